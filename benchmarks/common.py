@@ -0,0 +1,176 @@
+"""Shared fixtures and reporting for the benchmark suite."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+from __future__ import print_function
+
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+
+from timeit import default_timer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# Result set shapes: (rows, columns).
+TALL = (100000, 5)
+WIDE = (1000, 200)
+
+SEED = 1234
+
+DATABASE_TEMPLATE = """\
+identifier: "{name}"
+driver: "sqlite"
+connection:
+    database: "{path}"
+pool:
+    max_size: 16
+"""
+
+
+def create_fixture(path, tall=TALL, wide=WIDE):
+    """
+    Create the benchmark SQLite database at `path`.
+
+    Holds a `tall` table of many narrow rows and a `wide` table of fewer
+    rows with many columns, mixing integers, floats and text. Data is
+    generated from a fixed seed, so every run sees the same rows.
+    """
+    rng = random.Random(SEED)
+    connection = sqlite3.connect(path)
+    try:
+        for table, (nrows, ncols) in (("tall", tall), ("wide", wide)):
+            columns = ["c%d" % i for i in range(ncols)]
+            connection.execute("DROP TABLE IF EXISTS %s" % table)
+            connection.execute("CREATE TABLE %s (%s)" % (
+                table, ", ".join(columns)
+            ))
+            kinds = [i % 3 for i in range(ncols)]
+            rows = (
+                tuple(rng.randint(0, 1 << 30) if kind == 0 else
+                      rng.random() * 1000 if kind == 1 else
+                      "value-%08x" % rng.getrandbits(32)
+                      for kind in kinds)
+                for _ in range(nrows)
+            )
+            connection.executemany(
+                "INSERT INTO %s VALUES (%s)" % (
+                    table, ", ".join("?" * ncols)
+                ),
+                rows,
+            )
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def write_database_config(directory, name, path):
+    """Write a database YAML file pointing `name` at an SQLite file."""
+    with open(os.path.join(directory, "%s.yml" % name), "w") as f:
+        f.write(DATABASE_TEMPLATE.format(name=name, path=path))
+
+
+def measure(func, repeat=5, number=1):
+    """
+    Time `func`, returning the best of `repeat` runs of `number` calls.
+
+    :returns: Seconds per call.
+    :rtype: float
+    """
+    best = None
+    for _ in range(repeat):
+        start = default_timer()
+        for _ in range(number):
+            func()
+        elapsed = (default_timer() - start) / number
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = int(round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def environment():
+    """Describe the machine results were taken on."""
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "sqlite": sqlite3.sqlite_version,
+    }
+
+
+def higher_is_better(metric):
+    """Throughput metrics end in `_per_s`; everything else is a cost."""
+    return metric.endswith("_per_s")
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare results against a baseline.
+
+    :param results: Mapping of metric name to value.
+    :param baseline: A mapping loaded from a baseline file.
+    :param tolerance: Allowed relative slowdown, e.g. 0.2 for 20%.
+    :returns: (metric, baseline value, value, relative change) for every
+              metric that regressed beyond the tolerance.
+    :rtype: list(tuple)
+    """
+    regressions = []
+    for metric, old in sorted(baseline["results"].items()):
+        new = results.get(metric)
+        if new is None:
+            continue
+        if not old:
+            # e.g. errors appearing where the baseline had none.
+            if new > old and not higher_is_better(metric):
+                regressions.append((metric, old, new, float("inf")))
+            continue
+        change = (new - old) / float(old)
+        if higher_is_better(metric):
+            change = -change
+        if change > tolerance:
+            regressions.append((metric, old, new, change))
+    return regressions
+
+
+def save_baseline(path, results):
+    with open(path, "w") as f:
+        json.dump({"environment": environment(), "results": results},
+                  f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def load_baseline(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def report(results):
+    """Print results as an aligned table."""
+    width = max(len(metric) for metric in results)
+    for metric in sorted(results):
+        print("%-*s %14.6g" % (width, metric, results[metric]))
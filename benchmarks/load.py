@@ -0,0 +1,163 @@
+"""End-to-end HTTP load scenario against a local bridge server."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+from __future__ import print_function
+
+import json
+import os
+import resource
+import signal
+import subprocess
+import sys
+import threading
+
+from timeit import default_timer
+
+from benchmarks.common import ROOT, percentile, write_database_config
+
+from six.moves import http_client
+
+# name: (method, path, JSON body)
+SCENARIOS = [
+    ("point", "POST", "/query/bench",
+     {"sql": "SELECT * FROM tall WHERE rowid = %s", "params": [42]}),
+    ("page", "POST", "/query/bench?format=columnar",
+     {"sql": "SELECT * FROM wide LIMIT 50"}),
+    ("stream", "POST", "/query/bench?format=ndjson",
+     {"sql": "SELECT * FROM tall LIMIT 2000", "stream": True}),
+]
+
+APP_CONFIG = """\
+LEGACY_SUPPORT = True
+DATABASE_CONFIG_DIRECTORY = %r
+DATABASE_CONFIG_POLL_INTERVAL = 0
+LOG_FILE = %r
+"""
+
+SERVE = """\
+import logging
+import sys
+sys.path.insert(0, %r)
+logging.getLogger("werkzeug").setLevel(logging.ERROR)
+from werkzeug.serving import make_server
+from sql_json_bridge.app import create_app
+server = make_server("127.0.0.1", 0, create_app(), threaded=True)
+print(server.server_port)
+sys.stdout.flush()
+server.serve_forever()
+"""
+
+
+def start_server(directory, fixture):
+    """
+    Start the bridge in a child process, serving the fixture database.
+
+    :returns: The process and the port it listens on.
+    """
+    databases = os.path.join(directory, "databases")
+    if not os.path.isdir(databases):
+        os.mkdir(databases)
+    write_database_config(databases, "bench", fixture)
+    config = os.path.join(directory, "bridge.cfg")
+    with open(config, "w") as f:
+        f.write(APP_CONFIG % (databases, os.path.join(directory, "log")))
+    env = dict(os.environ, SQL_JSON_BRIDGE_CONFIG=config)
+    process = subprocess.Popen([sys.executable, "-c", SERVE % ROOT],
+                               stdout=subprocess.PIPE, env=env)
+    port = int(process.stdout.readline())
+    return process, port
+
+
+def stop_server(process):
+    """
+    Stop the server and return its peak resident set size in MB.
+
+    ru_maxrss covers waited-for children; it is in KB on Linux and bytes
+    on macOS.
+    """
+    process.send_signal(signal.SIGINT)
+    process.wait()
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    if sys.platform == "darwin":
+        peak /= 1024.0
+    return peak / 1024.0
+
+
+def client(port, scenario, deadline, latencies, errors):
+    _, method, path, body = scenario
+    payload = json.dumps(body)
+    headers = {"Content-Type": "application/json"}
+    while default_timer() < deadline:
+        connection = http_client.HTTPConnection("127.0.0.1", port)
+        start = default_timer()
+        try:
+            connection.request(method, path, payload, headers)
+            response = connection.getresponse()
+            response.read()
+            if response.status != 200:
+                errors.append(response.status)
+                continue
+        except Exception as e:
+            errors.append(str(e))
+            continue
+        finally:
+            connection.close()
+        latencies.append(default_timer() - start)
+
+
+def run_scenario(port, scenario, concurrency, duration):
+    latencies = []
+    errors = []
+    deadline = default_timer() + duration
+    threads = [threading.Thread(target=client,
+                                args=(port, scenario, deadline,
+                                      latencies, errors))
+               for _ in range(concurrency)]
+    start = default_timer()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = default_timer() - start
+    name = scenario[0]
+    if not latencies:
+        raise RuntimeError("Scenario %s failed: %r" % (name, errors[:5]))
+    latencies.sort()
+    return {
+        "http_%s_requests_per_s" % name: len(latencies) / elapsed,
+        "http_%s_p50_ms" % name: percentile(latencies, 0.5) * 1000,
+        "http_%s_p99_ms" % name: percentile(latencies, 0.99) * 1000,
+        "http_%s_errors" % name: len(errors),
+    }
+
+
+def run(directory, fixture, concurrency=8, duration=5.0):
+    """
+    Run every scenario against a fresh server process.
+
+    :returns: Throughput, p50 and p99 latency and errors per scenario,
+              and the server's peak RSS.
+    :rtype: dict
+    """
+    process, port = start_server(directory, fixture)
+    results = {}
+    try:
+        for scenario in SCENARIOS:
+            results.update(run_scenario(port, scenario, concurrency,
+                                        duration))
+    finally:
+        results["http_server_peak_rss_mb"] = stop_server(process)
+    return results
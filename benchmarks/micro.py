@@ -0,0 +1,118 @@
+"""Micro benchmarks: routing, driver round trips and serialization."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+from __future__ import print_function
+
+import os
+import re
+
+from benchmarks.common import measure, write_database_config
+
+from flask import Flask
+
+from sql_json_bridge.config import DbConfig
+from sql_json_bridge.responses import FORMAT_ALIASES, FORMATS, _encode, _write
+from sql_json_bridge.router import DatabaseRouter
+
+# Number of identifiers the routing benchmark resolves against.
+ROUTES = 500
+
+
+def bench_routing(results, repeat):
+    """Resolve names against `ROUTES` literal and regex identifiers."""
+    databases = {}
+    for n in range(ROUTES):
+        pattern = ("db%d" % n) if n % 2 else (r"shard%d-(\w+)" % n)
+        databases[re.compile(pattern)] = object()
+    router = DatabaseRouter(databases)
+    names = ["db%d" % n for n in range(1, ROUTES, 2)]
+    names += ["shard%d-x" % n for n in range(0, ROUTES, 2)]
+
+    def cached():
+        for name in names:
+            router.resolve(name)
+
+    def uncached():
+        for name in names:
+            router._resolve(name)
+
+    results["routing_cached_per_s"] = len(names) / measure(cached, repeat)
+    results["routing_uncached_per_s"] = (
+        len(names) / measure(uncached, repeat)
+    )
+
+
+def bench_driver(results, repeat, directory, fixture):
+    """Run queries through the SQLite driver and its connection pool."""
+    write_database_config(directory, "bench", fixture)
+    config = DbConfig(os.path.join(directory, "bench.yml"))
+    driver = config.driver
+    try:
+        def select_one():
+            columns, rows = driver.stream_rows("SELECT 1")
+            list(rows)
+
+        def fetch(table):
+            columns, rows = driver.stream_rows("SELECT * FROM %s" % table)
+            return sum(1 for _ in rows)
+
+        results["driver_select1_per_s"] = (
+            1 / measure(select_one, repeat, number=200)
+        )
+        for table in ("tall", "wide"):
+            nrows = fetch(table)
+            results["driver_fetch_%s_rows_per_s" % table] = (
+                nrows / measure(lambda: fetch(table), repeat)
+            )
+    finally:
+        config.close()
+
+
+def bench_serialization(results, repeat, directory, fixture):
+    """Serialize prefetched tall and wide results in every format."""
+    write_database_config(directory, "bench", fixture)
+    config = DbConfig(os.path.join(directory, "bench.yml"))
+    app = Flask("benchmarks")
+    app.config.from_object("sql_json_bridge.default_config")
+    names = dict((mimetype, alias) for alias, mimetype in
+                 FORMAT_ALIASES.items())
+    try:
+        for table in ("tall", "wide"):
+            columns, rows = config.driver.stream_rows(
+                "SELECT * FROM %s" % table
+            )
+            rows = list(rows)
+            for mimetype, fmt in FORMATS.items():
+                def serialize():
+                    return b"".join(_encode(piece) for piece in
+                                    _write(fmt, columns, rows))
+                with app.app_context():
+                    seconds = measure(serialize, repeat)
+                    size = len(serialize())
+                key = "serialize_%s_%s" % (names[mimetype], table)
+                results[key + "_rows_per_s"] = len(rows) / seconds
+                results[key + "_mb_per_s"] = size / seconds / 1e6
+    finally:
+        config.close()
+
+
+def run(repeat, directory, fixture):
+    """Run every micro benchmark, returning a dict of metrics."""
+    results = {}
+    bench_routing(results, repeat)
+    bench_driver(results, repeat, directory, fixture)
+    bench_serialization(results, repeat, directory, fixture)
+    return results
@@ -0,0 +1,106 @@
+"""
+Run the benchmark suite and compare it against a saved baseline.
+
+The suite runs offline against an SQLite fixture database, through the
+built-in "sqlite" driver:
+
+    micro   routing, driver round trips and per-format serialization
+            throughput for tall and wide result sets.
+    load    an end-to-end HTTP load test against a bridge server process,
+            reporting requests/s, p50/p99 latency and peak RSS.
+
+Usage::
+
+    python -m benchmarks.run                          # run and report
+    python -m benchmarks.run --save-baseline          # record a baseline
+    python -m benchmarks.run --compare --tolerance 0.2
+
+`--compare` exits non-zero if any metric is worse than the baseline by
+more than the tolerance. Baselines are machine specific; record one on
+the machine you compare on.
+"""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+from benchmarks import load, micro
+from benchmarks.common import (compare,
+                               create_fixture,
+                               load_baseline,
+                               report,
+                               save_baseline)
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "baseline.json")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().splitlines()[0]
+    )
+    parser.add_argument("--suite", choices=["all", "micro", "load"],
+                        default="all")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Runs per micro benchmark; the best counts.")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="Concurrent HTTP clients for the load test.")
+    parser.add_argument("--duration", type=float, default=5.0,
+                        help="Seconds per load scenario.")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE,
+                        help="Baseline file to save to or compare with.")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--compare", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed relative regression, e.g. 0.2.")
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp(prefix="bridge-bench-")
+    try:
+        fixture = os.path.join(directory, "bench.sqlite")
+        create_fixture(fixture)
+        results = {}
+        if args.suite in ("all", "micro"):
+            results.update(micro.run(args.repeat, directory, fixture))
+        if args.suite in ("all", "load"):
+            results.update(load.run(directory, fixture, args.concurrency,
+                                    args.duration))
+    finally:
+        shutil.rmtree(directory)
+
+    report(results)
+    if args.save_baseline:
+        save_baseline(args.baseline, results)
+        print("Saved baseline to %s" % args.baseline)
+    if args.compare:
+        regressions = compare(results, load_baseline(args.baseline),
+                              args.tolerance)
+        for metric, old, new, change in regressions:
+            print("REGRESSION %s: %.6g -> %.6g (%+.0f%%)" % (
+                metric, old, new, change * 100
+            ))
+        if regressions:
+            sys.exit(1)
+        print("No regressions beyond %.0f%%." % (args.tolerance * 100))
+
+
+if __name__ == "__main__":
+    main()
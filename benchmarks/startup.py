@@ -0,0 +1,150 @@
+"""
+Startup benchmark: time-to-ready with N database configs.
+
+Generates N database YAML files in a temporary directory and reports,
+for each N:
+
+    cold    seconds for a fresh interpreter to import the app modules and
+            load every config, i.e. time until the first request can be
+            served.
+    load    seconds to build a :py:class:`ConfigRegistry` in-process.
+    reload  seconds for a reload pass that finds nothing changed, which
+            the config poller runs every DATABASE_CONFIG_POLL_INTERVAL.
+    list    seconds to answer one /list from the loaded registry.
+
+Usage::
+
+    python benchmarks/startup.py -n 10 -n 100 -n 1000 --repeat 5
+"""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from timeit import default_timer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sql_json_bridge.registry import ConfigRegistry  # noqa: E402
+
+CONFIG_TEMPLATE = """\
+identifier: "db{n}-([a-z]+)"
+driver: "{driver}"
+connection:
+    host: "{{{{0}}}}.db{n}.example.com"
+    user: "bridge"
+    password: "secret"
+    db: "app"
+pool:
+    max_size: 4
+cache:
+    enabled: false
+"""
+
+COLD_START = """\
+import sys
+from timeit import default_timer
+start = default_timer()
+sys.path.insert(0, %r)
+import sql_json_bridge.app
+from sql_json_bridge.registry import ConfigRegistry
+registry = ConfigRegistry(%r)
+assert len(registry.databases) == %d
+print(default_timer() - start)
+"""
+
+
+def write_configs(directory, count, driver):
+    for n in range(count):
+        path = os.path.join(directory, "db%05d.yml" % n)
+        with open(path, "w") as f:
+            f.write(CONFIG_TEMPLATE.format(n=n, driver=driver))
+
+
+def best(func, repeat):
+    """Run `func` `repeat` times and return the fastest time in seconds."""
+    times = []
+    for _ in range(repeat):
+        start = default_timer()
+        func()
+        times.append(default_timer() - start)
+    return min(times)
+
+
+def cold_start(directory, count):
+    output = subprocess.check_output(
+        [sys.executable, "-c", COLD_START % (ROOT, directory, count)]
+    )
+    return float(output.decode("ascii").strip().splitlines()[-1])
+
+
+def run(count, repeat, driver):
+    directory = tempfile.mkdtemp(prefix="bridge-startup-")
+    try:
+        write_configs(directory, count, driver)
+        registry = ConfigRegistry(directory)
+
+        def list_databases():
+            sorted(identifier.pattern for identifier in registry.databases)
+
+        return {
+            "configs": count,
+            "cold": min(cold_start(directory, count)
+                        for _ in range(repeat)),
+            "load": best(lambda: ConfigRegistry(directory), repeat),
+            "reload": best(registry.reload, repeat),
+            "list": best(list_databases, repeat),
+        }
+    finally:
+        shutil.rmtree(directory)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-n", "--configs", type=int, action="append",
+                        help="Number of configs (repeatable).")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Runs per measurement; the best is reported.")
+    parser.add_argument("--driver", default="pymysql",
+                        help="Driver name written into the configs.")
+    parser.add_argument("--json", action="store_true",
+                        help="Print results as JSON.")
+    args = parser.parse_args(argv)
+
+    results = [run(count, args.repeat, args.driver)
+               for count in args.configs or [10, 100, 1000]]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print("%8s %10s %10s %10s %10s" % ("configs", "cold", "load",
+                                        "reload", "list"))
+    for result in results:
+        print("%8d %9.4fs %9.4fs %9.4fs %9.4fs" % (
+            result["configs"], result["cold"], result["load"],
+            result["reload"], result["list"],
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,440 @@
+"""ASGI application for SQL-HTTP-Bridge."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import asyncio
+import json
+import logging
+import os
+import weakref
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+from flask import Config
+
+from sql_json_bridge.aio.base import ThreadOffloadDriver, load_async_db_driver
+from sql_json_bridge.auth import Auth, Denied
+from sql_json_bridge.config import BoundDbConfig
+from sql_json_bridge.db_drivers.pool import PoolTimeout
+from sql_json_bridge.db_drivers.replicas import NoReplicaAvailable
+from sql_json_bridge.encoders import default, load_encoder
+from sql_json_bridge.extensions.cache import is_read_query
+from sql_json_bridge.fanout import listed_names
+from sql_json_bridge.limits import LimitExceeded
+from sql_json_bridge.registry import ConfigRegistry
+from sql_json_bridge.responses import (CHUNK_SIZE,
+                                       FORMAT_ALIASES,
+                                       FORMATS,
+                                       JSON,
+                                       META_HEADERS,
+                                       use_encoder)
+
+from werkzeug.datastructures import Headers
+
+LOG = logging.getLogger(__name__)
+
+TRUTHY = ('1', 'true', 'yes', 'on')
+
+
+def load_config():
+    """Load configuration the same way as the flask app does."""
+    config = Config(os.path.dirname(os.path.abspath(__file__)))
+    config.from_object('sql_json_bridge.default_config')
+    try:
+        config.from_envvar('SQL_JSON_BRIDGE_CONFIG')
+    except Exception:
+        pass
+    return config
+
+
+def negotiate_format(accept, name=None):
+    """
+    Pick a result format from an Accept header or explicit format name.
+
+    :returns: The chosen format, or None if nothing acceptable is offered.
+    """
+    if name:
+        return FORMATS.get(FORMAT_ALIASES.get(name, name))
+    if not accept:
+        return FORMATS[JSON]
+    ranked = []
+    for n, item in enumerate(accept.split(",")):
+        params = item.strip().split(";")
+        quality = 1.0
+        for param in params[1:]:
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            ranked.append((-quality, n, params[0].strip()))
+    for _, _, mimetype in sorted(ranked):
+        if mimetype in FORMATS:
+            return FORMATS[mimetype]
+        if mimetype in ("*/*", "application/*"):
+            return FORMATS[JSON]
+    return None
+
+
+class Request(object):
+    """The parts of an ASGI http request the bridge needs."""
+
+    def __init__(self, scope, body, disconnected=None):
+        self.method = scope["method"]
+        self.disconnected = disconnected or asyncio.Event()
+        self.path = scope["path"]
+        self.headers = Headers([
+            (k.decode("latin-1"), v.decode("latin-1"))
+            for k, v in scope.get("headers", ())
+        ])
+        self.values = dict(
+            parse_qsl(scope.get("query_string", b"").decode("latin-1"))
+        )
+        self.json = None
+        content_type = self.headers.get("content-type", "")
+        if content_type.startswith("application/json"):
+            try:
+                self.json = json.loads(body.decode("utf-8"))
+            except ValueError:
+                pass
+        elif content_type.startswith("application/x-www-form-urlencoded"):
+            self.values.update(parse_qsl(body.decode("utf-8")))
+
+    def param(self, name, default=None):
+        if isinstance(self.json, dict) and name in self.json:
+            return self.json[name]
+        return self.values.get(name, default)
+
+
+class AsyncBridge(object):
+    """
+    ASGI application serving the query, update and list endpoints.
+
+    Databases whose config names an `async_driver` (e.g. "aiomysql") use
+    that driver natively; all others run their regular driver through a
+    :py:class:`ThreadOffloadDriver` with `ASYNC_OFFLOAD_THREADS` threads.
+    Requests are authenticated and authorized like the flask app's, see
+    :py:class:`auth.Auth`.
+
+    :param config: Application configuration, see :py:func:`load_config`.
+    """
+
+    def __init__(self, config=None):
+        self.config = config if config is not None else load_config()
+        self.registry = ConfigRegistry(
+            self.config["DATABASE_CONFIG_DIRECTORY"],
+            self.config["DATABASE_ROUTER_CACHE_SIZE"],
+        )
+        self.registry.start(self.config["DATABASE_CONFIG_POLL_INTERVAL"])
+        use_encoder(load_encoder(self.config["JSON_ENCODER"]))
+        self.executor = ThreadPoolExecutor(
+            self.config["ASYNC_OFFLOAD_THREADS"]
+        )
+        self._drivers = weakref.WeakKeyDictionary()
+        self._offloaded = weakref.WeakKeyDictionary()
+        self.auth = Auth()
+        self.auth.configure(self.config)
+
+    def get_driver(self, config, args):
+        """Get the async driver for a resolved database."""
+        drivers = self._drivers.setdefault(config, {})
+        args = tuple(args)
+        driver = drivers.get(args)
+        if driver is None:
+            name = config.get("async_driver")
+            if name:
+                bound = BoundDbConfig(config, args) if args else config
+                driver = load_async_db_driver(name, bound)
+            else:
+                driver = ThreadOffloadDriver(config.get_driver(args),
+                                             self.executor)
+            drivers[args] = driver
+        return driver
+
+    def get_read_driver(self, config, args):
+        """
+        Get the async driver for a read-only query.
+
+        Reads against databases with replicas are spread across them.
+        Native async drivers always use the primary.
+        """
+        if config.get("async_driver") or config.get_replicas(args) is None:
+            return self.get_driver(config, args)
+        sync_driver = config.get_read_driver(args)
+        driver = self._offloaded.get(sync_driver)
+        if driver is None:
+            driver = ThreadOffloadDriver(sync_driver, self.executor)
+            self._offloaded[sync_driver] = driver
+        return driver
+
+    async def close(self):
+        self.registry.stop()
+        for drivers in list(self._drivers.values()):
+            for driver in drivers.values():
+                if not isinstance(driver, ThreadOffloadDriver):
+                    await driver.close()
+        self.executor.shutdown(wait=False)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] == "http":
+            body = b""
+            while True:
+                message = await receive()
+                body += message.get("body", b"")
+                if not message.get("more_body"):
+                    break
+            disconnected = asyncio.Event()
+            watcher = asyncio.ensure_future(
+                self.watch_disconnect(receive, disconnected)
+            )
+            try:
+                await self.dispatch(Request(scope, body, disconnected), send)
+            finally:
+                watcher.cancel()
+
+    async def watch_disconnect(self, receive, disconnected):
+        """Set `disconnected` once the client goes away."""
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                disconnected.set()
+                return
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def dispatch(self, request, send):
+        parts = request.path.strip("/").split("/")
+        query = len(parts) == 2 and parts[0] in ("query", "update")
+        if parts != ["list"] and not query:
+            return await self.respond(send, 404,
+                                      {"message": "404: Not Found"})
+        try:
+            key, identity = await self.authenticate(
+                request, parts[1] if query else None
+            )
+        except Denied as e:
+            return await self.respond(
+                send, e.status_code, {"ERROR": str(e)},
+                headers=[(k.lower(), v) for k, v in e.headers.items()],
+            )
+        if query:
+            await self.run_query(request, send, parts[1])
+        else:
+            await self.respond(send, 200, {
+                "databases": await self.list_databases(key, identity)
+            })
+
+    def offload(self, func, *args):
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(self.executor, func, *args)
+
+    async def authenticate(self, request, database_name=None):
+        """
+        Authenticate a request, and authorize it for a database if given.
+
+        Authenticators may block, e.g. on LDAP or fetching keys, so they
+        run on the offload executor.
+
+        :returns: A (cache key, identity) pair, or (None, None) if
+                  requests are not authenticated.
+        :raises auth.Denied: If the request may not proceed.
+        """
+        if self.auth.authenticator is None:
+            return None, None
+        return await self.offload(self.auth.verify, request, database_name)
+
+    async def list_databases(self, key, identity):
+        """List configured database identifiers an identity may use."""
+        databases = self.registry.databases
+        if self.auth.authenticator is None:
+            return sorted(identifier.pattern for identifier in databases)
+
+        def permitted():
+            return sorted(
+                identifier.pattern
+                for identifier, config in databases.items()
+                if any(self.auth.allows(key, identity, name)
+                       for name in listed_names(config))
+            )
+        return await self.offload(permitted)
+
+    async def respond(self, send, status, obj,
+                      content_type="application/json", headers=()):
+        body = json.dumps(obj, separators=(",", ":"), default=default)
+        raw_headers = [(b"content-type", content_type.encode("latin-1"))]
+        raw_headers.extend((k.encode("latin-1"), v.encode("latin-1"))
+                           for k, v in headers)
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": raw_headers,
+        })
+        await send({"type": "http.response.body",
+                    "body": body.encode("utf-8")})
+
+    async def run_query(self, request, send, database_name):
+        resolved = self.registry.resolve(database_name)
+        if resolved is None:
+            return await self.respond(
+                send, 404, {"ERROR": "Could not find matching database."}
+            )
+        db = self.get_driver(*resolved)
+        update = request.path.strip("/").startswith("update")
+
+        sql = request.param("sql")
+        if sql is None:
+            return await self.respond(
+                send, 400, {"ERROR": "SQL query missing from request."}
+            )
+        if (not update and is_read_query(sql) and
+                request.headers.get("x-bridge-read", "") != "primary"):
+            try:
+                db = self.get_read_driver(*resolved)
+            except NoReplicaAvailable as e:
+                return await self.respond(send, 503, {"ERROR": str(e)})
+        stream = request.param("stream", "")
+        if not isinstance(stream, bool):
+            stream = str(stream).lower() in TRUTHY
+        # Updates are committed before anything is written.
+        stream = stream and not update
+
+        params = request.param("params")
+        if params is not None and not isinstance(params, (list, dict)):
+            return await self.respond(
+                send, 400, {"ERROR": "Params must be an array or object."}
+            )
+
+        fmt = negotiate_format(request.headers.get("accept"),
+                               request.values.get("format"))
+        if fmt is None:
+            return await self.respond(
+                send, 406, {"ERROR": "No acceptable result format."}
+            )
+
+        limit = db.limits["max_rows"] or self.config["QUERY_MAX_ROWS"]
+        try:
+            if update:
+                columns, rows, rowcount = await db.run_update(sql, params)
+                meta = OrderedDict([("rows_matched", rowcount)])
+            elif stream:
+                columns, rows = await db.stream_rows(sql, params)
+            else:
+                columns, rows, more = await db.fetch_rows(sql, params, limit)
+                meta = OrderedDict([("rows_matched", len(rows)),
+                                    ("truncated", more)])
+        except NotImplementedError:
+            return await self.respond(
+                send, 501, {"ERROR": "Updates are not supported by this "
+                                     "database's async driver."}
+            )
+        except LimitExceeded as e:
+            return await self.respond(send, e.status_code, {"ERROR": str(e)},
+                                      headers=[("retry-after", "1")])
+        except PoolTimeout as e:
+            return await self.respond(send, 503, {"ERROR": str(e)})
+        except Exception as e:
+            return await self.respond(
+                send, 422, {"ERROR": ": ".join(str(i) for i in e.args)}
+            )
+
+        headers = [(b"content-type", fmt.mimetype.encode("latin-1"))]
+        if not stream:
+            headers.extend(
+                (META_HEADERS[key].lower().encode("latin-1"),
+                 (json.dumps(value) if isinstance(value, bool)
+                  else str(value)).encode("latin-1"))
+                for key, value in meta.items()
+            )
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": headers,
+        })
+        if stream:
+            await self.write_stream(send, fmt, columns, rows,
+                                    request.disconnected, limit)
+        else:
+            convert = fmt.converter(columns) or (lambda row: row)
+            pieces = [fmt.header(columns)]
+            pieces.extend(fmt.row(columns, convert(row), n == 0)
+                          for n, row in enumerate(rows))
+            pieces.append(fmt.footer(meta))
+            await send({"type": "http.response.body",
+                        "body": b"".join(_encode(p) for p in pieces)})
+
+    async def write_stream(self, send, fmt, columns, rows, disconnected,
+                           limit=None):
+        """
+        Write rows out in chunks as they arrive.
+
+        At most `limit` rows are written; the result is then flagged
+        `truncated`. If the client disconnects, or the limit is reached,
+        the rows are closed early, which cancels the query server side.
+        """
+        buf = [_encode(fmt.header(columns))]
+        size = len(buf[0])
+        convert = fmt.converter(columns)
+        meta = OrderedDict([("rows_matched", 0), ("truncated", False)])
+        try:
+            async for row in rows:
+                if disconnected.is_set():
+                    return
+                if limit is not None and meta["rows_matched"] >= limit:
+                    meta["truncated"] = True
+                    break
+                if convert is not None:
+                    row = convert(row)
+                piece = _encode(fmt.row(columns, row,
+                                        meta["rows_matched"] == 0))
+                meta["rows_matched"] += 1
+                buf.append(piece)
+                size += len(piece)
+                if size >= CHUNK_SIZE:
+                    await send({"type": "http.response.body",
+                                "body": b"".join(buf), "more_body": True})
+                    buf, size = [], 0
+        except Exception as e:
+            LOG.exception("Streaming query failed.")
+            buf.append(_encode(fmt.error(": ".join(str(i) for i in e.args))))
+        else:
+            buf.append(_encode(fmt.footer(meta)))
+        finally:
+            await rows.aclose()
+        await send({"type": "http.response.body", "body": b"".join(buf)})
+
+
+def _encode(piece):
+    if isinstance(piece, str):
+        return piece.encode("utf-8")
+    return piece
+
+
+def create_asgi_app(config=None):
+    """Create the ASGI app, e.g. `uvicorn --factory ...:create_asgi_app`."""
+    return AsyncBridge(config)
@@ -0,0 +1,249 @@
+"""Asynchronous database driver interface."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import abc
+import asyncio
+import itertools
+
+from stevedore import driver
+
+from sql_json_bridge.limits import QueueFull, QueueTimeout, load_limits
+
+# Rows pulled from a blocking driver per hop to the executor.
+OFFLOAD_BATCH_SIZE = 500
+
+
+def load_async_db_driver(driver_name, database_config):
+    """
+    Load an instance of an asynchronous database driver.
+
+    These drivers should exist in the
+    "sql_json_bridge.ext.async_database_driver" namespace.
+
+    :param driver_name: The name of the driver to be loaded.
+    :type driver_name: str
+    :param database_config: Configuration of the database.
+    :returns: A database object.
+    :rtype: :py:class:AsyncDatabaseDriver
+    """
+    mgr = driver.DriverManager(
+        namespace="sql_json_bridge.ext.async_database_driver",
+        name=driver_name,
+        invoke_on_load=True,
+        invoke_args=(database_config,),
+    )
+    return mgr.driver
+
+
+class AsyncBulkhead(object):
+    """
+    Asyncio counterpart of :py:class:`limits.Bulkhead`.
+
+    Queued callers wait on the event loop rather than in a thread.
+    """
+
+    def __init__(self, max_concurrent, max_queue=0, queue_timeout=None):
+        self.max_queue = int(max_queue or 0)
+        self.queue_timeout = queue_timeout
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(int(max_concurrent))
+
+    async def acquire(self):
+        """Take a slot, waiting in the queue if none is free."""
+        if not self._semaphore.locked():
+            await self._semaphore.acquire()
+            return
+        if self.waiting >= self.max_queue:
+            raise QueueFull("Too many queries queued for this database.")
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(),
+                                   self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise QueueTimeout("Timed out waiting for a query slot.")
+        finally:
+            self.waiting -= 1
+
+    def release(self):
+        """Give a slot back."""
+        self._semaphore.release()
+
+
+class AsyncDatabaseDriver(metaclass=abc.ABCMeta):
+    """
+    Modular stevedore Driver MetaClass for accessing databases from asyncio.
+
+    This mirrors :py:class:`DatabaseDriver` with coroutine methods. Should be
+    installed with a "sql_json_bridge.ext.async_database_driver" entrypoint.
+    The `limits` section of the database config is honoured the same way,
+    with queries waiting for a slot on the event loop.
+    """
+
+    def __init__(self, database_config):
+        self.config = database_config
+        self.limits = load_limits(database_config)
+        self.bulkhead = None
+        if self.limits["max_concurrent"]:
+            self.bulkhead = AsyncBulkhead(self.limits["max_concurrent"],
+                                          self.limits["max_queue"],
+                                          self.limits["queue_timeout"])
+
+    @abc.abstractmethod
+    async def iter_rows(self, query_string, params=None):
+        """
+        Run a Query, yielding its column names followed by tuple rows.
+
+        This is an asynchronous generator. The first item yielded is the
+        list of column names; every following item is one row as a tuple.
+
+        :param query_string: Query to be ran against the database.
+        :type query_string: str
+        :param params: Bind parameters for the query, if any.
+        """
+        raise NotImplementedError
+        yield
+
+    async def stream_rows(self, query_string, params=None):
+        """
+        Run a Query, returning its columns and an async generator of rows.
+
+        The query is executed before this returns. Callers must exhaust or
+        close the generator to release its connection and query slot.
+
+        :rtype: tuple(list, async generator)
+        :raises limits.LimitExceeded: If no query slot is available.
+        """
+        rows = self.limited_rows(query_string, params)
+        columns = await rows.__anext__()
+        return columns, rows
+
+    async def limited_rows(self, query_string, params=None):
+        """`iter_rows`, holding a query slot until the rows are done."""
+        if self.bulkhead is not None:
+            await self.bulkhead.acquire()
+        rows = self.iter_rows(query_string, params)
+        try:
+            async for item in rows:
+                yield item
+        finally:
+            await rows.aclose()
+            if self.bulkhead is not None:
+                self.bulkhead.release()
+
+    async def run_query(self, query_string, params=None):
+        """
+        Run a Query against the database and fetch every row.
+
+        :returns: A (columns, rows) pair.
+        :rtype: tuple(list, list)
+        """
+        columns, rows = await self.stream_rows(query_string, params)
+        return columns, [row async for row in rows]
+
+    async def fetch_rows(self, query_string, params=None, limit=None):
+        """
+        Run a Query and read up to `limit` rows of its result.
+
+        One row past the limit is read, to tell whether more follow; the
+        rest of the query is then cancelled.
+
+        :returns: A (columns, rows, more) tuple.
+        :rtype: tuple(list, list, bool)
+        """
+        columns, rows = await self.stream_rows(query_string, params)
+        fetched = []
+        try:
+            async for row in rows:
+                fetched.append(row)
+                if limit is not None and len(fetched) > limit:
+                    return columns, fetched[:limit], True
+            return columns, fetched, False
+        finally:
+            await rows.aclose()
+
+    async def run_update(self, query_string, params=None):
+        """
+        Run a statement against the database and commit it.
+
+        :returns: A (columns, rows, rowcount) tuple.
+        :raises NotImplementedError: If the driver cannot write.
+        """
+        raise NotImplementedError
+
+    async def close(self):
+        """Close any connections held by this driver."""
+
+
+class ThreadOffloadDriver(AsyncDatabaseDriver):
+    """
+    Adapter running a blocking :py:class:`DatabaseDriver` in a thread pool.
+
+    Used for drivers without a native asyncio library, such as pymssql.
+    The event loop never blocks on the database, but each in-flight query
+    still occupies an executor thread.
+
+    :param sync_driver: The blocking driver to wrap.
+    :param executor: The executor to offload calls to.
+    """
+
+    def __init__(self, sync_driver, executor):
+        super().__init__(sync_driver.config)
+        self.driver = sync_driver
+        self.executor = executor
+
+    def _run(self, func, *args):
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(self.executor, func, *args)
+
+    async def iter_rows(self, query_string, params=None):
+        columns, rows = await self._run(self.driver.stream_rows,
+                                        query_string, params)
+        try:
+            yield columns
+            while True:
+                batch = await self._run(
+                    list, itertools.islice(rows, OFFLOAD_BATCH_SIZE)
+                )
+                for row in batch:
+                    yield row
+                if len(batch) < OFFLOAD_BATCH_SIZE:
+                    break
+        finally:
+            await self._run(rows.close)
+
+    async def fetch_rows(self, query_string, params=None, limit=None):
+        # One hop to the executor rather than one per batch of rows.
+        if self.bulkhead is not None:
+            await self.bulkhead.acquire()
+        try:
+            return await self._run(self.driver.fetch_rows, query_string,
+                                   params, limit)
+        finally:
+            if self.bulkhead is not None:
+                self.bulkhead.release()
+
+    async def run_update(self, query_string, params=None):
+        if self.bulkhead is not None:
+            await self.bulkhead.acquire()
+        try:
+            return await self._run(self.driver.run_update, query_string,
+                                   params)
+        finally:
+            if self.bulkhead is not None:
+                self.bulkhead.release()
+
+    async def close(self):
+        await self._run(self.driver.close)
@@ -0,0 +1,172 @@
+"""Asynchronous MySQL driver built on aiomysql."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import asyncio
+import logging
+
+import aiomysql
+
+from sql_json_bridge.aio.base import AsyncDatabaseDriver
+from sql_json_bridge.db_drivers.pool import DEFAULT_POOL_OPTIONS
+from sql_json_bridge.db_drivers.pymysql import COLUMN_KINDS
+from sql_json_bridge.encoders import Columns
+from sql_json_bridge.limits import CANCEL_GRACE
+
+LOG = logging.getLogger(__name__)
+
+
+class AioMySQLDriver(AsyncDatabaseDriver):
+    """
+    Asynchronous driver for MySQL Databases.
+
+    This driver requires the aiomysql library, and takes the same
+    `connection` dictionary as :py:class:`MySQLDriver`. The `pool` section
+    is honoured as far as aiomysql supports it: `min_size`, `max_size` and
+    `max_lifetime` (as `pool_recycle`). Statements overrunning the
+    `statement_timeout` in `limits` are stopped with `KILL QUERY`.
+    """
+
+    def __init__(self, database_config):
+        super().__init__(database_config)
+        self._pool = None
+        self._pool_lock = asyncio.Lock()
+
+    async def pool(self):
+        """Return the aiomysql pool, creating it on first use."""
+        if self._pool is None:
+            async with self._pool_lock:
+                if self._pool is None:
+                    options = dict(DEFAULT_POOL_OPTIONS)
+                    options.update(self.config.get("pool") or {})
+                    self._pool = await aiomysql.create_pool(
+                        minsize=options["min_size"],
+                        maxsize=options["max_size"],
+                        pool_recycle=options["max_lifetime"] or -1,
+                        **self.config["connection"]
+                    )
+        return self._pool
+
+    async def cancel(self, conn):
+        """
+        Stop the statement running on a connection with `KILL QUERY`.
+
+        :returns: True if the kill was sent.
+        """
+        options = dict(self.config["connection"])
+        options.setdefault("connect_timeout", CANCEL_GRACE)
+        try:
+            killer = await aiomysql.connect(**options)
+            try:
+                async with killer.cursor() as cur:
+                    await cur.execute("KILL QUERY %d" % conn.thread_id())
+            finally:
+                killer.close()
+        except Exception:
+            LOG.exception("Could not cancel statement.")
+            return False
+        return True
+
+    async def iter_rows(self, query_string, params=None):
+        """
+        Run a query against a MySQL database, yielding rows as they arrive.
+
+        Rows are read through an unbuffered `SSCursor`. If the generator is
+        closed before the last row, the query is killed rather than
+        drained.
+        """
+        pool = await self.pool()
+        async with pool.acquire() as conn:
+            cur = await conn.cursor(aiomysql.SSCursor)
+            cancelled = False
+            try:
+                await self.execute(conn, cur, query_string, params)
+                description = cur.description or ()
+                yield Columns([column[0] for column in description],
+                              [COLUMN_KINDS.get(column[1])
+                               for column in description])
+                while True:
+                    row = await cur.fetchone()
+                    if row is None:
+                        break
+                    yield row
+            except GeneratorExit:
+                cancelled = await self.cancel(conn)
+                raise
+            finally:
+                try:
+                    await cur.close()
+                    await conn.rollback()
+                except aiomysql.Error:
+                    if not cancelled:
+                        raise
+                    # Reading the rest of a killed query fails; close the
+                    # connection so the pool drops it.
+                    conn.close()
+
+    async def run_update(self, query_string, params=None):
+        """
+        Run a statement on a pooled connection and commit it.
+
+        The transaction is rolled back only if the statement fails.
+        """
+        if self.bulkhead is not None:
+            await self.bulkhead.acquire()
+        try:
+            pool = await self.pool()
+            async with pool.acquire() as conn:
+                cur = await conn.cursor()
+                try:
+                    await self.execute(conn, cur, query_string, params)
+                    description = cur.description
+                    if description is None:
+                        result = Columns(), [], cur.rowcount
+                    else:
+                        result = (
+                            Columns([column[0] for column in description],
+                                    [COLUMN_KINDS.get(column[1])
+                                     for column in description]),
+                            list(await cur.fetchall()),
+                            cur.rowcount,
+                        )
+                    await conn.commit()
+                    return result
+                except Exception:
+                    await conn.rollback()
+                    raise
+                finally:
+                    await cur.close()
+        finally:
+            if self.bulkhead is not None:
+                self.bulkhead.release()
+
+    async def execute(self, conn, cur, query_string, params=None):
+        """Execute a statement, killing it after `statement_timeout`."""
+        timeout = self.limits["statement_timeout"]
+        timer = None
+        if timeout:
+            timer = asyncio.get_event_loop().call_later(
+                timeout, lambda: asyncio.ensure_future(self.cancel(conn))
+            )
+        try:
+            await cur.execute(query_string, params)
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+    async def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            await self._pool.wait_closed()
@@ -16,11 +16,22 @@
 
 import logging
 
-from logging.handlers import FileHandler
+from concurrent.futures import ThreadPoolExecutor
+from logging import FileHandler
 
 from flask import Flask, jsonify
 
-from sql_json_bridge.config import load_database_configs
+from sql_json_bridge.auth import auth
+from sql_json_bridge.extensions.cache import result_cache
+from sql_json_bridge.extensions.changes import change_feeds
+from sql_json_bridge.extensions.compression import response_compression
+from sql_json_bridge.extensions.cursors import open_cursors
+from sql_json_bridge.extensions.jobs import jobs
+from sql_json_bridge.extensions.metrics import request_metrics
+from sql_json_bridge.extensions.schema import schema_cache
+from sql_json_bridge.encoders import load_encoder
+from sql_json_bridge.registry import ConfigRegistry
+from sql_json_bridge.responses import BridgeJSONEncoder, use_encoder
 
 from werkzeug.exceptions import HTTPException
 from werkzeug.exceptions import default_exceptions
@@ -59,16 +70,42 @@ def configure_app(app):
     except:
         pass
 
-    app.config["DATABASES"] = load_database_configs(
-        app.config["DATABASE_CONFIG_LOCATION"]
+    registry = ConfigRegistry(
+        app.config["DATABASE_CONFIG_DIRECTORY"],
+        app.config["DATABASE_ROUTER_CACHE_SIZE"],
     )
+    registry.start(app.config["DATABASE_CONFIG_POLL_INTERVAL"])
+    app.config["DATABASE_REGISTRY"] = registry
+
+    app.json_encoder = BridgeJSONEncoder
+    use_encoder(load_encoder(app.config["JSON_ENCODER"]))
 
     if app.config["LEGACY_SUPPORT"]:
         from sql_json_bridge.legacy.views import legacy
         DEFAULT_BLUEPRINTS.append(legacy)
 
-    for code in default_exceptions.iterkeys():
-        app.error_handler_spec[None][code] = make_json_error
+    for code in default_exceptions:
+        app.register_error_handler(code, make_json_error)
+
+
+def configure_extensions(app):
+    """Initialize flask extensions."""
+    auth.init_app(app)
+    result_cache.init_app(app)
+    open_cursors.init_app(app)
+    jobs.init_app(app)
+    schema_cache.init_app(app)
+    change_feeds.init_app(app)
+    request_metrics.init_app(app)
+    # After metrics, so its hook runs first and metrics count the
+    # compressed size.
+    response_compression.init_app(app)
+    app.extensions["batch_executor"] = ThreadPoolExecutor(
+        app.config["BATCH_MAX_WORKERS"]
+    )
+    app.extensions["fanout_executor"] = ThreadPoolExecutor(
+        app.config["FANOUT_MAX_WORKERS"]
+    )
 
 
 def configure_logging(app):
@@ -93,6 +130,7 @@ def create_app(app_name=None, blueprints=None):
     app = Flask(app_name)
 
     configure_app(app)
+    configure_extensions(app)
     configure_logging(app)
 
     configure_blueprints(app, blueprints)
@@ -1,4 +1,4 @@
-"""Main View for Database queries and listing."""
+"""Pluggable authentication and authorization of requests."""
 # Copyright (C) 2016 Russell Troxel
 
 # This program is free software: you can redistribute it and/or modify
@@ -14,40 +14,319 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>
 
+import hashlib
+import importlib
+import logging
+import threading
+import time
+
+from collections import OrderedDict
 from functools import wraps
 
+from flask import g, jsonify, request
+
+from sql_json_bridge.auth.base import AuthenticationFailed
+
 from stevedore import driver
 
+import six
+
+LOG = logging.getLogger(__name__)
 
-def load_authenticator(driver_name, configuration_details):
+# Authenticators shipped with the bridge that need no entry point, by name.
+BUILTIN_AUTHENTICATORS = {
+    "api_key": "sql_json_bridge.auth.api_key:ApiKeyAuthenticator",
+    "jwt": "sql_json_bridge.auth.jwt_auth:JWTAuthenticator",
+}
+
+
+def load_authenticator(authenticator_name, options):
     """
-    Load an instance of a database driver.
+    Load an instance of an authenticator.
 
-    These drivers should exist in the "sql_json_bridge.ext.database_driver"
-    namespace, and should have short, readable names. For example, "mssql",
-    "sqlalchemy", or "mysql_safemode".
+    "api_key" and "jwt" are built in; other authenticators, e.g. for LDAP,
+    should exist in the "sql_json_bridge.ext.authenticator" namespace.
 
-    :param driver_name: The name of the driver to be loaded.
-    :type driver_name: str
-    :param connection_details: Connection details to be used for the
-                               database. These vary on a driver by driver
-                               basis.
-    :type connection_details:  dict
-    :returns: A database object.
-    :rtype: :py:class:base.DatabaseDriver
+    :param authenticator_name: The name of the authenticator to be loaded.
+    :type authenticator_name: str
+    :param options: Keyword options for the authenticator.
+    :type options: dict
+    :rtype: :py:class:base.Authenticator
     """
+    if authenticator_name in BUILTIN_AUTHENTICATORS:
+        module, _, name = BUILTIN_AUTHENTICATORS[
+            authenticator_name
+        ].partition(":")
+        return getattr(importlib.import_module(module), name)(**options)
     mgr = driver.DriverManager(
-        namespace="sql_json_bridge.ext.database_driver",
-        name=driver_name,
+        namespace="sql_json_bridge.ext.authenticator",
+        name=authenticator_name,
         invoke_on_load=True,
-        invoke_args=(configuration_details),
+        invoke_kwds=options,
     )
     return mgr.driver
 
 
+class DecisionCache(object):
+    """
+    In-process LRU cache of authentication and authorization results.
+
+    :param max_entries: Most entries kept; least recently used entries
+                        are evicted beyond it.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Fetch a result.
+
+        :returns: The result, or None on a miss or expired entry.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self._entries[key]
+                return None
+            # Re-insert to mark the entry as most recently used.
+            del self._entries[key]
+            self._entries[key] = entry
+            return entry[0]
+
+    def set(self, key, value, ttl):
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, time.time() + ttl)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class Denied(Exception):
+    """
+    Raised by :py:class:`Auth` for requests that may not proceed.
+
+    :ivar status_code: The HTTP status to answer the request with.
+    :ivar headers: Extra response headers, e.g. `WWW-Authenticate`.
+    """
+
+    def __init__(self, message, status_code, headers=None):
+        super(Denied, self).__init__(message)
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class Auth(object):
+    """
+    Authenticate requests with a configured authenticator.
+
+    `AUTH_BACKEND` names the authenticator, see
+    :py:func:`load_authenticator`, and `AUTH_OPTIONS` are passed to it.
+    Without one, requests are not authenticated.
+
+    Verified credentials are cached for `AUTH_CACHE_TTL` seconds, or until
+    they expire if sooner, and rejected ones for `AUTH_NEGATIVE_CACHE_TTL`
+    seconds, so a remote authenticator is asked once per credential and
+    TTL rather than once per request, and a client retrying bad
+    credentials cannot flood it. Whether an identity may use a database
+    is cached the same way. Credentials are cached by their SHA-256
+    digest, and at most `AUTH_CACHE_MAX_ENTRIES` results are kept.
+
+    :py:meth:`verify` and :py:meth:`permit` work on any request with
+    `headers`, and are shared with the ASGI app; the other checks answer
+    the current flask request.
+    """
+
+    def __init__(self, app=None):
+        self.authenticator = None
+        self.ttl = 60
+        self.negative_ttl = 5
+        self.identities = DecisionCache()
+        self.decisions = DecisionCache()
+        self.app = app
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.configure(app.config)
+
+    def configure(self, config):
+        """Set up from an application config."""
+        backend = config.get("AUTH_BACKEND")
+        self.authenticator = None
+        if backend is not None:
+            self.authenticator = load_authenticator(
+                backend, config.get("AUTH_OPTIONS") or {}
+            )
+        self.ttl = config.get("AUTH_CACHE_TTL", 60)
+        self.negative_ttl = config.get("AUTH_NEGATIVE_CACHE_TTL", 5)
+        max_entries = config.get("AUTH_CACHE_MAX_ENTRIES", 10000)
+        self.identities = DecisionCache(max_entries)
+        self.decisions = DecisionCache(max_entries)
+
+    def authenticate(self, credentials):
+        """
+        Verify credentials, through the cache.
+
+        :returns: A (cache key, identity) pair.
+        :raises AuthenticationFailed: If the credentials are rejected.
+        """
+        key = hashlib.sha256(credentials.encode("utf-8")).hexdigest()
+        result = self.identities.get(key)
+        if result is None:
+            try:
+                result = self.authenticator.authenticate(credentials)
+            except AuthenticationFailed as e:
+                # Rejections are cached as their message.
+                self.identities.set(key, str(e), self.negative_ttl)
+                raise
+            ttl = self.ttl
+            if result.expires is not None:
+                ttl = min(ttl, result.expires - time.time())
+            self.identities.set(key, result, ttl)
+        if isinstance(result, six.string_types):
+            raise AuthenticationFailed(result)
+        return key, result
+
+    def authorize(self, key, identity, database_name):
+        """
+        Decide whether an identity may use a database, through the cache.
+
+        :param key: The identity's cache key, from :py:meth:`authenticate`.
+        :rtype: bool
+        """
+        decision = self.decisions.get((key, database_name))
+        if decision is None:
+            decision = bool(
+                self.authenticator.authorize(identity, database_name)
+            )
+            self.decisions.set(
+                (key, database_name), decision,
+                self.ttl if decision else self.negative_ttl,
+            )
+        return decision
+
+    def verify(self, request, database_name=None):
+        """
+        Authenticate a request, and authorize it for a database if given.
+
+        :param request: A request with case-insensitive `headers`.
+        :returns: A (cache key, identity) pair, or (None, None) if
+                  requests are not authenticated.
+        :raises Denied: If the request may not proceed.
+        """
+        if self.authenticator is None:
+            return None, None
+        credentials = self.authenticator.credentials(request)
+        if not credentials:
+            raise self.unauthorized("Credentials missing from request.")
+        try:
+            key, identity = self.authenticate(credentials)
+        except AuthenticationFailed as e:
+            raise self.unauthorized(str(e))
+        except Exception:
+            LOG.exception("Authenticator failed.")
+            raise Denied("Authentication is unavailable.", 503)
+        if database_name is not None:
+            self.permit(key, identity, database_name)
+        return key, identity
+
+    def permit(self, key, identity, database_name):
+        """
+        Check that an identity may use a database.
+
+        :raises Denied: If it may not, or authorization is unavailable.
+        """
+        if self.authenticator is None:
+            return
+        try:
+            allowed = self.authorize(key, identity, database_name)
+        except Exception:
+            LOG.exception("Authorizer failed.")
+            raise Denied("Authorization is unavailable.", 503)
+        if not allowed:
+            raise Denied(
+                "Forbidden to access database %s." % database_name, 403
+            )
+
+    def allows(self, key, identity, database_name):
+        """Whether an identity may use a database, e.g. to list it."""
+        try:
+            self.permit(key, identity, database_name)
+        except Denied:
+            return False
+        return True
+
+    def unauthorized(self, message):
+        return Denied(message, 401, {
+            "WWW-Authenticate": self.authenticator.challenge,
+        })
+
+    def check(self, database_name=None):
+        """
+        Authenticate the current request, storing its identity in
+        `g.identity`.
+
+        :param database_name: A database the request uses, if known.
+        :returns: An error response, or None if the request may proceed.
+        """
+        if self.authenticator is None:
+            return None
+        try:
+            g.auth_key, g.identity = self.verify(request, database_name)
+        except Denied as e:
+            return denied_response(e)
+        return None
+
+    def forbidden(self, database_name):
+        """
+        Check that the current request's identity may use a database.
+
+        :returns: An error response, or None if it may.
+        """
+        if self.authenticator is None:
+            return None
+        try:
+            self.permit(g.auth_key, g.identity, database_name)
+        except Denied as e:
+            return denied_response(e)
+        return None
+
+    def permits(self, database_name):
+        """Whether the current request's identity may use a database."""
+        if self.authenticator is None:
+            return True
+        return self.allows(g.auth_key, g.identity, database_name)
+
+
+def denied_response(denied):
+    """Answer a request with a :py:class:`Denied` error."""
+    return jsonify(ERROR=str(denied)), denied.status_code, denied.headers
+
+
+auth = Auth()
+
+
 def requires_auth(f):
+    """
+    Authenticate requests to a view, see :py:class:`Auth`.
+
+    Views taking a `database_name` are also authorized for it.
+    """
     @wraps(f)
     def decorated(*args, **kwargs):
-        pass
+        error = auth.check(kwargs.get("database_name"))
+        if error is not None:
+            return error
         return f(*args, **kwargs)
     return decorated
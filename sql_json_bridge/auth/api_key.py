@@ -0,0 +1,74 @@
+"""Authentication by static API keys."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import hashlib
+
+from sql_json_bridge.auth.base import (AuthenticationFailed,
+                                       Authenticator,
+                                       Identity)
+
+# Prefix of keys given by their SHA-256 digest rather than in the clear.
+DIGEST_PREFIX = "sha256:"
+
+
+def key_digest(key):
+    """Hex SHA-256 digest of an API key."""
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class ApiKeyAuthenticator(Authenticator):
+    """
+    Check API keys against a fixed set, sent in `X-API-Key` or as bearer
+    tokens.
+
+    Keys are configured in `AUTH_OPTIONS`, either in the clear or, to
+    keep them out of the config file, as "sha256:" and their hex digest::
+
+        AUTH_OPTIONS = {"keys": {
+            "sha256:9f86d0...": {"name": "reports",
+                                 "databases": ["reporting_*"]},
+        }}
+
+    `databases` is optional, and defaults to every database.
+
+    :param keys: Key descriptions by key.
+    :param header: Header carrying the key, besides `Authorization`.
+    """
+
+    def __init__(self, keys=None, header="X-API-Key", **options):
+        super(ApiKeyAuthenticator, self).__init__(**options)
+        self.header = header
+        self.keys = {}
+        for key, spec in (keys or {}).items():
+            if key.startswith(DIGEST_PREFIX):
+                digest = key[len(DIGEST_PREFIX):].lower()
+            else:
+                digest = key_digest(key)
+            spec = spec or {}
+            self.keys[digest] = Identity(spec.get("name", digest[:8]),
+                                         spec.get("databases"))
+
+    def credentials(self, request):
+        key = request.headers.get(self.header)
+        if key:
+            return key
+        return super(ApiKeyAuthenticator, self).credentials(request)
+
+    def authenticate(self, credentials):
+        identity = self.keys.get(key_digest(credentials))
+        if identity is None:
+            raise AuthenticationFailed("Invalid API key.")
+        return identity
@@ -0,0 +1,112 @@
+"""Base classes for authenticators."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import abc
+import fnmatch
+
+import six
+
+
+class AuthenticationFailed(Exception):
+    """Raised by authenticators for credentials they reject."""
+
+
+class Identity(object):
+    """
+    Who a request was made by, once its credentials are verified.
+
+    :param name: A name for the caller, e.g. a user name or key name.
+    :param databases: Shell-style patterns of the database names the
+                      caller may use, e.g. ["shard_*"], or None for all.
+    :param expires: When the credentials expire, as a UNIX timestamp, or
+                    None if they do not.
+    """
+
+    __slots__ = ("name", "databases", "expires")
+
+    def __init__(self, name, databases=None, expires=None):
+        self.name = name
+        self.databases = databases
+        self.expires = expires
+
+    def may_access(self, database_name):
+        """Whether `databases` allows a database name."""
+        if self.databases is None:
+            return True
+        return any(fnmatch.fnmatchcase(database_name, pattern)
+                   for pattern in self.databases)
+
+
+@six.add_metaclass(abc.ABCMeta)
+class Authenticator(object):
+    """
+    Modular stevedore authenticator.
+
+    Should be installed with a "sql_json_bridge.ext.authenticator"
+    entrypoint. Authenticators may be slow, e.g. calling out to LDAP:
+    their results are cached by :py:class:`auth.Auth`, so they run once
+    per credential and TTL rather than once per request.
+
+    :param options: Authenticator-specific options, from `AUTH_OPTIONS`.
+    """
+
+    # Sent in `WWW-Authenticate` with 401 responses.
+    challenge = "Bearer"
+
+    def __init__(self, **options):
+        self.options = options
+
+    def credentials(self, request):
+        """
+        Read the credentials a request carries.
+
+        By default, a bearer token from the `Authorization` header.
+
+        :param request: The flask request, or the ASGI app's.
+        :returns: The credentials as a string, or None if there are none.
+        """
+        scheme, _, token = request.headers.get(
+            "Authorization", ""
+        ).partition(" ")
+        if scheme.lower() != "bearer":
+            return None
+        return token.strip() or None
+
+    @abc.abstractmethod
+    def authenticate(self, credentials):
+        """
+        Verify credentials.
+
+        :param credentials: As returned by :py:meth:`credentials`.
+        :type credentials: str
+        :rtype: :py:class:Identity
+        :raises AuthenticationFailed: If the credentials are rejected.
+                                      Other errors are taken to mean the
+                                      authenticator is unavailable, and
+                                      are not cached.
+        """
+        raise NotImplementedError
+
+    def authorize(self, identity, database_name):
+        """
+        Decide whether an identity may use a database.
+
+        :param identity: As returned by :py:meth:`authenticate`.
+        :type identity: :py:class:Identity
+        :param database_name: The requested database name.
+        :rtype: bool
+        """
+        return identity.may_access(database_name)
@@ -0,0 +1,115 @@
+"""Authentication by JSON Web Tokens, verified locally."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+from sql_json_bridge.auth.base import (AuthenticationFailed,
+                                       Authenticator,
+                                       Identity)
+
+try:
+    import jwt
+except ImportError:
+    jwt = None
+
+
+class JWTAuthenticator(Authenticator):
+    """
+    Verify bearer JSON Web Tokens with PyJWT.
+
+    Tokens are checked against `key`, a shared secret or PEM public key,
+    or against the key named by their `kid` header in `keys` or in the
+    JSON Web Key Set at `jwks_url`. A key set is fetched once and kept
+    for `jwks_ttl` seconds, so tokens are verified without calling the
+    issuer::
+
+        AUTH_OPTIONS = {"jwks_url": "https://issuer/.well-known/jwks.json",
+                        "audience": "sql-json-bridge"}
+
+    The identity is named by the `sub` claim, and a `databases` claim
+    may list patterns of the databases it may use.
+
+    :param algorithms: Accepted signing algorithms.
+    :param audience: Required `aud` claim, if any.
+    :param issuer: Required `iss` claim, if any.
+    :param leeway: Seconds of clock skew allowed when checking `exp`.
+    :param name_claim: Claim naming the identity.
+    :param databases_claim: Claim listing the identity's databases.
+    """
+
+    def __init__(self, key=None, keys=None, jwks_url=None, jwks_ttl=300,
+                 algorithms=("RS256",), audience=None, issuer=None,
+                 leeway=0, name_claim="sub", databases_claim="databases",
+                 **options):
+        if jwt is None:
+            raise RuntimeError(
+                "The jwt authenticator requires the PyJWT package."
+            )
+        super(JWTAuthenticator, self).__init__(**options)
+        if key is None and not keys and jwks_url is None:
+            raise ValueError("The jwt authenticator needs a key, keys or "
+                             "jwks_url.")
+        self.key = key
+        self.keys = keys or {}
+        self.jwks = None
+        if jwks_url is not None:
+            self.jwks = jwt.PyJWKClient(jwks_url, cache_keys=True,
+                                        lifespan=jwks_ttl)
+        self.algorithms = list(algorithms)
+        self.audience = audience
+        self.issuer = issuer
+        self.leeway = leeway
+        self.name_claim = name_claim
+        self.databases_claim = databases_claim
+
+    def signing_key(self, token):
+        """
+        Find the key a token should be signed with.
+
+        :raises AuthenticationFailed: If the token names an unknown key.
+        """
+        kid = jwt.get_unverified_header(token).get("kid")
+        if kid is not None and kid in self.keys:
+            return self.keys[kid]
+        if self.jwks is not None:
+            try:
+                return self.jwks.get_signing_key_from_jwt(token).key
+            except jwt.PyJWKClientConnectionError:
+                raise
+            except jwt.PyJWKClientError as e:
+                raise AuthenticationFailed(str(e))
+        if self.key is None:
+            raise AuthenticationFailed("Unknown signing key.")
+        return self.key
+
+    def authenticate(self, credentials):
+        try:
+            claims = jwt.decode(
+                credentials, self.signing_key(credentials),
+                algorithms=self.algorithms, audience=self.audience,
+                issuer=self.issuer, leeway=self.leeway,
+            )
+        except jwt.InvalidTokenError as e:
+            raise AuthenticationFailed("Invalid token: %s" % e)
+        name = claims.get(self.name_claim)
+        if name is None:
+            raise AuthenticationFailed("Token has no %r claim."
+                                       % self.name_claim)
+        databases = claims.get(self.databases_claim)
+        if databases is not None and not isinstance(databases, list):
+            databases = [databases]
+        expires = claims.get("exp")
+        if expires is not None:
+            expires += self.leeway
+        return Identity(name, databases, expires)
@@ -14,14 +14,62 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
 import os
 import re
+import threading
 
 from sql_json_bridge.db_drivers import load_db_driver
+from sql_json_bridge.db_drivers.replicas import ReplicaSet
+from sql_json_bridge.db_drivers.singleflight import SingleFlight
+from sql_json_bridge.extensions.cache import is_read_query, normalize_sql
+from sql_json_bridge.metrics import COALESCED
+
+import six
 
 import yaml
 
 
+_PLACEHOLDER = re.compile(r'{{([0-9]+)}}')
+
+# libyaml's loader is several times faster, when PyYAML was built with it.
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+def compile_template(obj):
+    """
+    Compile a configuration value into a substitution function.
+
+    Strings are split once on their '{{N}}' placeholders, so populating
+    them is a join over pre-split parts rather than a regex scan. Dicts
+    and lists are compiled recursively; other values are constants.
+
+    :param obj: The configuration value to compile.
+    :returns: A function taking a sequence of args and returning the
+              populated value.
+    """
+    if isinstance(obj, six.string_types):
+        parts = _PLACEHOLDER.split(obj)
+        if len(parts) == 1:
+            return lambda args: obj
+        # Odd indexes hold placeholder numbers, even indexes literal text.
+        indexes = [(i, int(parts[i])) for i in range(1, len(parts), 2)]
+
+        def populate(args):
+            populated = list(parts)
+            for i, n in indexes:
+                populated[i] = args[n] if args[n] is not None else ""
+            return "".join(populated)
+        return populate
+    if isinstance(obj, dict):
+        compiled = [(k, compile_template(v)) for k, v in obj.items()]
+        return lambda args: dict((k, f(args)) for k, f in compiled)
+    if isinstance(obj, list):
+        compiled = [compile_template(v) for v in obj]
+        return lambda args: [f(args) for f in compiled]
+    return lambda args: obj
+
+
 def load_database_configs(directory):
     databases = {}
     for (dirpath, dirnames, filenames) in os.walk(directory):
@@ -29,6 +77,7 @@ def load_database_configs(directory):
             if f.endswith(('.yml', '.yaml')):
                 conf = DbConfig(os.path.join(dirpath, f))
                 databases[conf['identifier']] = conf
+    return databases
 
 
 class DbConfig(object):
@@ -38,16 +87,83 @@ class DbConfig(object):
     This object will represent a single database group from the configuration
     file and will populate all variables into configuration options and
     dictionaries automatically.
+
+    An optional `pool` mapping configures the driver's connection pool:
+
+    .. code-block:: yaml
+
+        pool:
+            min_size: 0         # connections opened up front
+            max_size: 10        # hard cap on open connections
+            idle_timeout: 300   # seconds before an idle connection closes
+            max_lifetime: 3600  # seconds before any connection is recycled
+            wait_timeout: 10    # seconds to wait when the pool is exhausted
+            health_check: true  # validate connections on checkout
+
+    An optional `replicas` list declares read replicas of the database
+    in `connection`, see :py:class:`replicas.ReplicaSet`. Reads are then
+    balanced across healthy replicas and writes go to the primary.
+
+    With `coalesce` enabled, identical read queries arriving while one
+    is already running share its result, see :py:meth:`fetch_rows`:
+
+    .. code-block:: yaml
+
+        coalesce:
+            enabled: true
+
+    Drivers are created on the first query against the database, so
+    loading a config only parses its YAML.
+
+    :ivar fingerprint: Digest of the config file's contents, which tells
+                       configs apart across reloads, e.g. in cache keys.
     """
 
     def __init__(self, config_file):
         self.store = dict()
         with open(config_file, "r") as f:
-            self.store.update(
-                yaml.load(f.read())
-            )
+            text = f.read()
+        self.fingerprint = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        self.store.update(yaml.load(text, Loader=_YAML_LOADER))
         self.store["identifier"] = re.compile(self.store["identifier"])
-        self.driver = load_db_driver(self.store["driver"]), self)
+        self.templates = {}
+        self.drivers = {}
+        self.replica_sets = {}
+        self.flights = SingleFlight()
+        self._driver = None
+        self._lock = threading.Lock()
+
+    @property
+    def driver(self):
+        """
+        The driver shared by databases matching this config without groups.
+
+        :rtype: :py:class:base.DatabaseDriver
+        """
+        if self._driver is None:
+            with self._lock:
+                if self._driver is None:
+                    self._driver = load_db_driver(self.store["driver"], self)
+        return self._driver
+
+    def __getitem__(self, key):
+        return self.store[key]
+
+    def get(self, key, default=None):
+        return self.store.get(key, default)
+
+    def close(self):
+        """Close the connection pools of every driver for this config."""
+        with self._lock:
+            drivers = list(self.drivers.values())
+            if self._driver is not None:
+                drivers.append(self._driver)
+            drivers.extend(self.replica_sets.values())
+            self.drivers = {}
+            self.replica_sets = {}
+            self._driver = None
+        for driver in drivers:
+            driver.close()
 
     def populate_args(self, obj, args):
         """
@@ -58,24 +174,154 @@ class DbConfig(object):
         with the corresponding list item:
         {{0}} = args[0], etc.
 
-        Replacement will be done recursively if given a dict.
+        Replacement will be done recursively if given a dict or list.
 
-        :param string string: string to be populated.
+        :param obj: item to be populated.
         :param list args: list of arguments for population.
-        :rtype string:
+        :returns: The populated item.
         """
-        if type(obj) == str:
-            to_replace = obj.finditer(r'{{([0-9]+)}}')
-            for i in to_replace:
-                key = int(re.search(r'\d+', item).group())
-                obj.replace(item, args[key])
-            return obj
-
-    def get_item(self, database_name, key):
+        return compile_template(obj)(args)
+
+    def get_item(self, database_name, key, args=None):
         """
         Get item from config store with args replaced based on identifier.
         "{{\d}}" will be replaced with the corresponding zero-indexed regex
         group (regex group 1 becomes 0, etc).
+
+        Templates are compiled on first use of each key. If the identifier
+        groups are already known, e.g. from the router, pass them as `args`
+        to skip matching the name again.
         """
-        args = self["identifier"].match(database_name).groups()
-        return self.populate_args(self.store[key], args)
+        if args is None:
+            args = self["identifier"].match(database_name).groups()
+        template = self.templates.get(key)
+        if template is None:
+            template = self.templates[key] = compile_template(self.store[key])
+        return template(args)
+
+    def get_driver(self, args):
+        """
+        Get the driver serving the database with identifier groups `args`.
+
+        Identifiers without groups share this config's driver. Otherwise
+        each distinct set of groups gets its own driver, and so its own
+        connection pool, configured with its templates populated.
+
+        :param args: Identifier regex groups of the database name.
+        :type args: tuple
+        :rtype: :py:class:base.DatabaseDriver
+        """
+        if not args:
+            return self.driver
+        args = tuple(args)
+        driver = self.drivers.get(args)
+        if driver is None:
+            with self._lock:
+                driver = self.drivers.get(args)
+                if driver is None:
+                    driver = load_db_driver(self.store["driver"],
+                                            BoundDbConfig(self, args))
+                    self.drivers[args] = driver
+        return driver
+
+    def get_replicas(self, args):
+        """
+        Get the read replicas of the database with identifier groups `args`.
+
+        :param args: Identifier regex groups of the database name.
+        :type args: tuple
+        :returns: The database's replica set, or None if it has none.
+        :rtype: :py:class:replicas.ReplicaSet
+        """
+        if not self.store.get("replicas"):
+            return None
+        args = tuple(args or ())
+        replicas = self.replica_sets.get(args)
+        if replicas is None:
+            with self._lock:
+                replicas = self.replica_sets.get(args)
+                if replicas is None:
+                    replicas = ReplicaSet(
+                        BoundDbConfig(self, args) if args else self
+                    )
+                    self.replica_sets[args] = replicas
+        return replicas
+
+    def get_read_driver(self, args):
+        """
+        Get a driver to run a read-only query on.
+
+        Databases with replicas pick one per call, falling back to the
+        primary when none is available. Otherwise this is `get_driver`.
+
+        :param args: Identifier regex groups of the database name.
+        :type args: tuple
+        :rtype: :py:class:base.DatabaseDriver
+        :raises replicas.NoReplicaAvailable: If no replica is available
+                                             and fallback is disabled.
+        """
+        replicas = self.get_replicas(args)
+        if replicas is not None:
+            driver = replicas.choose()
+            if driver is not None:
+                return driver
+        return self.get_driver(args)
+
+    def coalescing(self):
+        """Whether identical concurrent reads share one execution."""
+        return bool((self.store.get("coalesce") or {}).get("enabled"))
+
+    def fetch_rows(self, args, driver, query_string, params=None,
+                   limit=None):
+        """
+        Run a query, sharing one execution between identical read queries.
+
+        While a read query runs against the database with identifier
+        groups `args`, calls with the same normalized SQL, params and
+        limit wait for it and get its result, instead of each running the
+        query. The rows list is shared between callers and must not be
+        changed. Without `coalesce` enabled, and for anything but read
+        queries, every call runs its query itself.
+
+        :param args: Identifier regex groups of the database name.
+        :type args: tuple
+        :param driver: The driver to run the query on if it is not
+                       already running, e.g. from `get_read_driver`.
+        :param query_string: The query to run.
+        :type query_string: str
+        :param params: Bind parameters for the query, if any.
+        :param limit: Most rows to read, or None for all of them.
+        :returns: A (columns, rows, more) tuple, as from
+                  :py:meth:`DatabaseDriver.fetch_rows`.
+        """
+        if not self.coalescing() or not is_read_query(query_string):
+            return driver.fetch_rows(query_string, params, limit)
+        key = (tuple(args or ()), normalize_sql(query_string),
+               repr(params), limit)
+        result, shared = self.flights.do(
+            key, lambda: driver.fetch_rows(query_string, params, limit)
+        )
+        if shared:
+            COALESCED.inc((self.store["identifier"].pattern,))
+        return result
+
+
+class BoundDbConfig(object):
+    """
+    View of a :py:class:DbConfig with its templates populated.
+
+    Drivers for regex identifiers receive this in place of the DbConfig,
+    so that item access returns values for one concrete database.
+    """
+
+    def __init__(self, config, args):
+        self.config = config
+        self.args = args
+
+    def __getitem__(self, key):
+        return self.config.get_item(None, key, self.args)
+
+    def get(self, key, default=None):
+        if key not in self.config.store:
+            return default
+        return self[key]
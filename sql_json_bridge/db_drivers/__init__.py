@@ -14,8 +14,65 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>
 
+import importlib
+import threading
+
 from stevedore import driver
 
+# Drivers shipped with the bridge that need no entry point, by name.
+BUILTIN_DRIVERS = {
+    "sqlite": "sql_json_bridge.db_drivers.sqlite:SQLiteDriver",
+}
+
+# Driver classes by name, resolved once per process.
+_DRIVER_CLASSES = {}
+_DRIVER_CLASSES_LOCK = threading.Lock()
+
+
+def register_db_driver(driver_name, driver_class):
+    """
+    Register a database driver class under a name.
+
+    Registered names take precedence over entry points, which allows
+    drivers to be used without installing an entry point for them.
+
+    :param driver_name: The name configs refer to the driver by.
+    :type driver_name: str
+    :param driver_class: A :py:class:base.DatabaseDriver subclass.
+    """
+    with _DRIVER_CLASSES_LOCK:
+        _DRIVER_CLASSES[driver_name] = driver_class
+
+
+def get_db_driver_class(driver_name):
+    """
+    Resolve the class of a database driver by name.
+
+    Registered and built-in drivers are checked first, then the
+    "sql_json_bridge.ext.database_driver" entry points. Entry points are
+    only scanned, and the driver's module only imported, the first time
+    each name is looked up.
+
+    :param driver_name: The name of the driver.
+    :type driver_name: str
+    :rtype: type
+    """
+    driver_class = _DRIVER_CLASSES.get(driver_name)
+    if driver_class is None:
+        with _DRIVER_CLASSES_LOCK:
+            driver_class = _DRIVER_CLASSES.get(driver_name)
+            if driver_class is None and driver_name in BUILTIN_DRIVERS:
+                module, _, name = BUILTIN_DRIVERS[driver_name].partition(":")
+                driver_class = getattr(importlib.import_module(module), name)
+                _DRIVER_CLASSES[driver_name] = driver_class
+            elif driver_class is None:
+                mgr = driver.DriverManager(
+                    namespace="sql_json_bridge.ext.database_driver",
+                    name=driver_name,
+                )
+                driver_class = _DRIVER_CLASSES[driver_name] = mgr.driver
+    return driver_class
+
 
 def load_db_driver(driver_name, database_config):
     """
@@ -34,10 +91,4 @@ def load_db_driver(driver_name, database_config):
     :returns: A database object.
     :rtype: :py:class:base.DatabaseDriver
     """
-    mgr = driver.DriverManager(
-        namespace="sql_json_bridge.ext.database_driver",
-        name=driver_name,
-        invoke_on_load=True,
-        invoke_args=(database_config),
-    )
-    return mgr.driver
+    return get_db_driver_class(driver_name)(database_config)
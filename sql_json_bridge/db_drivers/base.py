@@ -15,9 +15,65 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>
 
 import abc
+import contextlib
+import itertools
+import logging
+import threading
+import time
+
+from collections import OrderedDict
+from timeit import default_timer
+
+from sql_json_bridge.db_drivers.pool import ConnectionPool
+from sql_json_bridge.encoders import Columns
+from sql_json_bridge.limits import Bulkhead, load_limits
+from sql_json_bridge.metrics import observe_pool_wait
 
 import six
 
+LOG = logging.getLogger(__name__)
+
+# Per-thread connection watchers, see `watch_connections`.
+_watchers = threading.local()
+
+
+@contextlib.contextmanager
+def watch_connections(on_checkout, on_release):
+    """
+    Report the connections drivers check out on this thread in a block.
+
+    Lets code running queries through the driver API, e.g. fan-out
+    workers, cancel them from another thread with the driver's `cancel`.
+    Both callbacks take the driver and the connection; `on_release` is
+    called when a connection checked out in the block is returned, even
+    if that is after the block, e.g. when a row generator is closed.
+    `on_checkout` may raise to abandon the statement before it runs.
+    """
+    previous = getattr(_watchers, "watch", None)
+    _watchers.watch = (on_checkout, on_release)
+    try:
+        yield
+    finally:
+        _watchers.watch = previous
+
+
+class BatchAborted(Exception):
+    """Reported for statements skipped after a transactional batch failed."""
+
+
+class BulkInsertError(Exception):
+    """
+    Raised when a bulk insert fails part way through.
+
+    :param error: The underlying exception.
+    :param stats: Statistics for the batches committed before the failure.
+    """
+
+    def __init__(self, error, stats):
+        super(BulkInsertError, self).__init__(*error.args)
+        self.error = error
+        self.stats = stats
+
 
 @six.add_metaclass(abc.ABCMeta)
 class DatabaseDriver(object):
@@ -26,19 +82,284 @@ class DatabaseDriver(object):
 
     Should be installed with a "sql_json_bridge.ext.database_driver"
     entrypoint.
+
+    The optional `limits` section of the database configuration bounds
+    concurrent queries through a :py:class:`limits.Bulkhead`, and sets a
+    `statement_timeout` in seconds after which the running statement is
+    cancelled through `cancel`, if `cancel_is_threadsafe`.
     """
 
+    # Cursor description type codes of columns whose values need
+    # converting for JSON, mapped to their `encoders` kind.
+    column_kinds = {}
+
+    # Whether `cancel` may be called from another thread while the
+    # connection is in use, e.g. on `statement_timeout` or by a fan-out.
+    cancel_is_threadsafe = False
+
+    # Queries read by `introspect`. `tables_query` returns rows of
+    # (schema, table, table type); `columns_query` rows of (schema, table,
+    # column, data type, nullable, max length, precision, scale) in column
+    # order; and `indexes_query`, if set, rows of (schema, table, index,
+    # column, unique, primary) in key order.
+    tables_query = (
+        "SELECT TABLE_SCHEMA, TABLE_NAME, TABLE_TYPE "
+        "FROM INFORMATION_SCHEMA.TABLES "
+        "ORDER BY TABLE_SCHEMA, TABLE_NAME"
+    )
+    columns_query = (
+        "SELECT TABLE_SCHEMA, TABLE_NAME, COLUMN_NAME, DATA_TYPE, "
+        "IS_NULLABLE, CHARACTER_MAXIMUM_LENGTH, NUMERIC_PRECISION, "
+        "NUMERIC_SCALE "
+        "FROM INFORMATION_SCHEMA.COLUMNS "
+        "ORDER BY TABLE_SCHEMA, TABLE_NAME, ORDINAL_POSITION"
+    )
+    indexes_query = None
+
     def __init__(self, database_config):
         self.config = database_config
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self.limits = load_limits(database_config)
+        self.bulkhead = None
+        if self.limits["max_concurrent"]:
+            self.bulkhead = Bulkhead(self.limits["max_concurrent"],
+                                     self.limits["max_queue"],
+                                     self.limits["queue_timeout"])
+
+    @property
+    def pool(self):
+        """
+        Connection pool owned by this driver.
+
+        The pool is created on first use from the optional `pool` section
+        of the database configuration.
+
+        :rtype: :py:class:pool.ConnectionPool
+        """
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ConnectionPool(
+                        self.connect,
+                        check=self.check_connection,
+                        reset=self.reset_connection,
+                        **(self.config.get("pool") or {})
+                    )
+        return self._pool
+
+    @contextlib.contextmanager
+    def connection(self):
+        """
+        Check a pooled connection out for the duration of a `with` block.
+
+        If the database has a bulkhead, a query slot is held along with
+        the connection. Time spent waiting for both, including opening a
+        new connection, is recorded as the request's "connect" stage.
+
+        :returns: A context manager yielding a raw connection.
+        :raises limits.LimitExceeded: If no query slot is available.
+        :raises pool.PoolTimeout: If no connection is available.
+        """
+        start = default_timer()
+        if self.bulkhead is not None:
+            self.bulkhead.acquire()
+        try:
+            conn = self.pool.acquire()
+        except BaseException:
+            if self.bulkhead is not None:
+                self.bulkhead.release()
+            raise
+        observe_pool_wait(self.config, default_timer() - start)
+        watch = getattr(_watchers, "watch", None)
+        try:
+            if watch is not None:
+                watch[0](self, conn)
+            yield conn
+        finally:
+            if watch is not None:
+                watch[1](self, conn)
+            self.pool.release(conn)
+            if self.bulkhead is not None:
+                self.bulkhead.release()
+
+    def close(self):
+        """Close all pooled connections held by this driver."""
+        if self._pool is not None:
+            self._pool.close()
+
+    def check_connection(self, connection):
+        """
+        Check that a pooled connection is still usable.
+
+        Called on checkout when the pool's `health_check` option is on.
+        Override this with a cheap round trip for your library.
+
+        :param connection: A connection returned by `connect`.
+        :returns: True if the connection can be reused.
+        :rtype: bool
+        """
+        return True
+
+    def reset_connection(self, connection):
+        """
+        Reset a connection before it goes back into the pool.
+
+        By default, any open transaction is rolled back so the next
+        checkout starts from a clean state.
+
+        :param connection: A connection returned by `connect`.
+        """
+        connection.rollback()
+
+    def cancel(self, connection):
+        """
+        Cancel the statement running on a connection, server side.
+
+        This is called from row generators closed before their result
+        was read, e.g. because the HTTP client went away. If the driver
+        sets `cancel_is_threadsafe`, it is also called from other threads
+        while the connection is in use: from a timer thread when
+        `statement_timeout` expires, and when a fan-out is abandoned.
+        Override this for your library; by default nothing can be
+        cancelled.
+
+        :param connection: A connection returned by `connect`.
+        :returns: True if a cancel was sent.
+        :rtype: bool
+        """
+        return False
+
+    def _cancel_quietly(self, connection):
+        try:
+            return self.cancel(connection)
+        except Exception:
+            LOG.exception("Could not cancel statement.")
+            return False
+
+    @contextlib.contextmanager
+    def deadline(self, connection):
+        """
+        Cancel the running statement if the block outlives its timeout.
+
+        Only drivers whose `cancel_is_threadsafe` are cancelled; others
+        should enforce `statement_timeout` through their library.
+
+        :param connection: The connection the statement runs on.
+        """
+        timeout = self.limits["statement_timeout"]
+        if (not timeout or connection is None or
+                not self.cancel_is_threadsafe):
+            yield
+            return
+        timer = threading.Timer(timeout, self._cancel_quietly, (connection,))
+        timer.daemon = True
+        timer.start()
+        try:
+            yield
+        finally:
+            timer.cancel()
+
+    def describe(self, description):
+        """
+        Column names and kinds of a result set.
+
+        The kind of each column is looked up from its type code in
+        `column_kinds`, so result formats can choose a conversion per
+        column rather than per value.
+
+        :param description: A DB-API cursor description, or None.
+        :rtype: :py:class:`encoders.Columns`
+        """
+        description = description or ()
+        return Columns([column[0] for column in description],
+                       [self.column_kinds.get(column[1])
+                        for column in description])
+
+    def replica_lag(self, connection):
+        """
+        Report how far a read replica is behind its primary.
+
+        Used by :py:class:`replicas.ReplicaSet` when a `max_lag` is
+        configured. Override this for your database; by default the lag
+        is unknown, and never keeps a replica out of rotation.
+
+        :param connection: A connection to the replica.
+        :returns: Seconds of replication lag, or None if unknown.
+        :rtype: float
+        """
+        return None
+
+    def introspect(self):
+        """
+        Read the tables and views of the database.
+
+        Each is described by its schema, name, type ("table" or "view"),
+        columns and indexes. By default this runs `tables_query`,
+        `columns_query` and `indexes_query`, which read the ANSI
+        INFORMATION_SCHEMA views; indexes are only listed for drivers that
+        set `indexes_query`.
+
+        :rtype: list(dict)
+        """
+        tables = OrderedDict()
+        for schema, name, kind in self.fetch_rows(self.tables_query)[1]:
+            tables[(schema, name)] = OrderedDict([
+                ("schema", schema),
+                ("name", name),
+                ("type", "view" if "VIEW" in kind.upper() else "table"),
+                ("columns", []),
+                ("indexes", []),
+            ])
+        for row in self.fetch_rows(self.columns_query)[1]:
+            table = tables.get((row[0], row[1]))
+            if table is not None:
+                table["columns"].append(OrderedDict([
+                    ("name", row[2]),
+                    ("type", row[3]),
+                    ("nullable", row[4] in (True, 1, "YES")),
+                    ("max_length", row[5]),
+                    ("precision", row[6]),
+                    ("scale", row[7]),
+                ]))
+        if self.indexes_query is None:
+            return list(tables.values())
+        indexes = OrderedDict()
+        for schema, name, index, column, unique, primary in self.fetch_rows(
+                self.indexes_query)[1]:
+            table = tables.get((schema, name))
+            if table is None:
+                continue
+            entry = indexes.get((schema, name, index))
+            if entry is None:
+                entry = indexes[(schema, name, index)] = OrderedDict([
+                    ("name", index),
+                    ("columns", []),
+                    ("unique", bool(unique)),
+                    ("primary", bool(primary)),
+                ])
+                table["indexes"].append(entry)
+            entry["columns"].append(column)
+        return list(tables.values())
+
+    def cursor(self, connection):
+        """
+        Open a cursor returning rows as tuples.
+
+        Override this if your library's default cursor returns anything
+        else, e.g. dicts.
+
+        :param connection: A connection returned by `connect`.
+        """
+        return connection.cursor()
 
     @abc.abstractmethod
     def connect(self, *args, **kwargs):
         """
         Connect to the database represented by this driver.
 
-        If no connection method is needed, override this method with `pass`.
-        This function should attach a connection object to the database
-        object if one is necessary.
+        This function should return a new connection object. Connections
+        returned from here are owned and reused by the driver's pool.
 
         :param *args: Arguments to be passed to the connection method
                       of your underlying lybrary.
@@ -50,54 +371,366 @@ class DatabaseDriver(object):
         raise NotImplementedError
 
     @abc.abstractmethod
-    def run_query(self, query_string):
+    def run_query(self, query_string, params=None):
         """
         Run a Query against the database represented by the driver.
 
         :param query_string: Query to be ran against the database.
         :type query_string: str
+        :param params: Bind parameters for the query, as a sequence for
+                       positional or a dict for named placeholders.
         :returns: An iterable cursor of results.
         """
         raise NotImplementedError
 
-    def run_update(self, query_string):
+    def execute(self, cursor, query_string, params=None):
         """
-        Run an update function against a database.
+        Execute a statement on a cursor, binding `params` if given.
+
+        All statements run by the driver go through here, so drivers can
+        rewrite parameterized statements, e.g. to use server-side
+        preparation. Statements still running after `statement_timeout`
+        are cancelled.
+
+        :param cursor: A cursor from `cursor`.
+        :param query_string: Statement to be ran against the database.
+        :type query_string: str
+        :param params: Bind parameters for the statement, if any.
+        """
+        with self.deadline(getattr(cursor, "connection", None)):
+            if params is None:
+                cursor.execute(query_string)
+            else:
+                cursor.execute(query_string, params)
+
+    def execute_many(self, cursor, query_string, seq_of_params):
+        """
+        Execute a statement once per parameter set on a cursor.
+
+        :param cursor: A cursor from `cursor`.
+        :param query_string: Statement to be ran against the database.
+        :type query_string: str
+        :param seq_of_params: A sequence of bind parameter sets.
+        :returns: The number of rows affected.
+        :rtype: int
+        """
+        with self.deadline(getattr(cursor, "connection", None)):
+            cursor.executemany(query_string, seq_of_params)
+        return cursor.rowcount
 
-        By default, this function is an alias to run_query. If separate
-        code is needed by your driver to perform an update, you can
-        override this behavior here.
+    def iter_rows(self, query_string, params=None):
+        """
+        Run a Query, yielding its column names followed by tuple rows.
+
+        The first item yielded is the list of column names taken from the
+        cursor description; every following item is one row as a tuple.
+        Drivers should override this to read from an unbuffered,
+        server-side cursor so memory use stays constant in the number of
+        rows. A pooled connection is held until the generator is exhausted
+        or closed. By default, this falls back to `run_query`.
 
         :param query_string: Query to be ran against the database.
         :type query_string: str
-        :returns: An iterable cursor of results.
+        :param params: Bind parameters for the query, if any.
+        :returns: A generator of column names, then rows.
+        """
+        result = list(self.run_query(query_string, params) or ())
+        columns = Columns(result[0] if result else ())
+        yield columns
+        for row in result:
+            yield tuple(row[column] for column in columns)
+
+    def stream_rows(self, query_string, params=None):
+        """
+        Run a Query, returning its columns and a generator of tuple rows.
+
+        The query is executed before this returns, so errors are raised
+        here rather than from the row generator. Callers must exhaust or
+        close the generator to return its connection to the pool.
+
+        :param query_string: Query to be ran against the database.
+        :type query_string: str
+        :param params: Bind parameters for the query, if any.
+        :returns: A (columns, rows) pair.
+        :rtype: tuple(list, generator)
+        """
+        rows = self.iter_rows(query_string, params)
+        columns = next(rows)
+        return columns, rows
+
+    def fetch_rows(self, query_string, params=None, limit=None):
         """
-        self.run_query(query_string)
+        Run a Query and read up to `limit` rows of its result.
 
-    def run_delete(self, query_string):
+        One row past the limit is read, to tell whether more follow; the
+        rest of the query is then cancelled.
+
+        :param query_string: Query to be ran against the database.
+        :type query_string: str
+        :param params: Bind parameters for the query, if any.
+        :param limit: Most rows to read, or None for all of them.
+        :type limit: int
+        :returns: A (columns, rows, more) tuple.
+        :rtype: tuple(list, list, bool)
+        """
+        columns, rows = self.stream_rows(query_string, params)
+        try:
+            if limit is None:
+                return columns, list(rows), False
+            fetched = list(itertools.islice(rows, limit + 1))
+            return columns, fetched[:limit], len(fetched) > limit
+        finally:
+            rows.close()
+
+    def stream_query(self, query_string, params=None):
+        """
+        Run a Query and yield its rows one at a time as dicts.
+
+        :param query_string: Query to be ran against the database.
+        :type query_string: str
+        :param params: Bind parameters for the query, if any.
+        :returns: A generator of result rows.
+        """
+        columns, rows = self.stream_rows(query_string, params)
+        for row in rows:
+            yield dict(zip(columns, row))
+
+    def run_update(self, query_string, params=None):
         """
         Run an update function against a database.
 
-        By default, this function is an alias to run_query. If separate
-        code is needed by your driver to perform an update, you can
-        override this behavior here.
+        The statement runs on a pooled connection and is committed. If
+        separate code is needed by your driver to perform an update, you
+        can override this behavior here.
 
         :param query_string: Query to be ran against the database.
         :type query_string: str
-        :returns: An iterable cursor of results.
+        :param params: Bind parameters for the query, if any.
+        :returns: A (columns, rows, rowcount) tuple.
+        """
+        with self.connection() as connection:
+            result = self.execute_statement(connection, query_string, params)
+            connection.commit()
+            return result
+
+    def run_delete(self, query_string, params=None):
+        """
+        Run a delete function against a database.
+
+        By default, this function is an alias to run_update.
+
+        :param query_string: Query to be ran against the database.
+        :type query_string: str
+        :param params: Bind parameters for the query, if any.
+        :returns: A (columns, rows, rowcount) tuple.
         """
-        self.run_query(query_string)
+        return self.run_update(query_string, params)
 
-    def run_stored_proc(self, proc_name, **variables):
+    def run_many(self, query_string, seq_of_params):
         """
-        Run a stored procedure against this database.
+        Run one statement once per parameter set, e.g. a bulk insert.
 
-        If needed, this method can be used as a helper function to call
-        a stored procedure against the database by overriding this function.
+        All executions share one pooled connection and are committed
+        together.
+
+        :param query_string: Statement to be ran against the database.
+        :type query_string: str
+        :param seq_of_params: A sequence of bind parameter sets.
+        :returns: The number of rows affected.
+        :rtype: int
+        """
+        with self.connection() as connection:
+            cur = self.cursor(connection)
+            try:
+                rowcount = self.execute_many(cur, query_string, seq_of_params)
+            finally:
+                cur.close()
+            connection.commit()
+            return rowcount
+
+    def execute_statement(self, connection, query_string, params=None):
+        """
+        Execute one statement on `connection` and fetch its results.
+
+        :param connection: A connection checked out of the pool.
+        :param query_string: Statement to be ran against the database.
+        :type query_string: str
+        :param params: Bind parameters for the statement, if any.
+        :returns: A (columns, rows, rowcount) tuple.
+        :rtype: tuple(list, list, int)
+        """
+        cur = self.cursor(connection)
+        try:
+            self.execute(cur, query_string, params)
+            if cur.description is None:
+                return Columns(), [], cur.rowcount
+            return self.describe(cur.description), cur.fetchall(), cur.rowcount
+        finally:
+            cur.close()
+
+    def run_batch(self, statements, transaction=False):
+        """
+        Run several statements on a single pooled connection.
+
+        Each statement is a dict with a "sql" key and optional "params".
+        Without `transaction`, statements are committed one by one and a
+        failure only affects its own statement. With `transaction`, all
+        statements are committed together, and the first failure rolls
+        back the batch and skips the remaining statements.
+
+        :param statements: The statements to run, in order.
+        :type statements: list(dict)
+        :param transaction: Run the batch as one transaction.
+        :type transaction: bool
+        :returns: One result per statement: a (columns, rows, rowcount)
+                  tuple, or the exception the statement raised.
+        :rtype: list
+        """
+        results = []
+        with self.connection() as connection:
+            for n, statement in enumerate(statements):
+                try:
+                    results.append(self.execute_statement(
+                        connection,
+                        statement["sql"],
+                        statement.get("params"),
+                    ))
+                    if not transaction:
+                        connection.commit()
+                except Exception as e:
+                    connection.rollback()
+                    results.append(e)
+                    if transaction:
+                        skipped = BatchAborted(
+                            "Skipped after statement %d failed." % n
+                        )
+                        results.extend(
+                            [skipped] * (len(statements) - len(results))
+                        )
+                        return results
+            if transaction:
+                connection.commit()
+        return results
+
+    def quote_identifier(self, name):
+        """
+        Quote a table or column name for use in generated SQL.
+
+        Dotted names are quoted part by part. Override this for databases
+        not using ANSI double quotes.
+
+        :param name: The identifier to quote.
+        :type name: str
+        :rtype: str
+        """
+        return ".".join('"%s"' % part.replace('"', '""')
+                        for part in name.split("."))
+
+    def max_insert_rows(self, ncolumns):
+        """
+        Largest number of rows to send in one INSERT statement.
+
+        :param ncolumns: Number of columns being inserted.
+        :rtype: int
+        """
+        return 1000
+
+    def insert_batch(self, cursor, table, columns, rows):
+        """
+        Insert a batch of rows with one multi-row INSERT per statement.
+
+        :param cursor: A cursor from `cursor`.
+        :param table: The quoted table name.
+        :param columns: The quoted column names.
+        :param rows: The rows to insert, as sequences of values.
+        :type rows: list
+        """
+        per_statement = max(self.max_insert_rows(len(columns)), 1)
+        placeholders = "(%s)" % ", ".join(["%s"] * len(columns))
+        for start in range(0, len(rows), per_statement):
+            chunk = rows[start:start + per_statement]
+            query_string = "INSERT INTO %s (%s) VALUES %s" % (
+                table,
+                ", ".join(columns),
+                ", ".join([placeholders] * len(chunk)),
+            )
+            self.execute(cursor, query_string,
+                         tuple(itertools.chain.from_iterable(chunk)))
+
+    def bulk_insert(self, table, columns, rows, batch_size=1000):
+        """
+        Insert rows from an iterable into a table, committing per batch.
+
+        Rows are consumed lazily, so `rows` can stream from a request body
+        without being buffered as a whole.
+
+        :param table: The table to insert into.
+        :type table: str
+        :param columns: The column names the row values belong to.
+        :type columns: list(str)
+        :param rows: An iterable of rows, as sequences of values.
+        :param batch_size: Number of rows per committed batch.
+        :type batch_size: int
+        :returns: Statistics: rows written, batches committed, seconds
+                  taken and rows per second.
+        :rtype: dict
+        :raises BulkInsertError: If a batch fails. Earlier batches stay
+                                 committed.
+        """
+        table = self.quote_identifier(table)
+        columns = [self.quote_identifier(column) for column in columns]
+        rows = iter(rows)
+        stats = {"rows": 0, "batches": 0}
+        start = time.time()
+
+        def finish():
+            stats["seconds"] = round(time.time() - start, 6)
+            stats["rows_per_second"] = (
+                round(stats["rows"] / stats["seconds"], 1)
+                if stats["seconds"] else None
+            )
+            return stats
+
+        with self.connection() as connection:
+            cur = self.cursor(connection)
+            try:
+                while True:
+                    batch = [tuple(row)
+                             for row in itertools.islice(rows, batch_size)]
+                    if not batch:
+                        break
+                    self.insert_batch(cur, table, columns, batch)
+                    connection.commit()
+                    stats["rows"] += len(batch)
+                    stats["batches"] += 1
+            except Exception as e:
+                connection.rollback()
+                raise BulkInsertError(e, finish())
+            finally:
+                cur.close()
+        return finish()
+
+    def run_stored_proc(self, proc_name, params=()):
+        """
+        Call a stored procedure, yielding its result sets as they arrive.
+
+        Like `iter_rows`, but for every result set the procedure returns:
+        each starts with a :py:class:`encoders.Columns`, followed by its
+        tuple rows. Once all are read, the values of output parameters are
+        yielded as a dict, keyed as by :py:func:`procedures.output_key`.
+        The call should be made in a single round trip where the database
+        allows, and a pooled connection is held until the generator is
+        exhausted or closed.
+
+        Override this for databases with stored procedures; by default
+        they are not supported.
 
         :param proc_name: The name of the stored procedure to be run.
         :type proc_name: str
-        :param **kwargs: Keyword pairs for stored procedure variables.
-        :returns: An iterable cursor of results.
+        :param params: The call's parameters.
+        :type params: list(:py:class:`procedures.ProcParam`)
+        :returns: A generator of columns and rows, then output values.
+        :raises NotImplementedError: If the driver has no procedures.
+        :raises ValueError: If the parameters don't suit the database.
         """
         raise NotImplementedError
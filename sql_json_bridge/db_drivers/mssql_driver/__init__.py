@@ -1,8 +1,102 @@
 
 
+import datetime
+import decimal
+import math
+import re
+import threading
+import uuid
+
+from collections import OrderedDict
+
 import pymssql
 
+from sql_json_bridge import encoders
 from sql_json_bridge.db_drivers.base import DatabaseDriver
+from sql_json_bridge.db_drivers.procedures import output_key
+from sql_json_bridge.encoders import Columns
+
+import six
+
+_PLACEHOLDER = re.compile(r"%\((\w+)\)s|%s|%%")
+
+# pymssql's DB-API type codes. BINARY also covers UNIQUEIDENTIFIER, whose
+# values are UUIDs, so it is left to the encoder's per-value fallback.
+COLUMN_KINDS = {
+    4: encoders.TEMPORAL,   # DATETIME
+    5: encoders.DECIMAL,    # DECIMAL
+}
+
+# T-SQL types of the parameter types clients can declare, for output
+# parameters whose value is not given.
+SQL_TYPES = {
+    "int": "BIGINT",
+    "float": "FLOAT",
+    "decimal": "DECIMAL(38, 10)",
+    "string": "NVARCHAR(MAX)",
+    "bool": "BIT",
+    "date": "DATE",
+    "datetime": "DATETIME2",
+    "time": "TIME",
+    "binary": "VARBINARY(MAX)",
+    "uuid": "UNIQUEIDENTIFIER",
+}
+
+
+# Scale every DECIMAL parameter is declared with, so values of different
+# scales share one cached plan. Digits past it are rounded.
+DECIMAL_SCALE = 10
+
+# Longest strings and binary values declared with a bounded length;
+# longer ones are declared (MAX).
+MAX_NVARCHAR = 4000
+MAX_VARCHAR = 8000
+
+
+def sql_type(value, varchar=False, decimal_scale=DECIMAL_SCALE):
+    """
+    Pick the T-SQL type used to declare a bind parameter.
+
+    Types depend on as little of the value as possible, since each
+    distinct declaration gets its own cached plan: decimals all share
+    `decimal_scale`, and strings and binary values are either bounded or
+    (MAX). Strings compared with VARCHAR columns should be declared
+    VARCHAR, as an NVARCHAR parameter makes SQL Server convert the column
+    and scan rather than seek its index.
+
+    :param value: The parameter's value.
+    :param varchar: Declare strings VARCHAR rather than NVARCHAR.
+    :param decimal_scale: Scale of DECIMAL declarations.
+    """
+    if isinstance(value, bool):
+        return "BIT"
+    if isinstance(value, six.integer_types):
+        return "BIGINT"
+    if isinstance(value, float):
+        return "FLOAT"
+    if isinstance(value, decimal.Decimal):
+        return "DECIMAL(38, %d)" % decimal_scale
+    if isinstance(value, datetime.datetime):
+        return "DATETIME2"
+    if isinstance(value, datetime.date):
+        return "DATE"
+    if isinstance(value, datetime.time):
+        return "TIME"
+    if isinstance(value, uuid.UUID):
+        return "UNIQUEIDENTIFIER"
+    if isinstance(value, bytearray) or (
+            six.PY3 and isinstance(value, six.binary_type)):
+        if len(value) > MAX_VARCHAR:
+            return "VARBINARY(MAX)"
+        return "VARBINARY(%d)" % MAX_VARCHAR
+    length = len(value) if isinstance(value, six.string_types) else 0
+    if varchar:
+        if length > MAX_VARCHAR:
+            return "VARCHAR(MAX)"
+        return "VARCHAR(%d)" % MAX_VARCHAR
+    if length > MAX_NVARCHAR:
+        return "NVARCHAR(MAX)"
+    return "NVARCHAR(%d)" % MAX_NVARCHAR
 
 
 class MSSQLDriver(DatabaseDriver):
@@ -28,8 +122,39 @@ class MSSQLDriver(DatabaseDriver):
     Additional possible arguments can be found in the _mssql documentation:
 
     http://pymssql.org/en/stable/ref/pymssql.html#pymssql.connect
+
+    Parameterized statements are sent through `sp_executesql`, so SQL
+    Server caches one plan per statement rather than one per set of
+    literal values. The rewritten statements are cached per driver, up to
+    `statement_cache_size` (default 256) entries; set `prepare_statements`
+    to false in the database config to send them as plain text instead.
+    Strings are declared NVARCHAR, or VARCHAR with `varchar_parameters`
+    set, e.g. for schemas keyed on VARCHAR columns; decimals are declared
+    with a scale of `decimal_scale` (default 10).
+
+    A `statement_timeout` in the database's `limits` becomes pymssql's
+    `timeout`, which has FreeTDS cancel overrunning statements itself.
+    FreeTDS connections are not thread-safe, so queries are never
+    cancelled from other threads, e.g. by an abandoned fan-out; its
+    workers close their own results instead.
     """
 
+    column_kinds = COLUMN_KINDS
+
+    indexes_query = (
+        "SELECT s.name, t.name, i.name, c.name, i.is_unique, "
+        "i.is_primary_key "
+        "FROM sys.indexes i "
+        "JOIN sys.tables t ON t.object_id = i.object_id "
+        "JOIN sys.schemas s ON s.schema_id = t.schema_id "
+        "JOIN sys.index_columns ic ON ic.object_id = i.object_id "
+        "AND ic.index_id = i.index_id "
+        "JOIN sys.columns c ON c.object_id = ic.object_id "
+        "AND c.column_id = ic.column_id "
+        "WHERE i.name IS NOT NULL AND ic.is_included_column = 0 "
+        "ORDER BY s.name, t.name, i.name, ic.key_ordinal"
+    )
+
     def __init__(self, database_config):
         """
         Initialize this driver using connection information.
@@ -37,13 +162,151 @@ class MSSQLDriver(DatabaseDriver):
         :param args: args to be passed to the connect method.
         :param kwargs: kwargs to be passed to the connect method.
         """
-        self.config = database_config
+        super(MSSQLDriver, self).__init__(database_config)
+        self.statements = OrderedDict()
+        self._statements_lock = threading.Lock()
 
     def connect(self, *args, **kwargs):
-        """Connect method is not implemented in this driver."""
-        pass
+        """Open a new connection for the driver's pool."""
+        options = dict(self.config["connection"])
+        timeout = self.limits["statement_timeout"]
+        if timeout:
+            options.setdefault("timeout", int(math.ceil(timeout)))
+        return pymssql.connect(**options)
+
+    def cancel(self, connection):
+        """
+        Cancel the pending results of a connection.
+
+        FreeTDS connections are not thread-safe, so this is only used from
+        the thread owning the connection; statement timeouts are left to
+        pymssql's `timeout`.
+        """
+        connection._conn.cancel()
+        return True
+
+    def check_connection(self, connection):
+        """Run a trivial query, since pymssql has no ping."""
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+        return True
+
+    def replica_lag(self, connection):
+        """
+        Read the lag of an Always On secondary replica (SQL Server 2016+).
+
+        Reports the most lagged database on the replica, or None when it
+        is not a secondary.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT MAX(secondary_lag_seconds) "
+                "FROM sys.dm_hadr_database_replica_states "
+                "WHERE is_local = 1 AND is_primary_replica = 0"
+            )
+            row = cursor.fetchone()
+        if row is None or row[0] is None:
+            return None
+        return float(row[0])
+
+    def prepare(self, query_string, params):
+        """
+        Rewrite a parameterized statement into an `sp_executesql` call.
+
+        `%s` and `%(name)s` placeholders become `@P<n>` and `@name`
+        parameters declared with types taken from `params`. Rewrites are
+        cached by statement and parameter types.
 
-    def run_query(self, query_string):
+        :param query_string: A statement with pyformat placeholders.
+        :param params: Its bind parameters.
+        :returns: The `sp_executesql` statement and its parameter values.
+        :rtype: tuple(str, tuple)
+        """
+        if isinstance(params, dict):
+            names = sorted(params)
+            values = tuple(params[name] for name in names)
+        else:
+            names = None
+            values = tuple(params)
+        key = (query_string, tuple(names or ()),
+               tuple(self.param_type(value) for value in values))
+        with self._statements_lock:
+            statement = self.statements.pop(key, None)
+            if statement is not None:
+                self.statements[key] = statement
+                return statement, values
+
+        positions = iter(range(1, len(values) + 1))
+
+        def replace(match):
+            if match.group() == "%%":
+                return "%%"
+            if match.group(1) is not None:
+                return "@" + match.group(1)
+            return "@P%d" % next(positions)
+
+        inner = _PLACEHOLDER.sub(replace, query_string)
+        if names is not None:
+            declared = ["@%s" % name for name in names]
+        else:
+            declared = ["@P%d" % n for n in range(1, len(values) + 1)]
+        declarations = ", ".join(
+            "%s %s" % (name, type_name)
+            for name, type_name in zip(declared, key[2])
+        )
+        statement = "EXEC sp_executesql N'%s', N'%s'%s" % (
+            inner.replace("'", "''"),
+            declarations,
+            "".join(", %s=%%s" % name for name in declared),
+        )
+        with self._statements_lock:
+            self.statements[key] = statement
+            while len(self.statements) > self.config.get(
+                    "statement_cache_size", 256):
+                self.statements.popitem(last=False)
+        return statement, values
+
+    def param_type(self, value):
+        """Pick the T-SQL type of a bind parameter, see `sql_type`."""
+        return sql_type(
+            value,
+            varchar=self.config.get("varchar_parameters", False),
+            decimal_scale=self.config.get("decimal_scale", DECIMAL_SCALE),
+        )
+
+    def execute(self, cursor, query_string, params=None):
+        """Execute a statement, via `sp_executesql` if it has params."""
+        if params is None:
+            cursor.execute(query_string)
+        elif not params or not self.config.get("prepare_statements", True):
+            cursor.execute(query_string, params)
+        else:
+            cursor.execute(*self.prepare(query_string, params))
+
+    def execute_many(self, cursor, query_string, seq_of_params):
+        """Execute a statement per parameter set, as pymssql does."""
+        rowcount = 0
+        for params in seq_of_params:
+            self.execute(cursor, query_string, params)
+            rowcount += max(cursor.rowcount, 0)
+        return rowcount
+
+    def quote_identifier(self, name):
+        """Quote an identifier with T-SQL brackets."""
+        return ".".join("[%s]" % part.replace("]", "]]")
+                        for part in name.split("."))
+
+    def max_insert_rows(self, ncolumns):
+        """
+        Largest number of rows to send in one INSERT statement.
+
+        SQL Server allows 1000 rows per VALUES clause and 2100 parameters
+        per request.
+        """
+        return min(1000, 2099 // max(ncolumns, 1))
+
+    def run_query(self, query_string, params=None):
         """
         Run a query against an MS-SQL database.
 
@@ -52,28 +315,139 @@ class MSSQLDriver(DatabaseDriver):
 
         :param query_string: query to be run.
         :param type: str
+        :param params: Bind parameters for `%s` or `%(name)s` placeholders.
         :returns: The results of the query.
         :rtype: list(dict:?)
         """
-        with pymssql.connect(**self.config["connection"]) as conn:
+        with self.connection() as conn:
             with conn.cursor(as_dict=True) as cursor:
-                cursor.execute(query_string)
+                self.execute(cursor, query_string, params)
                 return [row for row in cursor]
 
-    def run_stored_proc(self, proc_name, *variables):
+    def iter_rows(self, query_string, params=None):
         """
-        Run a stored procedure against an MS-SQL database.
+        Run a query against an MS-SQL database, yielding rows as they arrive.
 
-        This method will run stored procedures agains an MS-SQL
-        database using this driver.
+        pymssql fetches rows from the server lazily while the cursor is
+        iterated, so tuple rows are passed on without building a list. If
+        the generator is closed before the last row, the remaining results
+        are cancelled rather than read.
 
-        :param stored_proc: The name of the stored procedure to be run.
+        :param query_string: query to be run.
         :param type: str
-        :param variables: variables to be passed to the stored procedure.
-        :returns: The results of the query.
-        :rtype: list(dict:?)
+        :param params: Bind parameters for the query, if any.
+        :returns: A generator of column names, then rows.
+        :rtype: generator
         """
-        with pymssql.connect(**self.connection_dict) as conn:
-            with conn.cursor(as_dict=True) as cursor:
-                cursor.callproc(proc_name, variables)
-                return [row for row in cursor]
+        with self.connection() as conn:
+            with conn.cursor() as cursor:
+                self.execute(cursor, query_string, params)
+                if cursor.description is None:
+                    yield Columns()
+                    return
+                yield self.describe(cursor.description)
+                try:
+                    for row in cursor:
+                        yield row
+                except GeneratorExit:
+                    self._cancel_quietly(conn)
+                    raise
+
+    def proc_statement(self, proc_name, params):
+        """
+        Build the batch calling a stored procedure.
+
+        Output parameters are declared as variables, passed with OUTPUT
+        and selected after the call, so their values arrive as the final
+        result set of the same round trip::
+
+            DECLARE @O1 BIGINT = %s;
+            EXEC [dbo].[report] @start = %s, @total = @O1 OUTPUT;
+            SELECT @O1 AS [@total]
+
+        :returns: The statement, its parameter values, and the output
+                  result set's column names mapped to output keys.
+        :rtype: tuple(str, tuple, OrderedDict)
+        """
+        declarations = []
+        declared = []
+        arguments = []
+        values = []
+        outputs = OrderedDict()
+        for n, param in enumerate(params):
+            if param.output:
+                variable = "@O%d" % n
+                if param.value is not None:
+                    type_name = self.param_type(param.value)
+                else:
+                    type_name = SQL_TYPES.get(param.type, "NVARCHAR(MAX)")
+                declarations.append("DECLARE %s %s = %%s; " % (variable,
+                                                                type_name))
+                declared.append(param.value)
+                argument = variable + " OUTPUT"
+                outputs[variable] = output_key(param, n)
+            else:
+                argument = "%s"
+                values.append(param.value)
+            if param.name is not None:
+                argument = "@%s = %s" % (param.name, argument)
+            arguments.append(argument)
+        statement = "%sEXEC %s %s" % ("".join(declarations),
+                                      self.quote_identifier(proc_name),
+                                      ", ".join(arguments))
+        statement = statement.rstrip()
+        if outputs:
+            statement += "; SELECT " + ", ".join(
+                "%s AS [@%s]" % (variable, key.replace("]", "]]"))
+                for variable, key in outputs.items()
+            )
+        return statement, tuple(declared + values), OrderedDict(
+            ("@" + key, key) for key in outputs.values()
+        )
+
+    def run_stored_proc(self, proc_name, params=()):
+        """
+        Call a stored procedure on an MS-SQL database in one round trip.
+
+        Every result set is streamed with `nextset`. Those without columns,
+        e.g. row counts of statements inside the procedure, are skipped.
+        Output parameters come back as the batch's last result set, see
+        `proc_statement`.
+
+        :param proc_name: The name of the stored procedure to be run.
+        :param type: str
+        :param params: The call's parameters.
+        :type params: list(:py:class:`procedures.ProcParam`)
+        :returns: A generator of columns and rows, then output values.
+        :rtype: generator
+        """
+        statement, values, outputs = self.proc_statement(proc_name, params)
+        with self.connection() as conn:
+            with conn.cursor() as cursor:
+                self.execute(cursor, statement, values or None)
+                try:
+                    more = True
+                    while more:
+                        if cursor.description is None:
+                            more = cursor.nextset()
+                            continue
+                        columns = self.describe(cursor.description)
+                        if outputs and list(columns) == list(outputs):
+                            # Most likely the output parameters, unless
+                            # another result set follows.
+                            rows = list(cursor)
+                            more = cursor.nextset()
+                            if not more and rows:
+                                yield dict(zip(outputs.values(), rows[0]))
+                                return
+                            yield columns
+                            for row in rows:
+                                yield row
+                            continue
+                        yield columns
+                        for row in cursor:
+                            yield row
+                        more = cursor.nextset()
+                except GeneratorExit:
+                    self._cancel_quietly(conn)
+                    raise
@@ -0,0 +1,305 @@
+"""Connection pooling for database drivers."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import collections
+import contextlib
+import logging
+import threading
+import time
+import weakref
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_POOL_OPTIONS = {
+    "min_size": 0,
+    "max_size": 10,
+    "idle_timeout": 300,
+    "max_lifetime": 3600,
+    "wait_timeout": 10,
+    "health_check": True,
+}
+
+# Seconds between maintenance passes over every open pool.
+MAINTENANCE_INTERVAL = 30
+
+_POOLS = weakref.WeakSet()
+_MAINTENANCE_LOCK = threading.Lock()
+_maintenance_thread = None
+
+
+def _maintenance_loop():
+    while True:
+        time.sleep(MAINTENANCE_INTERVAL)
+        for pool in list(_POOLS):
+            try:
+                pool.maintain()
+            except Exception:
+                LOG.exception("Connection pool maintenance failed.")
+
+
+def _register(pool):
+    """Add a pool to the maintenance pass, starting it if needed."""
+    global _maintenance_thread
+    with _MAINTENANCE_LOCK:
+        _POOLS.add(pool)
+        if _maintenance_thread is None:
+            _maintenance_thread = threading.Thread(
+                target=_maintenance_loop, name="pool-maintenance"
+            )
+            _maintenance_thread.daemon = True
+            _maintenance_thread.start()
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection could be checked out in time."""
+
+
+class PooledConnection(object):
+    """
+    Bookkeeping wrapper for a connection owned by a pool.
+
+    :param connection: The raw DB-API connection.
+    """
+
+    __slots__ = ("connection", "created", "last_used")
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.created = self.last_used = time.time()
+
+
+class ConnectionPool(object):
+    """
+    Bounded, thread-safe pool of DB-API connections.
+
+    Connections are created through `factory`, validated through `check`
+    when checked out, and closed once they exceed `idle_timeout` seconds
+    without use or `max_lifetime` seconds of age. When `max_size`
+    connections are checked out, callers wait up to `wait_timeout`
+    seconds before a :py:class:`PoolTimeout` is raised.
+
+    Every `MAINTENANCE_INTERVAL` seconds a shared background thread
+    closes expired idle connections and opens new ones up to `min_size`,
+    see :py:meth:`maintain`.
+
+    :param factory: Callable returning a new raw connection.
+    :param check: Callable taking a raw connection and returning True if
+                  it is still usable.
+    :param reset: Callable run on a raw connection when it is released,
+                  e.g. to roll back an open transaction.
+    :param options: Pool options, see `DEFAULT_POOL_OPTIONS`.
+    :type options: dict
+    """
+
+    def __init__(self, factory, check=None, reset=None, **options):
+        self.factory = factory
+        self.check = check
+        self.reset = reset
+        opts = dict(DEFAULT_POOL_OPTIONS)
+        opts.update(options)
+        self.min_size = int(opts["min_size"])
+        self.max_size = int(opts["max_size"])
+        self.idle_timeout = opts["idle_timeout"]
+        self.max_lifetime = opts["max_lifetime"]
+        self.wait_timeout = opts["wait_timeout"]
+        self.health_check = opts["health_check"]
+
+        self._idle = collections.deque()
+        self._size = 0
+        self._checked_out = {}
+        self._closed = False
+        self._cond = threading.Condition(threading.Lock())
+
+        for _ in range(self.min_size):
+            self._idle.append(PooledConnection(self.factory()))
+            self._size += 1
+        _register(self)
+
+    @property
+    def size(self):
+        """Total number of open connections, idle or checked out."""
+        return self._size
+
+    @property
+    def idle(self):
+        """Number of idle connections waiting in the pool."""
+        return len(self._idle)
+
+    @property
+    def in_use(self):
+        """Number of connections currently checked out."""
+        return len(self._checked_out)
+
+    def _expired(self, pooled, now):
+        if self.max_lifetime and now - pooled.created > self.max_lifetime:
+            return True
+        if self.idle_timeout and now - pooled.last_used > self.idle_timeout:
+            return True
+        return False
+
+    def _discard(self, pooled):
+        """Close a connection and free its slot. Call without the lock."""
+        try:
+            pooled.connection.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def _healthy(self, pooled):
+        if not self.health_check or self.check is None:
+            return True
+        try:
+            return bool(self.check(pooled.connection))
+        except Exception:
+            return False
+
+    def acquire(self):
+        """
+        Check a connection out of the pool.
+
+        :returns: A raw DB-API connection.
+        :raises PoolTimeout: If the pool stays exhausted for `wait_timeout`.
+        """
+        deadline = None
+        if self.wait_timeout is not None:
+            deadline = time.time() + self.wait_timeout
+        while True:
+            pooled = None
+            create = False
+            with self._cond:
+                if self._closed:
+                    raise PoolTimeout("Connection pool is closed.")
+                while not self._idle and self._size >= self.max_size:
+                    remaining = None
+                    if deadline is not None:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            raise PoolTimeout(
+                                "Timed out waiting for a database connection."
+                            )
+                    self._cond.wait(remaining)
+                if self._idle:
+                    pooled = self._idle.pop()
+                else:
+                    self._size += 1
+                    create = True
+
+            if create:
+                try:
+                    pooled = PooledConnection(self.factory())
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            elif (self._expired(pooled, time.time()) or
+                  not self._healthy(pooled)):
+                self._discard(pooled)
+                continue
+
+            with self._cond:
+                self._checked_out[id(pooled.connection)] = pooled
+            return pooled.connection
+
+    def release(self, connection, discard=False):
+        """
+        Return a connection to the pool.
+
+        :param connection: A connection previously returned by `acquire`.
+        :param discard: Close the connection instead of reusing it, e.g.
+                        after an error left it in an unknown state.
+        :type discard: bool
+        """
+        with self._cond:
+            pooled = self._checked_out.pop(id(connection), None)
+        if pooled is None:
+            return
+        if not discard and self.reset is not None:
+            try:
+                self.reset(connection)
+            except Exception:
+                discard = True
+        now = time.time()
+        if discard or self._closed or self._expired(pooled, now):
+            self._discard(pooled)
+            return
+        pooled.last_used = now
+        with self._cond:
+            self._idle.append(pooled)
+            self._cond.notify()
+
+    @contextlib.contextmanager
+    def connection(self):
+        """
+        Context manager checking a connection out for the enclosed block.
+
+        The connection is always released, and is discarded by `release`
+        if it can no longer be reset.
+        """
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def prune(self):
+        """Close idle connections past their idle timeout or lifetime."""
+        now = time.time()
+        with self._cond:
+            keep = collections.deque()
+            stale = []
+            for pooled in self._idle:
+                if self._expired(pooled, now):
+                    stale.append(pooled)
+                else:
+                    keep.append(pooled)
+            self._idle = keep
+        for pooled in stale:
+            self._discard(pooled)
+
+    def refill(self):
+        """Open idle connections until the pool holds `min_size`."""
+        while True:
+            with self._cond:
+                if self._closed or self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                pooled = PooledConnection(self.factory())
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._idle.appendleft(pooled)
+                self._cond.notify()
+
+    def maintain(self):
+        """Close expired idle connections, then refill to `min_size`."""
+        self.prune()
+        self.refill()
+
+    def close(self):
+        """Close every idle connection and refuse further checkouts."""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = list(self._idle), collections.deque()
+            self._cond.notify_all()
+        for pooled in idle:
+            self._discard(pooled)
@@ -0,0 +1,143 @@
+"""Typed parameters for stored procedure calls."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import base64
+import binascii
+import datetime
+import decimal
+import uuid
+
+import six
+
+
+def _parse_temporal(formats):
+    def parse(value):
+        for fmt in formats:
+            try:
+                return datetime.datetime.strptime(value, fmt)
+            except ValueError:
+                continue
+        raise ValueError("Invalid date or time %r." % (value,))
+    return parse
+
+
+_parse_datetime = _parse_temporal([
+    "%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%d %H:%M:%S",
+])
+_parse_time = _parse_temporal(["%H:%M:%S.%f", "%H:%M:%S"])
+
+
+def _parse_bool(value):
+    if not isinstance(value, bool):
+        raise ValueError("Invalid boolean %r." % (value,))
+    return value
+
+
+def _parse_binary(value):
+    try:
+        return base64.b64decode(value)
+    except (TypeError, binascii.Error):
+        raise ValueError("Invalid base64 %r." % (value,))
+
+
+# Parameter types clients may declare, and how JSON values are converted
+# to them. Dates and times are written in ISO 8601 and binary values in
+# base64, as in query results.
+PARAM_TYPES = {
+    "int": int,
+    "float": float,
+    "decimal": lambda value: decimal.Decimal(six.text_type(value)),
+    "string": six.text_type,
+    "bool": _parse_bool,
+    "date": lambda value: _parse_datetime(value + "T00:00:00").date(),
+    "datetime": _parse_datetime,
+    "time": lambda value: _parse_time(value).time(),
+    "binary": _parse_binary,
+    "uuid": uuid.UUID,
+}
+
+
+class ProcParam(object):
+    """
+    One parameter of a stored procedure call.
+
+    :param name: The parameter's name, without any `@`, or None for a
+                 positional parameter.
+    :param value: Its value, already converted to `type`.
+    :param type: A key of `PARAM_TYPES`, or None if not declared.
+    :param output: Whether the procedure writes the parameter back, so
+                   its value is returned with the results.
+    """
+
+    __slots__ = ("name", "value", "type", "output")
+
+    def __init__(self, name, value=None, type=None, output=False):
+        self.name = name
+        self.value = value
+        self.type = type
+        self.output = output
+
+
+def output_key(param, position):
+    """The key an output parameter's value is returned under."""
+    return param.name if param.name is not None else str(position)
+
+
+def load_proc_param(name, spec):
+    """
+    Read one parameter of a call from its JSON form.
+
+    A plain JSON value is passed as is. An object may declare the value's
+    type, and mark the parameter as output:
+    `{"value": "2016-01-31", "type": "date", "output": false}`.
+
+    :raises ValueError: If the type is unknown or the value invalid.
+    """
+    if not isinstance(spec, dict):
+        return ProcParam(name, spec)
+    type_name = spec.get("type")
+    value = spec.get("value")
+    if type_name is not None:
+        if type_name not in PARAM_TYPES:
+            raise ValueError("Unknown parameter type %r." % (type_name,))
+        if value is not None:
+            try:
+                value = PARAM_TYPES[type_name](value)
+            except (TypeError, ValueError, decimal.InvalidOperation):
+                raise ValueError("Invalid %s parameter %r."
+                                 % (type_name, value))
+    return ProcParam(name, value, type_name, bool(spec.get("output")))
+
+
+def load_proc_params(params):
+    """
+    Read the parameters of a stored procedure call from its JSON form.
+
+    :param params: An array of positional parameters, an object of named
+                   ones, or None. Output values of positional parameters
+                   are returned under their position, counted from 0.
+    :rtype: list(:py:class:ProcParam)
+    :raises ValueError: If the parameters are malformed.
+    """
+    if params is None:
+        return []
+    if isinstance(params, list):
+        return [load_proc_param(None, spec) for spec in params]
+    if isinstance(params, dict):
+        return [load_proc_param(name.lstrip("@"), spec)
+                for name, spec in sorted(params.items())]
+    raise ValueError("Params must be an array or object.")
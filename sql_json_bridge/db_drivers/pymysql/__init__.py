@@ -2,7 +2,27 @@
 
 import pymysql.cursors
 
+from pymysql.constants import FIELD_TYPE
+
+from sql_json_bridge import encoders
 from sql_json_bridge.db_drivers.base import DatabaseDriver
+from sql_json_bridge.db_drivers.procedures import output_key
+from sql_json_bridge.limits import CANCEL_GRACE
+
+# Kinds of the MySQL column types pymysql converts to Python types that
+# JSON lacks. BLOB and string types share type codes, so binary strings
+# are left to the encoder's per-value fallback.
+COLUMN_KINDS = {
+    FIELD_TYPE.DECIMAL: encoders.DECIMAL,
+    FIELD_TYPE.NEWDECIMAL: encoders.DECIMAL,
+    FIELD_TYPE.DATE: encoders.TEMPORAL,
+    FIELD_TYPE.NEWDATE: encoders.TEMPORAL,
+    FIELD_TYPE.DATETIME: encoders.TEMPORAL,
+    FIELD_TYPE.TIMESTAMP: encoders.TEMPORAL,
+    FIELD_TYPE.TIME: encoders.TIMEDELTA,
+    FIELD_TYPE.BIT: encoders.BINARY,
+    FIELD_TYPE.GEOMETRY: encoders.BINARY,
+}
 
 
 class MySQLDriver(DatabaseDriver):
@@ -18,8 +38,41 @@ class MySQLDriver(DatabaseDriver):
         - password: The password to use to connect.
         - port:     The port to utilize.
         - db:       The database to connect to.
+
+    With a `statement_timeout` in the database's `limits`, overrunning
+    statements are stopped with `KILL QUERY`, and `read_timeout` defaults
+    to a few seconds longer as a backstop.
     """
 
+    column_kinds = COLUMN_KINDS
+
+    # KILL QUERY is sent over its own connection.
+    cancel_is_threadsafe = True
+
+    # INFORMATION_SCHEMA covers every database on the server; only the
+    # connected one is introspected.
+    tables_query = (
+        "SELECT TABLE_SCHEMA, TABLE_NAME, TABLE_TYPE "
+        "FROM information_schema.TABLES "
+        "WHERE TABLE_SCHEMA = DATABASE() "
+        "ORDER BY TABLE_NAME"
+    )
+    columns_query = (
+        "SELECT TABLE_SCHEMA, TABLE_NAME, COLUMN_NAME, DATA_TYPE, "
+        "IS_NULLABLE, CHARACTER_MAXIMUM_LENGTH, NUMERIC_PRECISION, "
+        "NUMERIC_SCALE "
+        "FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() "
+        "ORDER BY TABLE_NAME, ORDINAL_POSITION"
+    )
+    indexes_query = (
+        "SELECT TABLE_SCHEMA, TABLE_NAME, INDEX_NAME, COLUMN_NAME, "
+        "NON_UNIQUE = 0, INDEX_NAME = 'PRIMARY' "
+        "FROM information_schema.STATISTICS "
+        "WHERE TABLE_SCHEMA = DATABASE() "
+        "ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX"
+    )
+
     def __init__(self, database_config):
         """
         Initialize this driver using connection information.
@@ -27,30 +80,209 @@ class MySQLDriver(DatabaseDriver):
         :param args: args to be passed to the connect method.
         :param kwargs: kwargs to be passed to the connect method.
         """
-        self.config = database_config
+        super(MySQLDriver, self).__init__(database_config)
 
     def connect(self, *args, **kwargs):
-        """Connect method is not implemented in this driver."""
+        """Open a new connection for the driver's pool."""
+        options = dict(self.config["connection"])
+        timeout = self.limits["statement_timeout"]
+        if timeout:
+            options.setdefault("read_timeout", timeout + CANCEL_GRACE)
         connection = pymysql.connect(cursorclass=pymysql.cursors.DictCursor,
-                                     **self.config["connection"])
+                                     **options)
         return connection
 
-    def run_query(self, query_string):
+    def cancel(self, connection):
+        """
+        Stop the statement running on a connection with `KILL QUERY`.
+
+        The kill is sent from a separate, short-lived connection, since
+        the target connection is busy.
+        """
+        options = dict(self.config["connection"])
+        options.setdefault("connect_timeout", CANCEL_GRACE)
+        killer = pymysql.connect(**options)
+        try:
+            with killer.cursor() as cur:
+                cur.execute("KILL QUERY %d" % connection.thread_id())
+        finally:
+            killer.close()
+        return True
+
+    def check_connection(self, connection):
+        """Ping the server without reconnecting."""
+        connection.ping(reconnect=False)
+        return True
+
+    def replica_lag(self, connection):
+        """
+        Read `Seconds_Behind_Master` from `SHOW SLAVE STATUS`.
+
+        A replica whose replication threads are stopped reports no value,
+        and counts as infinitely far behind.
         """
-        Run a query against an MS-SQL database.
+        with connection.cursor(pymysql.cursors.DictCursor) as cur:
+            cur.execute("SHOW SLAVE STATUS")
+            status = cur.fetchone()
+        if not status:
+            return None
+        lag = status.get("Seconds_Behind_Master")
+        return float("inf") if lag is None else float(lag)
 
-        This method will run arbitrary queries against an MS-SQL
+    def cursor(self, connection):
+        """Open a tuple cursor, overriding the connection's DictCursor."""
+        return connection.cursor(pymysql.cursors.Cursor)
+
+    def quote_identifier(self, name):
+        """Quote an identifier with MySQL backticks."""
+        return ".".join("`%s`" % part.replace("`", "``")
+                        for part in name.split("."))
+
+    def insert_batch(self, cursor, table, columns, rows):
+        """
+        Insert a batch of rows through `executemany`.
+
+        pymysql rewrites an `INSERT ... VALUES` executemany into multi-row
+        INSERT statements sized to fit `max_allowed_packet`.
+        """
+        self.execute_many(
+            cursor,
+            "INSERT INTO %s (%s) VALUES (%s)" % (
+                table,
+                ", ".join(columns),
+                ", ".join(["%s"] * len(columns)),
+            ),
+            rows,
+        )
+
+    def run_query(self, query_string, params=None):
+        """
+        Run a query against a MySQL database.
+
+        This method will run arbitrary queries against a MySQL
         database using this driver.
 
+        pymysql only implements the text protocol, so bind parameters are
+        escaped and interpolated client-side; MySQL has no plan cache for
+        a server-side prepare to benefit from.
+
         :param query_string: query to be run.
         :param type: str
+        :param params: Bind parameters for `%s` or `%(name)s` placeholders.
         :returns: The results of the query.
         :rtype: list(dict:?)
         """
-        try:
-            connection = self.connect()
+        with self.connection() as connection:
             with connection.cursor() as cur:
-                cur.execute(query_string)
+                self.execute(cur, query_string, params)
                 return cur.fetchall()
-        finally:
-            connection.close()
+
+    def iter_rows(self, query_string, params=None):
+        """
+        Run a query against a MySQL database, yielding rows as they arrive.
+
+        Rows are read as tuples through an unbuffered `SSCursor`, so the
+        result set is never held in memory as a whole. If the generator is
+        closed before the last row, the query is killed rather than
+        drained.
+
+        :param query_string: query to be run.
+        :param type: str
+        :param params: Bind parameters for the query, if any.
+        :returns: A generator of column names, then rows.
+        :rtype: generator
+        """
+        with self.connection() as connection:
+            cur = connection.cursor(pymysql.cursors.SSCursor)
+            cancelled = False
+            try:
+                self.execute(cur, query_string, params)
+                yield self.describe(cur.description)
+                row = cur.fetchone()
+                while row is not None:
+                    yield row
+                    row = cur.fetchone()
+            except GeneratorExit:
+                cancelled = self._cancel_quietly(connection)
+                raise
+            finally:
+                try:
+                    cur.close()
+                except pymysql.err.MySQLError:
+                    # Reading the rest of a killed query fails; the pool
+                    # discards the connection when it can't be reset.
+                    if not cancelled:
+                        raise
+
+    def run_stored_proc(self, proc_name, params=()):
+        """
+        Call a stored procedure on a MySQL database with `CALL`.
+
+        Every result set is streamed through an unbuffered cursor with
+        `nextset`. MySQL has no named arguments, so parameters must be
+        positional. OUT and INOUT parameters are passed as session
+        variables, which take a `SET` before the call if they have a value
+        and a `SELECT` after it; calls without them take one round trip.
+
+        :param proc_name: The name of the stored procedure to be run.
+        :param type: str
+        :param params: The call's parameters.
+        :type params: list(:py:class:`procedures.ProcParam`)
+        :returns: A generator of columns and rows, then output values.
+        :rtype: generator
+        """
+        arguments = []
+        values = []
+        outputs = []
+        initial = []
+        for n, param in enumerate(params):
+            if param.name is not None:
+                raise ValueError(
+                    "MySQL procedures only take positional parameters."
+                )
+            if param.output:
+                variable = "@_sql_json_bridge_%d" % n
+                # Also clears values left on the pooled connection.
+                initial.append((variable, param.value))
+                arguments.append(variable)
+                outputs.append((output_key(param, n), variable))
+            else:
+                arguments.append("%s")
+                values.append(param.value)
+        with self.connection() as connection:
+            cur = connection.cursor(pymysql.cursors.SSCursor)
+            cancelled = False
+            try:
+                if initial:
+                    self.execute(cur, "SET " + ", ".join(
+                        "%s = %%s" % variable for variable, value in initial
+                    ), [value for variable, value in initial])
+                self.execute(cur, "CALL %s(%s)" % (
+                    self.quote_identifier(proc_name), ", ".join(arguments)
+                ), values or None)
+                more = True
+                while more:
+                    # The call's own status comes last, without columns.
+                    if cur.description is not None:
+                        yield self.describe(cur.description)
+                        row = cur.fetchone()
+                        while row is not None:
+                            yield row
+                            row = cur.fetchone()
+                    more = cur.nextset()
+                if outputs:
+                    self.execute(cur, "SELECT " + ", ".join(
+                        variable for key, variable in outputs
+                    ))
+                    row = cur.fetchone()
+                    cur.fetchall()
+                    yield dict(zip([key for key, variable in outputs], row))
+            except GeneratorExit:
+                cancelled = self._cancel_quietly(connection)
+                raise
+            finally:
+                try:
+                    cur.close()
+                except pymysql.err.MySQLError:
+                    if not cancelled:
+                        raise
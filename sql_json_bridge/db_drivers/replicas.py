@@ -0,0 +1,295 @@
+"""Read replica selection and health checking."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import logging
+import threading
+
+from sql_json_bridge.db_drivers import load_db_driver
+from sql_json_bridge.db_drivers.pool import PoolTimeout
+from sql_json_bridge.metrics import REPLICA_HEALTHY, REPLICA_LAG_SECONDS
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_REPLICA_OPTIONS = {
+    "balance": "least_outstanding",
+    "check_interval": 5,
+    "eject_after": 3,
+    "readmit_after": 2,
+    "max_lag": None,
+    "fallback_to_primary": True,
+}
+
+BALANCE_POLICIES = ("least_outstanding", "round_robin")
+
+
+class NoReplicaAvailable(Exception):
+    """Raised when every replica is down and reads may not use the primary."""
+
+
+def load_replica_options(config):
+    """
+    Read the optional `replica_policy` section of a database config.
+
+    :rtype: dict
+    """
+    options = dict(DEFAULT_REPLICA_OPTIONS)
+    options.update(config.get("replica_policy") or {})
+    if options["balance"] not in BALANCE_POLICIES:
+        raise ValueError("Unknown replica balance policy %r."
+                         % options["balance"])
+    return options
+
+
+class ReplicaConfig(object):
+    """
+    View of a database config for one of its replicas.
+
+    A replica's `connection` is merged over the primary's, so replicas
+    usually only name their host. Other keys of the replica entry, e.g.
+    `pool` or `limits`, replace the primary's; everything else is read
+    from the primary's config.
+
+    :param config: The :py:class:DbConfig or :py:class:BoundDbConfig.
+    :param index: Position of the replica in the `replicas` list.
+    """
+
+    def __init__(self, config, index):
+        self.config = config
+        self.index = index
+
+    def __getitem__(self, key):
+        replica = self.config["replicas"][self.index]
+        if key == "connection":
+            connection = dict(self.config["connection"])
+            connection.update(replica.get("connection") or {})
+            return connection
+        if key in replica:
+            return replica[key]
+        return self.config[key]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+class Replica(object):
+    """
+    Health and balancing state of one replica.
+
+    :param driver: The replica's :py:class:base.DatabaseDriver.
+    :param name: Name used in logs and metrics.
+    :param weight: Relative share of reads the replica should get.
+    """
+
+    def __init__(self, driver, name, weight=1):
+        self.driver = driver
+        self.name = name
+        self.weight = max(float(weight), 0.001)
+        self.healthy = True
+        self.failures = 0
+        self.successes = 0
+        self.lag = None
+        self.current_weight = 0.0
+
+    @property
+    def outstanding(self):
+        """Queries running on the replica, i.e. connections checked out."""
+        pool = self.driver._pool
+        return pool.in_use if pool is not None else 0
+
+
+class ReplicaSet(object):
+    """
+    The read replicas of one database, and how reads are spread on them.
+
+    Configured with a `replicas` list and an optional `replica_policy`:
+
+    .. code-block:: yaml
+
+        replicas:
+            - name: "replica-1"     # optional, defaults to the host
+              weight: 2             # optional, defaults to 1
+              connection:
+                  host: "replica-1.example.com"
+            - connection:
+                  host: "replica-2.example.com"
+        replica_policy:             # optional, defaults shown
+            balance: least_outstanding  # or round_robin
+            check_interval: 5       # seconds between health checks
+            eject_after: 3          # failed checks before ejection
+            readmit_after: 2        # passed checks before re-admission
+            max_lag: null           # seconds of replication lag allowed
+            fallback_to_primary: true
+
+    `least_outstanding` sends each read to the replica with the fewest
+    queries running per unit of weight; `round_robin` rotates through
+    replicas in proportion to their weight. Either way, replicas that
+    are ejected, or lag further behind than `max_lag` according to
+    :py:meth:`DatabaseDriver.replica_lag`, are skipped.
+
+    :param config: The :py:class:DbConfig or :py:class:BoundDbConfig.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.options = load_replica_options(config)
+        self.database = config["identifier"].pattern
+        self.replicas = []
+        for n, entry in enumerate(config["replicas"]):
+            replica_config = ReplicaConfig(config, n)
+            name = entry.get("name") or (
+                replica_config["connection"].get("host") or
+                replica_config["connection"].get("server") or
+                "replica-%d" % n
+            )
+            self.replicas.append(Replica(
+                load_db_driver(config["driver"], replica_config),
+                name,
+                entry.get("weight", 1),
+            ))
+            REPLICA_HEALTHY.set((self.database, name), 1)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        if self.options["check_interval"]:
+            self.start(self.options["check_interval"])
+
+    def available(self):
+        """Replicas currently eligible for reads."""
+        max_lag = self.options["max_lag"]
+        return [replica for replica in self.replicas
+                if replica.healthy and (max_lag is None or
+                                        replica.lag is None or
+                                        replica.lag <= max_lag)]
+
+    def _round_robin(self, replicas):
+        # Smooth weighted round robin, as in nginx: spreads picks of a
+        # heavier replica out instead of sending them back to back.
+        total = 0.0
+        best = None
+        for replica in replicas:
+            replica.current_weight += replica.weight
+            total += replica.weight
+            if best is None or replica.current_weight > best.current_weight:
+                best = replica
+        best.current_weight -= total
+        return best
+
+    def choose(self):
+        """
+        Pick the replica to send a read to.
+
+        :returns: The replica's driver, or None if no replica is available
+                  and reads should go to the primary.
+        :raises NoReplicaAvailable: If no replica is available and
+                                    `fallback_to_primary` is off.
+        """
+        candidates = self.available()
+        if not candidates:
+            if self.options["fallback_to_primary"]:
+                return None
+            raise NoReplicaAvailable("No healthy replica available.")
+        with self._lock:
+            if self.options["balance"] == "least_outstanding":
+                loads = [replica.outstanding / replica.weight
+                         for replica in candidates]
+                least = min(loads)
+                # Ties, e.g. when idle, are broken by weighted rotation.
+                candidates = [replica for replica, load
+                              in zip(candidates, loads) if load == least]
+            return self._round_robin(candidates).driver
+
+    def check_replica(self, replica):
+        """Run one health check against a replica and update its state."""
+        driver = replica.driver
+        try:
+            connection = driver.pool.acquire()
+        except PoolTimeout:
+            # Every connection is busy serving reads; not a failure.
+            return
+        except Exception as e:
+            self._failed(replica, e)
+            return
+        discard = False
+        try:
+            if not driver.check_connection(connection):
+                raise RuntimeError("Connection check failed.")
+            if self.options["max_lag"] is not None:
+                try:
+                    replica.lag = driver.replica_lag(connection)
+                except Exception:
+                    LOG.exception("Could not read lag of replica %s.",
+                                  replica.name)
+                    replica.lag = None
+                if replica.lag is not None:
+                    REPLICA_LAG_SECONDS.set((self.database, replica.name),
+                                            replica.lag)
+        except Exception as e:
+            discard = True
+            self._failed(replica, e)
+            return
+        finally:
+            driver.pool.release(connection, discard=discard)
+        self._passed(replica)
+
+    def _failed(self, replica, error):
+        replica.successes = 0
+        replica.failures += 1
+        if replica.healthy and replica.failures >= self.options["eject_after"]:
+            replica.healthy = False
+            REPLICA_HEALTHY.set((self.database, replica.name), 0)
+            LOG.warning("Ejected replica %s of %s: %s",
+                        replica.name, self.database, error)
+
+    def _passed(self, replica):
+        replica.failures = 0
+        replica.successes += 1
+        if (not replica.healthy and
+                replica.successes >= self.options["readmit_after"]):
+            replica.healthy = True
+            REPLICA_HEALTHY.set((self.database, replica.name), 1)
+            LOG.info("Re-admitted replica %s of %s.",
+                     replica.name, self.database)
+
+    def check(self):
+        """Health check every replica once."""
+        for replica in self.replicas:
+            self.check_replica(replica)
+
+    def start(self, interval):
+        """Health check replicas every `interval` seconds in a thread."""
+        if self._thread is not None:
+            return
+
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    self.check()
+                except Exception:
+                    LOG.exception("Replica health check failed.")
+
+        self._thread = threading.Thread(target=run,
+                                        name="replica-health-check")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        """Stop health checks and close every replica's pool."""
+        self._stop.set()
+        for replica in self.replicas:
+            replica.driver.close()
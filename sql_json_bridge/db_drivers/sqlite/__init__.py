@@ -0,0 +1,168 @@
+"""SQLite database driver, using the standard library."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import re
+import sqlite3
+
+from collections import OrderedDict
+
+from sql_json_bridge.db_drivers.base import DatabaseDriver
+
+_PLACEHOLDER = re.compile(r"%\((\w+)\)s|%s|%%")
+
+
+def to_qmark(query_string):
+    """Rewrite `%s` and `%(name)s` placeholders for sqlite3."""
+    def replace(match):
+        if match.group() == "%%":
+            return "%"
+        if match.group(1) is not None:
+            return ":" + match.group(1)
+        return "?"
+    return _PLACEHOLDER.sub(replace, query_string)
+
+
+class SQLiteDriver(DatabaseDriver):
+    """
+    Driver for SQLite database files, using the standard library.
+
+    Mainly a local stand-in for benchmarks and development, since it
+    needs no server. The connection dictionary takes:
+        - database: Path of the database file. With `uri: true`, a
+                    `file:` URI such as
+                    "file:bench?mode=memory&cache=shared" gives an
+                    in-memory database shared by all pooled connections.
+    Other keys are passed through to `sqlite3.connect`.
+
+    Statements use the same `%s` and `%(name)s` placeholders as the other
+    drivers; they are rewritten to sqlite3's own.
+    """
+
+    cancel_is_threadsafe = True
+
+    def connect(self, *args, **kwargs):
+        """Open a new connection for the driver's pool."""
+        options = dict(self.config["connection"])
+        options.setdefault("check_same_thread", False)
+        return sqlite3.connect(**options)
+
+    def check_connection(self, connection):
+        """Run a trivial query."""
+        connection.execute("SELECT 1").fetchall()
+        return True
+
+    def cancel(self, connection):
+        """Interrupt the running statement; safe from any thread."""
+        connection.interrupt()
+        return True
+
+    def introspect(self):
+        """Read tables, columns and indexes from sqlite_master and pragmas."""
+        tables = []
+        with self.connection() as connection:
+            for name, kind in connection.execute(
+                    "SELECT name, type FROM sqlite_master "
+                    "WHERE type IN ('table', 'view') "
+                    "AND name NOT LIKE 'sqlite_%' ORDER BY name").fetchall():
+                quoted = self.quote_identifier(name)
+                columns = [
+                    OrderedDict([("name", column), ("type", type_name),
+                                 ("nullable", not notnull and not pk),
+                                 ("max_length", None), ("precision", None),
+                                 ("scale", None)])
+                    for _, column, type_name, notnull, _, pk
+                    in connection.execute("PRAGMA table_info(%s)" % quoted)
+                ]
+                indexes = []
+                for index in connection.execute(
+                        "PRAGMA index_list(%s)" % quoted).fetchall():
+                    indexes.append(OrderedDict([
+                        ("name", index[1]),
+                        ("columns", [
+                            info[2] for info in connection.execute(
+                                "PRAGMA index_info(%s)"
+                                % self.quote_identifier(index[1]))
+                        ]),
+                        ("unique", bool(index[2])),
+                        ("primary", index[3] == "pk"),
+                    ]))
+                tables.append(OrderedDict([
+                    ("schema", "main"),
+                    ("name", name),
+                    ("type", kind),
+                    ("columns", columns),
+                    ("indexes", indexes),
+                ]))
+        return tables
+
+    def execute(self, cursor, query_string, params=None):
+        """Execute a statement, rewriting its placeholders if it has params."""
+        if params is not None:
+            query_string = to_qmark(query_string)
+        super(SQLiteDriver, self).execute(cursor, query_string, params)
+
+    def execute_many(self, cursor, query_string, seq_of_params):
+        """Execute a statement per parameter set."""
+        return super(SQLiteDriver, self).execute_many(
+            cursor, to_qmark(query_string), seq_of_params
+        )
+
+    def max_insert_rows(self, ncolumns):
+        """
+        Largest number of rows to send in one INSERT statement.
+
+        Older SQLite builds allow 999 bound parameters per statement.
+        """
+        return min(1000, 999 // max(ncolumns, 1))
+
+    def run_query(self, query_string, params=None):
+        """
+        Run a query against an SQLite database.
+
+        :param query_string: query to be run.
+        :param type: str
+        :param params: Bind parameters for `%s` or `%(name)s` placeholders.
+        :returns: The results of the query.
+        :rtype: list(dict:?)
+        """
+        columns, rows = self.stream_rows(query_string, params)
+        return [dict(zip(columns, row)) for row in rows]
+
+    def iter_rows(self, query_string, params=None):
+        """
+        Run a query against an SQLite database, yielding rows as they arrive.
+
+        sqlite3 steps through the result as the cursor is iterated, so rows
+        are never held in memory as a whole.
+
+        :param query_string: query to be run.
+        :param type: str
+        :param params: Bind parameters for the query, if any.
+        :returns: A generator of column names, then rows.
+        :rtype: generator
+        """
+        with self.connection() as connection:
+            cur = self.cursor(connection)
+            try:
+                self.execute(cur, query_string, params)
+                yield self.describe(cur.description)
+                for row in cur:
+                    yield row
+            except GeneratorExit:
+                self._cancel_quietly(connection)
+                raise
+            finally:
+                cur.close()
@@ -2,6 +2,47 @@
 
 DEBUG = False
 TESTING = False
-JSONIFY_PRETTYPRINT_REGULAR = True
-JSON_SORT_KEYS = True
+JSONIFY_PRETTYPRINT_REGULAR = False
+JSON_SORT_KEYS = False
+JSON_ENCODER = "auto"
 DATABASE_CONFIG_DIRECTORY = "/etc/sql_json_bridge/databases/"
+DATABASE_CONFIG_POLL_INTERVAL = 10
+DATABASE_ROUTER_CACHE_SIZE = 1024
+RESULT_CACHE_BACKEND = "local"
+RESULT_CACHE_OPTIONS = {"max_bytes": 64 * 1024 * 1024}
+ASYNC_OFFLOAD_THREADS = 64
+BATCH_MAX_STATEMENTS = 100
+BATCH_MAX_WORKERS = 16
+METRICS_ENABLED = True
+METRICS_SERVER_TIMING = True
+METRICS_PUBLIC = False
+COMPRESSION_ENABLED = False
+COMPRESSION_MIN_SIZE = 1024
+ETAG_ENABLED = False
+QUERY_MAX_ROWS = 100000
+CURSOR_TTL = 30
+CURSOR_MAX_OPEN = 64
+SCHEMA_CACHE_TTL = 300
+SCHEMA_CACHE_MAX_DATABASES = 1024
+FANOUT_MAX_DATABASES = 256
+FANOUT_MAX_WORKERS = 32
+FANOUT_TIMEOUT = 30
+JOB_MAX_WORKERS = 4
+JOB_MAX_PENDING = 64
+JOB_MAX_ROWS = 10000000
+JOB_MAX_BYTES = 1024 * 1024 * 1024
+JOB_RETENTION = 3600
+JOB_SPOOL_DIRECTORY = None
+CHANGES_POLL_INTERVAL = 1.0
+CHANGES_BUFFER_ROWS = 10000
+CHANGES_MAX_ROWS = 10000
+CHANGES_MAX_SUBSCRIPTIONS = 1024
+CHANGES_SUBSCRIPTION_TTL = 300
+CHANGES_MAX_WAIT = 30
+CHANGES_STREAM_DURATION = 300
+CHANGES_KEEPALIVE = 15
+AUTH_BACKEND = None
+AUTH_OPTIONS = {}
+AUTH_CACHE_TTL = 60
+AUTH_NEGATIVE_CACHE_TTL = 5
+AUTH_CACHE_MAX_ENTRIES = 10000
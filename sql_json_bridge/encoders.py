@@ -0,0 +1,268 @@
+"""JSON encoders for query results, with per-column type conversion."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import base64
+import datetime
+import decimal
+import json
+import sys
+import uuid
+
+from collections import OrderedDict
+
+import six
+
+from stevedore import driver
+
+# Kinds of column value that JSON has no type for. Drivers map the type
+# codes in a cursor description onto these, see
+# :py:meth:`DatabaseDriver.describe`.
+DECIMAL = "decimal"
+TEMPORAL = "temporal"
+TIMEDELTA = "timedelta"
+BINARY = "binary"
+UUID = "uuid"
+
+# dicts keep insertion order from 3.7 on, and are cheaper to build.
+ordered_dict = dict if sys.version_info >= (3, 7) else OrderedDict
+
+
+class Columns(list):
+    """
+    Column names of a result set, along with the kind of each column.
+
+    :param names: The column names.
+    :param kinds: One kind per column, e.g. :py:data:`DECIMAL`, or None
+                  where values need no conversion or their type is not
+                  known from the cursor description.
+    """
+
+    def __init__(self, names=(), kinds=None):
+        super(Columns, self).__init__(names)
+        self.kinds = list(kinds) if kinds is not None else [None] * len(self)
+
+
+def column_kinds(columns):
+    """Kinds of a column list, which may be a plain list of names."""
+    kinds = getattr(columns, "kinds", None)
+    return kinds if kinds is not None else [None] * len(columns)
+
+
+def format_timedelta(value):
+    """
+    Format a timedelta as `[-]HH:MM:SS[.ffffff]`.
+
+    This is how MySQL writes TIME values, which pymysql returns as
+    timedeltas; hours may exceed 24.
+    """
+    sign = "-" if value < datetime.timedelta(0) else ""
+    value = abs(value)
+    minutes, seconds = divmod(value.days * 86400 + value.seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    text = "%s%02d:%02d:%02d" % (sign, hours, minutes, seconds)
+    if value.microseconds:
+        text += ".%06d" % value.microseconds
+    return text
+
+
+def format_binary(value):
+    """Base64 encode binary column values."""
+    return base64.b64encode(value).decode("ascii")
+
+
+def isoformat(value):
+    # Drivers return some invalid dates, e.g. MySQL's zero date, as text.
+    try:
+        return value.isoformat()
+    except AttributeError:
+        return value
+
+
+CONVERTERS = {
+    DECIMAL: str,
+    TEMPORAL: isoformat,
+    TIMEDELTA: format_timedelta,
+    BINARY: format_binary,
+    UUID: str,
+}
+
+
+def default(value):
+    """
+    Convert a value of a type JSON has no representation for.
+
+    This is the per-value fallback for columns whose kind the driver
+    could not tell from the cursor description.
+
+    :raises TypeError: If the value is of an unknown type.
+    """
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        return format_timedelta(value)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return format_binary(bytes(value))
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    raise TypeError("%r is not JSON serializable" % (value,))
+
+
+class JSONEncoder(object):
+    """
+    Serializer for the JSON based result formats.
+
+    Should be installed with a "sql_json_bridge.ext.json_encoder"
+    entrypoint. Values of the kinds in `native` are serialized by the
+    underlying library itself; the others are converted column by column
+    before rows are serialized.
+    """
+
+    name = None
+    native = frozenset()
+
+    def dumps(self, obj):
+        """
+        Serialize `obj` compactly, without sorting keys.
+
+        :rtype: bytes
+        """
+        raise NotImplementedError
+
+    def row_converter(self, kinds):
+        """
+        Build a function converting rows of a result set for `dumps`.
+
+        The conversion for each column is chosen once from its kind,
+        rather than by inspecting every value.
+
+        :param kinds: The kind of each column, see :py:class:`Columns`.
+        :returns: A function taking a row and returning a list, or None
+                  if rows can be serialized as they are.
+        """
+        plan = [(n, CONVERTERS[kind]) for n, kind in enumerate(kinds)
+                if kind in CONVERTERS and kind not in self.native]
+        if not plan:
+            return None
+
+        def convert(row):
+            row = list(row)
+            for n, converter in plan:
+                value = row[n]
+                if value is not None:
+                    row[n] = converter(value)
+            return row
+        return convert
+
+
+class StdlibJSONEncoder(JSONEncoder):
+    """The standard library's json module; always available."""
+
+    name = "json"
+
+    def __init__(self):
+        self._encode = json.JSONEncoder(separators=(",", ":"),
+                                        default=default).encode
+
+    def dumps(self, obj):
+        text = self._encode(obj)
+        if isinstance(text, six.text_type):
+            return text.encode("utf-8")
+        return text
+
+
+class OrjsonEncoder(JSONEncoder):
+    """orjson, which serializes dates, times and UUIDs natively."""
+
+    name = "orjson"
+    native = frozenset([TEMPORAL, UUID])
+
+    def __init__(self):
+        import orjson
+        self._dumps = orjson.dumps
+        self._fallback = StdlibJSONEncoder()
+
+    def dumps(self, obj):
+        try:
+            return self._dumps(obj, default=default)
+        except TypeError:
+            # orjson refuses integers wider than 64 bits.
+            return self._fallback.dumps(obj)
+
+
+class UjsonEncoder(JSONEncoder):
+    """
+    ujson; every kind is converted before serializing.
+
+    ujson has no hook for unknown types, so results with values it can't
+    serialize fall back to the standard library.
+    """
+
+    name = "ujson"
+
+    def __init__(self):
+        import ujson
+        self._dumps = ujson.dumps
+        self._fallback = StdlibJSONEncoder()
+
+    def dumps(self, obj):
+        try:
+            text = self._dumps(obj, ensure_ascii=False,
+                               escape_forward_slashes=False)
+        except (TypeError, OverflowError):
+            return self._fallback.dumps(obj)
+        return text.encode("utf-8")
+
+
+# Tried in order by the "auto" encoder.
+BUILTIN_ENCODERS = OrderedDict([
+    ("orjson", OrjsonEncoder),
+    ("ujson", UjsonEncoder),
+    ("json", StdlibJSONEncoder),
+])
+
+
+def load_encoder(name="auto"):
+    """
+    Load a JSON encoder by name.
+
+    "auto" picks the fastest built-in encoder whose library is installed.
+    Other names are looked up in `BUILTIN_ENCODERS`, then as a
+    "sql_json_bridge.ext.json_encoder" entrypoint.
+
+    :param name: Name of the encoder, e.g. "orjson".
+    :type name: str
+    :rtype: :py:class:JSONEncoder
+    """
+    if name == "auto":
+        for encoder in BUILTIN_ENCODERS.values():
+            try:
+                return encoder()
+            except ImportError:
+                continue
+    if name in BUILTIN_ENCODERS:
+        try:
+            return BUILTIN_ENCODERS[name]()
+        except ImportError:
+            raise RuntimeError(
+                "The %s JSON encoder requires the %s package." % (name, name)
+            )
+    return driver.DriverManager(
+        namespace="sql_json_bridge.ext.json_encoder",
+        name=name,
+        invoke_on_load=True,
+    ).driver
@@ -0,0 +1,369 @@
+"""Result cache for read queries."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import abc
+import hashlib
+import re
+import threading
+import time
+
+from collections import OrderedDict
+
+import six
+
+from stevedore import driver
+
+# Split SQL into quoted literals/identifiers (odd indexes) and everything
+# else (even indexes), so whitespace is only collapsed outside quotes.
+_QUOTED = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\])""")
+_WHITESPACE = re.compile(r"\s+")
+
+# Prefix of every result cache key.
+KEY_PREFIX = "sql_json_bridge:result:"
+_READ_QUERY = re.compile(r"^\s*(SELECT|WITH)\b", re.IGNORECASE)
+# Quoted text and comments, which are blanked out before looking for
+# keywords that make a query write or lock.
+_LITERALS = re.compile(
+    r"""'(?:[^']|'')*'|"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\]"""
+    r"""|--[^\n]*|/\*.*?\*/""",
+    re.DOTALL,
+)
+# SELECT INTO, data-modifying CTEs and row locks, e.g. FOR UPDATE,
+# LOCK IN SHARE MODE or SQL Server's table hints.
+_NOT_READ = re.compile(
+    r"\b(INTO|INSERT|UPDATE|DELETE|MERGE|FOR\s+SHARE|FOR\s+KEY\s+SHARE"
+    r"|LOCK\s+IN\s+SHARE\s+MODE|UPDLOCK|XLOCK|HOLDLOCK|TABLOCKX?"
+    r"|PAGLOCK|ROWLOCK)\b",
+    re.IGNORECASE,
+)
+
+
+def normalize_sql(sql):
+    """
+    Normalize a SQL string for use in a cache key.
+
+    Runs of whitespace outside quoted strings and identifiers collapse to
+    a single space, and surrounding whitespace and trailing semicolons
+    are removed. Case is preserved, since identifiers and literals may be
+    case sensitive.
+
+    :param sql: The SQL string to normalize.
+    :type sql: str
+    :rtype: str
+    """
+    parts = _QUOTED.split(sql)
+    for i in range(0, len(parts), 2):
+        parts[i] = _WHITESPACE.sub(" ", parts[i])
+    return "".join(parts).strip().rstrip(";").rstrip()
+
+
+def is_read_query(sql):
+    """
+    Return True if `sql` looks like a side-effect free SELECT.
+
+    Only single statements starting with SELECT or WITH count, and not
+    if they write, e.g. `SELECT ... INTO` or `WITH ... DELETE`, or lock
+    rows. Whatever this accepts may be cached, coalesced and sent to a
+    replica, so it errs on the side of refusing.
+    """
+    if not _READ_QUERY.match(sql):
+        return False
+    code = _LITERALS.sub(" ", sql).strip().rstrip(";")
+    if ";" in code:
+        return False
+    return _NOT_READ.search(code) is None
+
+
+def cache_key(identity, sql, params=None, mimetype=None):
+    """
+    Build a cache key from a database identity, SQL and bind parameters.
+
+    :param identity: The resolved database the query runs against, e.g.
+                     its config's fingerprint and identifier groups, so
+                     names resolving to one database share entries.
+    :param sql: The query string; it is normalized before hashing.
+    :param params: Bind parameters for the query, if any.
+    :param mimetype: The result format the entry is serialized in.
+    :rtype: str
+    """
+    digest = hashlib.sha1()
+    for part in (identity, normalize_sql(sql), repr(params), mimetype):
+        digest.update(six.text_type(part).encode("utf-8"))
+        digest.update(b"\0")
+    return KEY_PREFIX + digest.hexdigest()
+
+
+@six.add_metaclass(abc.ABCMeta)
+class CacheBackend(object):
+    """
+    Modular stevedore storage backend for the result cache.
+
+    Should be installed with a "sql_json_bridge.ext.cache_backend"
+    entrypoint. Values are opaque byte strings.
+    """
+
+    def __init__(self, **options):
+        self.options = options
+
+    @abc.abstractmethod
+    def get(self, key):
+        """
+        Fetch a value from the cache.
+
+        :returns: The stored bytes, or None on a miss or expired entry.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def set(self, key, value, ttl):
+        """
+        Store a value in the cache for `ttl` seconds.
+
+        :param key: Cache key.
+        :type key: str
+        :param value: Value to store.
+        :type value: bytes
+        :param ttl: Time to live in seconds.
+        :type ttl: int
+        """
+        raise NotImplementedError
+
+    def delete(self, key):
+        """Remove a value from the cache, if present."""
+        raise NotImplementedError
+
+    def clear(self, prefix):
+        """Remove every value whose key starts with `prefix`."""
+        raise NotImplementedError
+
+
+class LocalCacheBackend(CacheBackend):
+    """
+    In-process LRU cache bounded by the total size of stored values.
+
+    :param max_bytes: Size budget for stored values; least recently used
+                      entries are evicted when it is exceeded.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, **options):
+        super(LocalCacheBackend, self).__init__(**options)
+        self.max_bytes = int(max_bytes)
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _pop(self, key):
+        value, _ = self._entries.pop(key)
+        self.size -= len(value)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires <= time.time():
+                self._pop(key)
+                return None
+            # Re-insert to mark the entry as most recently used.
+            del self._entries[key]
+            self._entries[key] = entry
+            return value
+
+    def set(self, key, value, ttl):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            self._entries[key] = (value, time.time() + ttl)
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+
+    def clear(self, prefix):
+        with self._lock:
+            for key in [key for key in self._entries
+                        if key.startswith(prefix)]:
+                self._pop(key)
+
+
+class RedisCacheBackend(CacheBackend):
+    """
+    Redis backed cache, shared between all workers using the same server.
+
+    Requires the redis python package. Options are passed through to
+    `redis.StrictRedis`, e.g. host, port and db. Size bounds and eviction
+    are left to the server's `maxmemory-policy`.
+    """
+
+    def __init__(self, **options):
+        super(RedisCacheBackend, self).__init__(**options)
+        # Imported here so apps using the local backend don't pay for it.
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("The redis cache backend requires redis-py.")
+        self.client = redis.StrictRedis(**options)
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value, ttl):
+        self.client.setex(key, int(max(ttl, 1)), value)
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def clear(self, prefix):
+        keys = []
+        for key in self.client.scan_iter(match=prefix + "*", count=1000):
+            keys.append(key)
+            if len(keys) >= 1000:
+                self.client.delete(*keys)
+                keys = []
+        if keys:
+            self.client.delete(*keys)
+
+
+BUILTIN_BACKENDS = {
+    "local": LocalCacheBackend,
+    "redis": RedisCacheBackend,
+}
+
+
+def load_cache_backend(backend_name, options):
+    """
+    Load an instance of a result cache backend.
+
+    "local" and "redis" are built in; other backends should exist in the
+    "sql_json_bridge.ext.cache_backend" namespace.
+
+    :param backend_name: The name of the backend to be loaded.
+    :type backend_name: str
+    :param options: Keyword options for the backend.
+    :type options: dict
+    :rtype: :py:class:CacheBackend
+    """
+    if backend_name in BUILTIN_BACKENDS:
+        return BUILTIN_BACKENDS[backend_name](**options)
+    mgr = driver.DriverManager(
+        namespace="sql_json_bridge.ext.cache_backend",
+        name=backend_name,
+        invoke_on_load=True,
+        invoke_kwds=options,
+    )
+    return mgr.driver
+
+
+class ResultCache(object):
+    """
+    Cache of query results in front of :py:meth:`DatabaseDriver.run_query`.
+
+    Caching is opt-in per database through the `cache` section of its
+    configuration:
+
+    .. code-block:: yaml
+
+        cache:
+            enabled: true
+            ttl: 30         # seconds
+
+    The backend is chosen app-wide by `RESULT_CACHE_BACKEND` and
+    `RESULT_CACHE_OPTIONS`. The cache is cleared whenever the database
+    configs reload.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.app = app
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.backend = load_cache_backend(
+            app.config.get("RESULT_CACHE_BACKEND", "local"),
+            app.config.get("RESULT_CACHE_OPTIONS") or {},
+        )
+        registry = app.config.get("DATABASE_REGISTRY")
+        if registry is not None:
+            registry.add_listener(self.clear)
+
+    @staticmethod
+    def policy(database_config):
+        """
+        Return the TTL for results of a database, or None if not cached.
+
+        :param database_config: The database's configuration.
+        :type database_config: :py:class:DbConfig
+        """
+        options = database_config.get("cache") or {}
+        if not options.get("enabled", False):
+            return None
+        return options.get("ttl", 30)
+
+    def get(self, key):
+        """
+        Look up a cached response body.
+
+        :returns: A (rows_matched, body) pair, or None on a miss.
+        """
+        if self.backend is None:
+            return None
+        value = self.backend.get(key)
+        if value is None:
+            return None
+        rows_matched, _, body = value.partition(b"\n")
+        return int(rows_matched), body
+
+    def set(self, key, rows_matched, body, ttl):
+        """
+        Store a serialized response body for `ttl` seconds.
+
+        Bodies are cached as sent, keyed by their format, so hits skip
+        serializing and read back exactly what a miss returned, e.g. raw
+        MessagePack binary. Nothing stored runs code when read back, so a
+        shared backend such as Redis is safe.
+
+        :param rows_matched: Number of rows in the body.
+        :param body: The serialized body.
+        :type body: bytes
+        """
+        if self.backend is None:
+            return
+        self.backend.set(key, b"%d\n" % rows_matched + body, ttl)
+
+    def clear(self):
+        """
+        Drop every cached result, e.g. when database configs reload.
+
+        Configs are part of cache keys, so entries a backend fails to
+        clear are never served for a changed config.
+        """
+        if self.backend is None:
+            return
+        try:
+            self.backend.clear(KEY_PREFIX)
+        except NotImplementedError:
+            pass
+
+
+result_cache = ResultCache()
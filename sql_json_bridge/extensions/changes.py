@@ -0,0 +1,547 @@
+"""Incremental change feeds over queries with a watermark column."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import logging
+import threading
+import time
+import uuid
+
+from collections import OrderedDict, deque
+
+from sql_json_bridge.encoders import Columns
+from sql_json_bridge.extensions.cache import normalize_sql
+from sql_json_bridge.limits import LimitExceeded
+from sql_json_bridge.metrics import CHANGES_SERVED
+
+LOG = logging.getLogger(__name__)
+
+# Name of the bind parameter carrying the watermark into delta queries.
+WATERMARK_PARAM = "bridge_watermark"
+
+
+class TooManySubscriptions(LimitExceeded):
+    """Raised when `CHANGES_MAX_SUBSCRIPTIONS` subscriptions exist."""
+
+    status_code = 429
+
+
+class Delta(object):
+    """
+    Rows of a change feed past a subscription's watermark.
+
+    :param columns: Column names of the rows.
+    :param rows: The new rows, in watermark order.
+    :param watermark: The subscription's watermark after these rows.
+    :param more: Whether more new rows are waiting.
+    :param version: The feed's version when the rows were read, to wait
+                    for newer rows with.
+    """
+
+    __slots__ = ("columns", "rows", "watermark", "more", "version")
+
+    def __init__(self, columns, rows, watermark, more=False, version=0):
+        self.columns = columns
+        self.rows = rows
+        self.watermark = watermark
+        self.more = more
+        self.version = version
+
+
+class Feed(object):
+    """
+    One query polled for new rows on behalf of all its subscriptions.
+
+    The feed starts at the watermark column's current maximum and polls
+    for rows past it every `interval` seconds, keeping the last
+    `buffer_rows` in memory. Subscriptions whose watermark falls within
+    the buffer read from it; those further behind, e.g. new ones taking
+    a snapshot, query the database directly until they catch up. So
+    however many clients follow a query, it is polled once per interval,
+    with a range scan on the watermark column.
+
+    The feed only polls while it is read from: after `idle_timeout`
+    seconds without reads it stops, and forgets its buffer.
+
+    :param database: The database name.
+    :param config: The database's :py:class:DbConfig.
+    :param args: Identifier groups of the database name.
+    :param sql: The subscribed query.
+    :param params: Bind parameters of the query, if any.
+    :param column: Name of the watermark column.
+    """
+
+    def __init__(self, database, config, args, sql, params, column,
+                 interval=1.0, buffer_rows=10000, batch_rows=1000,
+                 idle_timeout=60):
+        self.database = database
+        self.config = config
+        self.args = args
+        self.sql = sql
+        self.params = params
+        self.column = column
+        self.interval = interval
+        self.buffer_rows = buffer_rows
+        self.batch_rows = batch_rows
+        self.idle_timeout = idle_timeout
+        self.subscriptions = 0
+        self.columns = None
+        self.rows = deque()
+        self.ready = False
+        self.floor = None
+        self.head = None
+        self.version = 0
+        self.last_read = time.time()
+        self.condition = threading.Condition()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def statement(self, driver, since, aggregate=False):
+        """
+        Wrap the subscribed query to select rows past `since`.
+
+        :param driver: The driver the statement will run on.
+        :param since: The watermark to select rows past, or None for all.
+        :param aggregate: Select the maximum watermark instead of rows.
+        :returns: The statement and its bind parameters.
+        """
+        column = driver.quote_identifier(self.column)
+        params = self.params
+        if aggregate:
+            statement = "SELECT MAX(%s) FROM (%s) bridge_changes" % (
+                column, self.sql)
+        else:
+            statement = "SELECT * FROM (%s) bridge_changes" % self.sql
+            if since is not None:
+                if isinstance(params, dict):
+                    params = dict(params)
+                    params[WATERMARK_PARAM] = since
+                    placeholder = "%%(%s)s" % WATERMARK_PARAM
+                else:
+                    params = list(params or ()) + [since]
+                    placeholder = "%s"
+                statement += " WHERE %s > %s" % (column, placeholder)
+            statement += " ORDER BY %s" % column
+        return statement, params
+
+    def query(self, since, limit):
+        """
+        Read rows past `since` from the database.
+
+        :returns: A (columns, rows, more, index) tuple, `index` being the
+                  position of the watermark column.
+        :raises ValueError: If the query has no watermark column.
+        """
+        driver = self.config.get_read_driver(self.args)
+        statement, params = self.statement(driver, since)
+        columns, rows, more = driver.fetch_rows(statement, params, limit)
+        lowered = [name.lower() for name in columns]
+        if self.column.lower() not in lowered:
+            raise ValueError("Watermark column %r is not in the result."
+                             % self.column)
+        return columns, rows, more, lowered.index(self.column.lower())
+
+    def latest(self):
+        """Read the watermark column's current maximum."""
+        driver = self.config.get_read_driver(self.args)
+        statement, params = self.statement(driver, None, aggregate=True)
+        rows = driver.fetch_rows(statement, params)[1]
+        return rows[0][0] if rows else None
+
+    def covers(self, watermark):
+        """Whether every row past `watermark` is in the buffer."""
+        if not self.ready:
+            return False
+        if self.floor is None:
+            return True
+        try:
+            return watermark is not None and watermark >= self.floor
+        except TypeError:
+            return False
+
+    def buffered(self, watermark, limit):
+        """
+        Read rows past `watermark` from the buffer.
+
+        :returns: A (columns, rows, last watermark, more) tuple, or None
+                  if the buffer does not cover `watermark`.
+        """
+        with self.condition:
+            if not self.covers(watermark):
+                return None
+            new = [(mark, row) for mark, row in self.rows
+                   if watermark is None or mark > watermark]
+            columns = self.columns or Columns()
+        more = limit is not None and len(new) > limit
+        if more:
+            new = new[:limit]
+        last = new[-1][0] if new else watermark
+        return columns, [row for mark, row in new], last, more
+
+    def poll(self):
+        """Read rows past the feed's head into the buffer."""
+        if not self.ready:
+            latest = self.latest()
+            with self.condition:
+                self.floor = self.head = latest
+                self.ready = True
+            return
+        more = True
+        while more:
+            columns, rows, more, index = self.query(self.head,
+                                                    self.batch_rows)
+            if not rows:
+                return
+            with self.condition:
+                self.columns = columns
+                for row in rows:
+                    self.rows.append((row[index], row))
+                self.head = rows[-1][index]
+                while len(self.rows) > self.buffer_rows:
+                    self.floor = self.rows.popleft()[0]
+                self.version += 1
+                self.condition.notify_all()
+
+    def touch(self):
+        """Record a read, starting the poller if it stopped."""
+        self.last_read = time.time()
+        with self.condition:
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run,
+                                                name="change-feed")
+                self._thread.daemon = True
+                self._thread.start()
+
+    def wait(self, version, timeout):
+        """
+        Wait up to `timeout` seconds for rows newer than `version`.
+
+        :returns: Whether new rows arrived.
+        """
+        with self.condition:
+            if self.version == version:
+                self.condition.wait(timeout)
+            return self.version != version
+
+    def close(self):
+        self._stop.set()
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                if time.time() - self.last_read > self.idle_timeout:
+                    break
+                try:
+                    self.poll()
+                except Exception:
+                    LOG.exception("Polling change feed on %s failed.",
+                                  self.database)
+                self._stop.wait(self.interval)
+        finally:
+            with self.condition:
+                self._thread = None
+                self.ready = False
+                self.rows.clear()
+                self.columns = None
+
+
+class Subscription(object):
+    """
+    A client following a feed, and how far it has read.
+
+    :param feed: The :py:class:Feed followed.
+    :param watermark: Watermark to read rows past, or None for all rows.
+    :param native: Whether `watermark` came from the database, rather
+                   than from the client as JSON; only native watermarks
+                   are compared with buffered rows.
+    """
+
+    def __init__(self, feed, watermark=None, native=False):
+        self.id = uuid.uuid4().hex
+        self.feed = feed
+        self.watermark = watermark
+        self.native = native
+        self.last_read = time.time()
+        self.lock = threading.Lock()
+
+    def status(self):
+        """Describe the subscription, as returned by the /changes API."""
+        return OrderedDict([
+            ("subscription", self.id),
+            ("database", self.feed.database),
+            ("watermark_column", self.feed.column),
+            ("watermark", self.watermark),
+        ])
+
+
+class ChangeFeeds(object):
+    """
+    Incremental queries: each poll returns only rows added since the last.
+
+    A subscription registers a query and a watermark column, such as an
+    auto-increment id or an insert timestamp, that only increases as rows
+    are added. The bridge remembers the last watermark each subscription
+    read, and subscriptions to the same query share one :py:class:`Feed`
+    polling the database. Feeds poll every `CHANGES_POLL_INTERVAL`
+    seconds, or per database:
+
+    .. code-block:: yaml
+
+        changes:
+            poll_interval: 1    # seconds
+
+    Subscriptions expire `CHANGES_SUBSCRIPTION_TTL` seconds after their
+    last read; at most `CHANGES_MAX_SUBSCRIPTIONS` are kept. Like jobs,
+    they live in the process that accepted them.
+    """
+
+    def __init__(self, app=None):
+        self.poll_interval = 1.0
+        self.buffer_rows = 10000
+        self.max_rows = 10000
+        self.max_subscriptions = 1024
+        self.ttl = 300
+        self.max_wait = 30
+        self.stream_duration = 300
+        self.keepalive = 15
+        self._feeds = {}
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self.app = app
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.poll_interval = app.config.get("CHANGES_POLL_INTERVAL", 1.0)
+        self.buffer_rows = app.config.get("CHANGES_BUFFER_ROWS", 10000)
+        self.max_rows = app.config.get("CHANGES_MAX_ROWS", 10000)
+        self.max_subscriptions = app.config.get(
+            "CHANGES_MAX_SUBSCRIPTIONS", 1024
+        )
+        self.ttl = app.config.get("CHANGES_SUBSCRIPTION_TTL", 300)
+        self.max_wait = app.config.get("CHANGES_MAX_WAIT", 30)
+        self.stream_duration = app.config.get("CHANGES_STREAM_DURATION", 300)
+        self.keepalive = app.config.get("CHANGES_KEEPALIVE", 15)
+
+    def subscribe(self, database, config, args, sql, params, column,
+                  start=None):
+        """
+        Subscribe to the rows a query gains.
+
+        :param database: The database name.
+        :param config: The database's :py:class:DbConfig.
+        :param args: Identifier groups of the database name.
+        :param sql: The query. Its watermark column must be in its result.
+        :param params: Bind parameters of the query, if any.
+        :param column: Name of the watermark column.
+        :param start: Watermark to start past: None to start with every
+                      current row, "latest" to only see rows added from
+                      now on, or a value of the column.
+        :rtype: :py:class:Subscription
+        :raises TooManySubscriptions: If `max_subscriptions` exist.
+        :raises ValueError: If the query has no watermark column.
+        """
+        key = (database, normalize_sql(sql), repr(params), column.lower())
+        with self._lock:
+            if len(self._subscriptions) >= self.max_subscriptions:
+                raise TooManySubscriptions("Too many subscriptions.")
+            feed = self._feeds.get(key)
+            if feed is None:
+                options = config.get("changes") or {}
+                feed = self._feeds[key] = Feed(
+                    database, config, args, sql, params, column,
+                    interval=options.get("poll_interval",
+                                         self.poll_interval),
+                    buffer_rows=self.buffer_rows,
+                    idle_timeout=self.ttl,
+                )
+                feed.key = key
+            feed.subscriptions += 1
+        try:
+            # Fails early if the watermark column is not selected.
+            feed.query(None, 0)
+            if start == "latest":
+                subscription = Subscription(feed, feed.latest(), True)
+            else:
+                subscription = Subscription(feed, start, start is None)
+        except Exception:
+            self._release(feed)
+            raise
+        with self._lock:
+            self._subscriptions[subscription.id] = subscription
+        self._start()
+        return subscription
+
+    def get(self, subscription_id):
+        """
+        Look up a subscription.
+
+        :returns: The subscription, or None if unknown or expired.
+        """
+        with self._lock:
+            return self._subscriptions.get(subscription_id)
+
+    def rewind(self, subscription, watermark):
+        """Move a subscription back to a watermark the client sent."""
+        with subscription.lock:
+            subscription.watermark = watermark
+            subscription.native = False
+
+    def changes(self, subscription, limit=None):
+        """
+        Read a subscription's new rows, and advance its watermark past them.
+
+        Rows come from the shared feed when it covers the subscription's
+        watermark, and from the database otherwise.
+
+        :param limit: Most rows to return; capped by `CHANGES_MAX_ROWS`.
+        :rtype: :py:class:Delta
+        """
+        limit = min(limit or self.max_rows, self.max_rows)
+        feed = subscription.feed
+        feed.touch()
+        with subscription.lock:
+            subscription.last_read = time.time()
+            watermark = subscription.watermark
+            version = feed.version
+            buffered = None
+            if subscription.native:
+                buffered = feed.buffered(watermark, limit)
+            if buffered is not None:
+                columns, rows, last, more = buffered
+                source = "buffer"
+            else:
+                columns, rows, more, index = feed.query(watermark, limit)
+                last = rows[-1][index] if rows else watermark
+                source = "database"
+            CHANGES_SERVED.inc((feed.config["identifier"].pattern, source),
+                               len(rows))
+            if rows:
+                subscription.watermark = last
+                subscription.native = True
+            return Delta(columns, rows, subscription.watermark, more,
+                         version)
+
+    def wait(self, subscription, delta, timeout):
+        """
+        Wait up to `timeout` seconds for the feed to grow past `delta`.
+
+        :param delta: The subscription's last :py:class:Delta.
+        :returns: Whether new rows arrived.
+        """
+        feed = subscription.feed
+        feed.touch()
+        return feed.wait(delta.version, timeout)
+
+    def poll(self, subscription, limit=None, wait=0):
+        """
+        Read a subscription's new rows, waiting for some if there are none.
+
+        :param wait: Most seconds to wait for new rows, capped by
+                     `CHANGES_MAX_WAIT`.
+        :rtype: :py:class:Delta
+        """
+        deadline = time.time() + min(wait, self.max_wait)
+        delta = self.changes(subscription, limit)
+        while not delta.rows:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            if self.wait(subscription, delta, remaining):
+                delta = self.changes(subscription, limit)
+        return delta
+
+    def events(self, subscription, limit=None):
+        """
+        Follow a subscription, yielding deltas as rows arrive.
+
+        Yields None every `CHANGES_KEEPALIVE` seconds without new rows, and
+        stops after `CHANGES_STREAM_DURATION` seconds, so a client holds a
+        worker for a bounded time and then reconnects.
+        """
+        deadline = time.time() + self.stream_duration
+        while True:
+            delta = self.changes(subscription, limit)
+            if delta.rows:
+                yield delta
+                if delta.more:
+                    continue
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return
+            if not self.wait(subscription, delta,
+                             min(self.keepalive, remaining)):
+                yield None
+
+    def unsubscribe(self, subscription_id):
+        """
+        Drop a subscription, stopping its feed if it was the last.
+
+        :returns: The subscription, or None if unknown or expired.
+        """
+        with self._lock:
+            subscription = self._subscriptions.pop(subscription_id, None)
+        if subscription is not None:
+            self._release(subscription.feed)
+        return subscription
+
+    def sweep(self):
+        """Drop subscriptions not read for `ttl` seconds."""
+        now = time.time()
+        with self._lock:
+            expired = [subscription_id for subscription_id, subscription
+                       in self._subscriptions.items()
+                       if subscription.last_read + self.ttl < now]
+        for subscription_id in expired:
+            self.unsubscribe(subscription_id)
+
+    def close(self):
+        """Stop every feed and sweeping."""
+        self._stop.set()
+        with self._lock:
+            feeds = list(self._feeds.values())
+            self._feeds.clear()
+            self._subscriptions.clear()
+        for feed in feeds:
+            feed.close()
+
+    def _release(self, feed):
+        with self._lock:
+            feed.subscriptions -= 1
+            if feed.subscriptions > 0:
+                return
+            self._feeds.pop(feed.key, None)
+        feed.close()
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._sweep_loop)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _sweep_loop(self):
+        interval = min(max(self.ttl / 2.0, 1), 60)
+        while not self._stop.wait(interval):
+            self.sweep()
+
+
+change_feeds = ChangeFeeds()
@@ -0,0 +1,218 @@
+"""Response compression and ETags for query results."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import hashlib
+import zlib
+
+from collections import OrderedDict
+
+from flask import g, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class GzipCompressor(object):
+    """Incremental gzip compressor."""
+
+    def __init__(self, level=6):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED,
+                                            16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        """Emit everything compressed so far, keeping the stream open."""
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class ZstdCompressor(object):
+    """Incremental zstd compressor; requires the zstandard package."""
+
+    def __init__(self, level=3):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+class BrotliCompressor(object):
+    """Incremental brotli compressor; requires the brotli package."""
+
+    def __init__(self, quality=4):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+# Content codings offered, most preferred first, where their library is
+# installed. Levels favour speed, as results are compressed per request.
+COMPRESSORS = OrderedDict()
+if zstandard is not None:
+    COMPRESSORS["zstd"] = ZstdCompressor
+if brotli is not None:
+    COMPRESSORS["br"] = BrotliCompressor
+COMPRESSORS["gzip"] = GzipCompressor
+
+
+def negotiate_encoding():
+    """
+    Pick the content coding for the response from `Accept-Encoding`.
+
+    :returns: A key of `COMPRESSORS`, or None to send the body as is.
+    """
+    return request.accept_encodings.best_match(list(COMPRESSORS))
+
+
+def content_etag(data):
+    """Hash a response body into an ETag value."""
+    return hashlib.sha1(data).hexdigest()
+
+
+def _compress_stream(pieces, compressor):
+    # Flush after every piece, so each chunk of rows reaches the client
+    # as soon as it's written rather than when the compressor's buffer
+    # fills. Closing this generator closes `pieces`, which cancels the
+    # query of a client that went away.
+    try:
+        for piece in pieces:
+            if not piece:
+                continue
+            yield compressor.compress(piece) + compressor.flush()
+        yield compressor.finish()
+    finally:
+        close = getattr(pieces, "close", None)
+        if close is not None:
+            close()
+
+
+class ResponseCompression(object):
+    """
+    Flask extension compressing responses and answering `If-None-Match`.
+
+    Either is turned on app-wide by `COMPRESSION_ENABLED` and
+    `ETAG_ENABLED`, or per database:
+
+    .. code-block:: yaml
+
+        compression:
+            enabled: true
+            min_size: 1024  # bytes; smaller results are sent as is
+        etag:
+            enabled: true
+
+    Responses are compressed with the best coding the client accepts of
+    zstd, br (with the zstandard and brotli packages) and gzip. Streamed
+    responses are compressed incrementally, chunk by chunk, whatever
+    their size.
+
+    A buffered response's ETag is a hash of its uncompressed body; it is
+    weak, so all codings of a result share it. Clients polling a query
+    with `If-None-Match` get `304 Not Modified` and an empty body while
+    the result is unchanged. Streamed responses get no ETag, as their
+    body is not known until it has been sent.
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.compress = app.config.get("COMPRESSION_ENABLED", False)
+        self.min_size = app.config.get("COMPRESSION_MIN_SIZE", 1024)
+        self.etag = app.config.get("ETAG_ENABLED", False)
+        app.after_request(self.after_request)
+
+    def policy(self, database_config):
+        """
+        Return the compression and ETag settings for a database.
+
+        :param database_config: The database's configuration, or None if
+                                the request did not resolve a database.
+        :returns: A (min_size, etag) pair, `min_size` being None if
+                  responses are not compressed.
+        """
+        compression = {}
+        etag = {}
+        if database_config is not None:
+            compression = database_config.get("compression") or {}
+            etag = database_config.get("etag") or {}
+        min_size = None
+        if compression.get("enabled", self.compress):
+            min_size = compression.get("min_size", self.min_size)
+        return min_size, etag.get("enabled", self.etag)
+
+    def after_request(self, response):
+        if (response.status_code != 200 or response.direct_passthrough or
+                "Content-Encoding" in response.headers):
+            return response
+        min_size, etag = self.policy(g.get("database_config"))
+        if min_size is not None:
+            response.vary.add("Accept-Encoding")
+        if etag and not response.is_streamed:
+            tag = content_etag(response.get_data())
+            response.set_etag(tag, weak=True)
+            if request.if_none_match.contains_weak(tag):
+                response.status_code = 304
+                response.set_data(b"")
+                del response.headers["Content-Length"]
+                return response
+        if min_size is None:
+            return response
+        encoding = negotiate_encoding()
+        if encoding is None:
+            return response
+        compressor = COMPRESSORS[encoding]()
+        if response.is_streamed:
+            response.response = _compress_stream(response.response,
+                                                 compressor)
+            response.headers.pop("Content-Length", None)
+        else:
+            data = response.get_data()
+            if len(data) < min_size:
+                return response
+            response.set_data(compressor.compress(data) +
+                              compressor.finish())
+        response.headers["Content-Encoding"] = encoding
+        return response
+
+
+response_compression = ResponseCompression()
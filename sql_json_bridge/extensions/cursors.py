@@ -0,0 +1,182 @@
+"""Open server-side cursors behind continuation tokens."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import itertools
+import logging
+import threading
+import time
+import uuid
+
+from collections import OrderedDict
+
+LOG = logging.getLogger(__name__)
+
+
+class OpenCursor(object):
+    """
+    The unread remainder of a query result.
+
+    :param database: The database name the query was run against.
+    :param columns: Column names of the result set.
+    :param rows: The row generator from `stream_rows`, still holding its
+                 pooled connection.
+    :param page_size: Rows per page, or None for no limit.
+    """
+
+    __slots__ = ("database", "columns", "rows", "page_size", "pending",
+                 "expires")
+
+    def __init__(self, database, columns, rows, page_size=None):
+        self.database = database
+        self.columns = columns
+        self.rows = rows
+        self.page_size = page_size
+        self.pending = []
+        self.expires = None
+
+    def fetch(self, size):
+        """
+        Read the next page of rows.
+
+        One row past the page is read ahead, to tell whether more follow.
+
+        :param size: Page size, or None to read every remaining row.
+        :returns: A (rows, more) pair.
+        :rtype: tuple(list, bool)
+        """
+        if size is None:
+            page = self.pending + list(self.rows)
+            self.pending = []
+            return page, False
+        page = self.pending + list(
+            itertools.islice(self.rows, size + 1 - len(self.pending))
+        )
+        self.pending = page[size:]
+        del page[size:]
+        return page, bool(self.pending)
+
+    def close(self):
+        """Close the row generator, cancelling the rest of the query."""
+        self.rows.close()
+
+
+class CursorStore(object):
+    """
+    Keep partially read results open between page requests.
+
+    A page that leaves rows unread parks its cursor here under an opaque
+    token, so the next page continues reading the same server-side cursor
+    instead of re-running the query. Each cursor holds a pooled
+    connection, so cursors are closed after `CURSOR_TTL` seconds without
+    a page request, and at most `CURSOR_MAX_OPEN` are kept, the least
+    recently used being closed first.
+    """
+
+    def __init__(self, app=None):
+        self.ttl = 30
+        self.max_open = 64
+        self._cursors = OrderedDict()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self.app = app
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ttl = app.config.get("CURSOR_TTL", 30)
+        self.max_open = app.config.get("CURSOR_MAX_OPEN", 64)
+
+    def put(self, cursor):
+        """
+        Park a cursor and return its continuation token.
+
+        :param cursor: The cursor to keep open.
+        :type cursor: :py:class:OpenCursor
+        :rtype: str
+        """
+        token = uuid.uuid4().hex
+        cursor.expires = time.time() + self.ttl
+        evicted = []
+        with self._lock:
+            self._cursors[token] = cursor
+            while len(self._cursors) > self.max_open:
+                evicted.append(self._cursors.popitem(last=False)[1])
+        self._close(evicted)
+        self._start()
+        return token
+
+    def take(self, token, database):
+        """
+        Remove and return the cursor behind a token.
+
+        :param token: A token returned by `put`.
+        :param database: The database name of the request; tokens are only
+                         valid for the database they were issued for.
+        :returns: The cursor, or None if the token is unknown or expired.
+        :rtype: :py:class:OpenCursor
+        """
+        with self._lock:
+            cursor = self._cursors.get(token)
+            if cursor is None or cursor.database != database:
+                return None
+            del self._cursors[token]
+        if cursor.expires < time.time():
+            self._close([cursor])
+            return None
+        return cursor
+
+    def sweep(self):
+        """Close cursors whose TTL has run out."""
+        now = time.time()
+        with self._lock:
+            expired = [token for token, cursor in self._cursors.items()
+                       if cursor.expires < now]
+            stale = [self._cursors.pop(token) for token in expired]
+        self._close(stale)
+
+    def close(self):
+        """Close every open cursor and stop sweeping."""
+        self._stop.set()
+        with self._lock:
+            cursors = list(self._cursors.values())
+            self._cursors.clear()
+        self._close(cursors)
+
+    def _close(self, cursors):
+        for cursor in cursors:
+            try:
+                cursor.close()
+            except Exception:
+                LOG.exception("Failed to close cursor.")
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._sweep_loop)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _sweep_loop(self):
+        interval = max(self.ttl / 2.0, 1)
+        while not self._stop.wait(interval):
+            self.sweep()
+
+
+open_cursors = CursorStore()
@@ -0,0 +1,352 @@
+"""Asynchronous query jobs with results spooled to local disk."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import bisect
+import datetime
+import itertools
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from sql_json_bridge.limits import LimitExceeded
+
+LOG = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+# Rows pickled together into one spool record.
+SPOOL_BATCH_SIZE = 1000
+
+
+class JobQueueFull(LimitExceeded):
+    """Raised when `JOB_MAX_PENDING` jobs are already queued or running."""
+
+    status_code = 429
+
+
+def _timestamp(seconds):
+    if seconds is None:
+        return None
+    return datetime.datetime.utcfromtimestamp(seconds).isoformat() + "Z"
+
+
+class Spool(object):
+    """
+    The rows of a result, written to a local file.
+
+    Rows are pickled in batches of `SPOOL_BATCH_SIZE`. The first row and
+    file offset of each batch are kept in memory, so a range of rows is
+    read by seeking to the batch holding its first row rather than from
+    the start of the file.
+
+    :param path: The file to write.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.columns = None
+        self.rows = 0
+        self.size = 0
+        self._starts = []
+        self._offsets = []
+        self._file = open(path, "wb")
+
+    def write(self, batch):
+        """Append a list of rows."""
+        data = pickle.dumps(batch, pickle.HIGHEST_PROTOCOL)
+        self._file.write(data)
+        self._starts.append(self.rows)
+        self._offsets.append(self.size)
+        self.rows += len(batch)
+        self.size += len(data)
+
+    def finish(self):
+        """Close the file for writing; rows can be read from then on."""
+        if not self._file.closed:
+            self._file.close()
+
+    def read(self, start=0, count=None):
+        """
+        Yield the rows from `start` on, at most `count` of them.
+
+        :param start: Index of the first row.
+        :param count: Most rows to read, or None to read to the end.
+        """
+        stop = self.rows if count is None else min(self.rows, start + count)
+        if start >= stop:
+            return
+        n = bisect.bisect_right(self._starts, start) - 1
+        row = self._starts[n]
+        with open(self.path, "rb") as spool:
+            spool.seek(self._offsets[n])
+            while row < stop:
+                batch = pickle.load(spool)
+                for values in batch[max(start - row, 0):stop - row]:
+                    yield values
+                row += len(batch)
+
+    def remove(self):
+        """Delete the file."""
+        self.finish()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class Job(object):
+    """
+    A query running, or waiting to run, in the background.
+
+    :param database: The database name the query was submitted for.
+    :param sql: The query.
+    :param params: Bind parameters for the query, if any.
+    """
+
+    def __init__(self, database, sql, params=None):
+        self.id = uuid.uuid4().hex
+        self.database = database
+        self.sql = sql
+        self.params = params
+        self.state = QUEUED
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.error = None
+        self.truncated = False
+        self.spool = None
+        self.future = None
+        self.cancelled = threading.Event()
+
+    def status(self):
+        """
+        Describe the job for clients polling it.
+
+        :rtype: dict
+        """
+        status = OrderedDict([
+            ("job", self.id),
+            ("database", self.database),
+            ("state", self.state),
+            ("submitted", _timestamp(self.submitted)),
+            ("started", _timestamp(self.started)),
+            ("finished", _timestamp(self.finished)),
+            ("rows_matched",
+             self.spool.rows if self.spool is not None else 0),
+            ("bytes", self.spool.size if self.spool is not None else 0),
+            ("truncated", self.truncated),
+        ])
+        if self.error is not None:
+            status["ERROR"] = self.error
+        return status
+
+
+class JobManager(object):
+    """
+    Run queries in the background, spooling their results to disk.
+
+    Submitting a query returns a job right away, and the query runs on a
+    pool of `JOB_MAX_WORKERS` threads, so no request worker waits on it.
+    Its rows are written to a file under `JOB_SPOOL_DIRECTORY` (the
+    system's temporary directory by default) and read back from there by
+    range, so large results are never held in memory.
+
+    At most `JOB_MAX_PENDING` jobs may be queued or running at once.
+    Results are cut short after `JOB_MAX_ROWS` rows or `JOB_MAX_BYTES`
+    bytes of spool and flagged `truncated`. Jobs and their spool files
+    are deleted `JOB_RETENTION` seconds after they finish.
+
+    Jobs live in the process that accepted them, so deployments running
+    several processes must route polls for a job back to that process.
+    """
+
+    def __init__(self, app=None):
+        self.max_workers = 4
+        self.max_pending = 64
+        self.max_rows = None
+        self.max_bytes = None
+        self.retention = 3600
+        self.directory = None
+        self.executor = None
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self.app = app
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_workers = app.config.get("JOB_MAX_WORKERS", 4)
+        self.max_pending = app.config.get("JOB_MAX_PENDING", 64)
+        self.max_rows = app.config.get("JOB_MAX_ROWS")
+        self.max_bytes = app.config.get("JOB_MAX_BYTES")
+        self.retention = app.config.get("JOB_RETENTION", 3600)
+        self.directory = tempfile.mkdtemp(
+            prefix="sql_json_bridge-jobs-",
+            dir=app.config.get("JOB_SPOOL_DIRECTORY"),
+        )
+        self.executor = ThreadPoolExecutor(self.max_workers)
+
+    def submit(self, database, db, sql, params=None):
+        """
+        Queue a query to run in the background.
+
+        :param database: The database name the query was submitted for.
+        :param db: The driver to run it with.
+        :type db: :py:class:base.DatabaseDriver
+        :param sql: The query.
+        :param params: Bind parameters for the query, if any.
+        :rtype: :py:class:Job
+        :raises JobQueueFull: If `max_pending` jobs are queued or running.
+        """
+        job = Job(database, sql, params)
+        with self._lock:
+            pending = sum(1 for other in self._jobs.values()
+                          if other.state in (QUEUED, RUNNING))
+            if pending >= self.max_pending:
+                raise JobQueueFull("Too many jobs queued or running.")
+            self._jobs[job.id] = job
+        job.future = self.executor.submit(self.run, job, db)
+        self._start()
+        return job
+
+    def run(self, job, db):
+        """Run a job's query, spooling its rows."""
+        if job.cancelled.is_set():
+            return
+        job.state = RUNNING
+        job.started = time.time()
+        spool = rows = None
+        try:
+            spool = job.spool = Spool(os.path.join(self.directory, job.id))
+            columns, rows = db.stream_rows(job.sql, job.params)
+            spool.columns = columns
+            while not job.cancelled.is_set():
+                if ((self.max_rows is not None and
+                     spool.rows >= self.max_rows) or
+                        (self.max_bytes is not None and
+                         spool.size >= self.max_bytes)):
+                    job.truncated = next(rows, None) is not None
+                    break
+                size = SPOOL_BATCH_SIZE
+                if self.max_rows is not None:
+                    size = min(size, self.max_rows - spool.rows)
+                batch = list(itertools.islice(rows, size))
+                if batch:
+                    spool.write(batch)
+                if len(batch) < size:
+                    break
+        except Exception as e:
+            job.error = ": ".join(str(i) for i in e.args)
+            job.state = FAILED
+            LOG.warning("Job %s failed: %s", job.id, job.error)
+        else:
+            job.state = CANCELLED if job.cancelled.is_set() else DONE
+        finally:
+            if rows is not None:
+                # Cancels the query if the job stopped reading early.
+                rows.close()
+            job.finished = time.time()
+            if spool is not None:
+                spool.finish()
+                if job.state != DONE:
+                    spool.remove()
+
+    def get(self, job_id):
+        """
+        Look up a job.
+
+        :returns: The job, or None if the id is unknown or expired.
+        :rtype: :py:class:Job
+        """
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """
+        Cancel a job and delete its result.
+
+        A running query is cancelled once the job reads its next batch.
+
+        :returns: The job, or None if the id is unknown or expired.
+        :rtype: :py:class:Job
+        """
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+        if job is None:
+            return None
+        job.cancelled.set()
+        if job.future.cancel():
+            job.state = CANCELLED
+            job.finished = time.time()
+        elif job.future.done() and job.spool is not None:
+            job.spool.remove()
+        return job
+
+    def sweep(self):
+        """Delete jobs, and their spools, `retention` seconds old."""
+        now = time.time()
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.finished is not None and
+                       job.finished + self.retention < now]
+            jobs = [self._jobs.pop(job_id) for job_id in expired]
+        for job in jobs:
+            if job.spool is not None:
+                job.spool.remove()
+
+    def close(self):
+        """Cancel every job, stop sweeping and delete the spool directory."""
+        self._stop.set()
+        with self._lock:
+            job_ids = list(self._jobs)
+        for job_id in job_ids:
+            self.cancel(job_id)
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._sweep_loop)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _sweep_loop(self):
+        interval = min(max(self.retention / 2.0, 1), 60)
+        while not self._stop.wait(interval):
+            self.sweep()
+
+
+jobs = JobManager()
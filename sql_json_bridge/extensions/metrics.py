@@ -0,0 +1,91 @@
+"""Request metrics, exposed at `/metrics` in Prometheus text format."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+from flask import Response, request
+
+from sql_json_bridge import metrics
+from sql_json_bridge.auth import requires_auth
+
+
+class Metrics(object):
+    """
+    Flask extension recording request metrics and serving `/metrics`.
+
+    Each request is timed and counted by endpoint, database and status;
+    stages timed with :py:func:`metrics.stage` are reported in a
+    `Server-Timing` header when `METRICS_SERVER_TIMING` is set.
+
+    `/metrics` takes the same credentials as the other endpoints, unless
+    `METRICS_PUBLIC` is set, e.g. for scrapers on a trusted network.
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config.get("METRICS_ENABLED", True):
+            return
+        self.server_timing = app.config.get("METRICS_SERVER_TIMING", True)
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown)
+        render = self.render
+        if not app.config.get("METRICS_PUBLIC", False):
+            render = requires_auth(render)
+        app.add_url_rule("/metrics", "metrics", render)
+
+    def before_request(self):
+        timings = metrics.begin_request(request.endpoint or "unknown")
+        metrics.IN_FLIGHT.inc((timings.endpoint,))
+
+    def after_request(self, response):
+        timings = metrics.current_request()
+        if timings is None:
+            return response
+        if self.server_timing and timings.stages:
+            response.headers["Server-Timing"] = metrics.server_timing(
+                timings
+            )
+        status = str(response.status_code)
+        labels = (timings.endpoint, timings.database, status)
+        metrics.REQUESTS.inc(labels)
+        if response.status_code >= 400:
+            metrics.ERRORS.inc(labels)
+        if not response.is_streamed:
+            metrics.RESPONSE_BYTES.inc(
+                (timings.endpoint, timings.database),
+                response.content_length or 0,
+            )
+        return response
+
+    def teardown(self, exception):
+        timings = metrics.end_request()
+        if timings is None:
+            return
+        metrics.IN_FLIGHT.dec((timings.endpoint,))
+        metrics.REQUEST_SECONDS.observe(
+            (timings.endpoint, timings.database, timings.driver),
+            metrics.default_timer() - timings.start,
+        )
+
+    def render(self):
+        return Response(metrics.REGISTRY.render(),
+                        mimetype=metrics.CONTENT_TYPE)
+
+
+request_metrics = Metrics()
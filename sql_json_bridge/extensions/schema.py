@@ -0,0 +1,170 @@
+"""Cached database schemas, read through the drivers."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import fnmatch
+import threading
+import time
+
+from collections import OrderedDict
+
+from sql_json_bridge.db_drivers.singleflight import SingleFlight
+from sql_json_bridge.metrics import SCHEMA_INTROSPECTIONS
+
+
+class Schema(object):
+    """
+    The tables of one database, as read at `loaded`.
+
+    :param tables: Tables as returned by
+                   :py:meth:`DatabaseDriver.introspect`.
+    """
+
+    __slots__ = ("tables", "loaded")
+
+    def __init__(self, tables, loaded=None):
+        self.tables = tables
+        self.loaded = loaded if loaded is not None else time.time()
+
+    def filter(self, table=None, schema=None):
+        """
+        Select tables by name.
+
+        :param table: A shell-style pattern, e.g. "order*", matched
+                      case-insensitively against the table name, or the
+                      name qualified with its schema.
+        :param schema: A schema name, matched case-insensitively.
+        :rtype: list(dict)
+        """
+        tables = self.tables
+        if schema is not None:
+            schema = schema.lower()
+            tables = [entry for entry in tables
+                      if (entry["schema"] or "").lower() == schema]
+        if table is not None:
+            table = table.lower()
+            tables = [
+                entry for entry in tables
+                if fnmatch.fnmatchcase(entry["name"].lower(), table) or
+                fnmatch.fnmatchcase(
+                    ("%s.%s" % (entry["schema"], entry["name"])).lower(),
+                    table,
+                )
+            ]
+        return tables
+
+
+class SchemaCache(object):
+    """
+    Keep each database's schema in memory between requests.
+
+    A schema is introspected on first use and again, lazily, by the
+    first request after its TTL runs out; concurrent requests for a
+    schema being read share one introspection. TTLs default to
+    `SCHEMA_CACHE_TTL` seconds and are set per database with:
+
+    .. code-block:: yaml
+
+        schema:
+            ttl: 300        # seconds, 0 to introspect on every request
+
+    Schemas are cached under the requested database name, since a regex
+    identifier stands for many databases. At most
+    `SCHEMA_CACHE_MAX_DATABASES` are kept, the least recently used being
+    dropped first.
+    """
+
+    def __init__(self, app=None):
+        self.ttl = 300
+        self.max_databases = 1024
+        self._schemas = OrderedDict()
+        self._lock = threading.Lock()
+        self._flights = SingleFlight()
+        self.app = app
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ttl = app.config.get("SCHEMA_CACHE_TTL", 300)
+        self.max_databases = app.config.get("SCHEMA_CACHE_MAX_DATABASES",
+                                            1024)
+
+    def policy(self, database_config):
+        """
+        Return the schema TTL of a database, in seconds.
+
+        :param database_config: The database's configuration.
+        :type database_config: :py:class:DbConfig
+        """
+        options = database_config.get("schema") or {}
+        return options.get("ttl", self.ttl)
+
+    def cached(self, database_name):
+        """
+        Look up a cached schema without introspecting.
+
+        :returns: The schema, possibly stale, or None if not cached.
+        :rtype: :py:class:Schema
+        """
+        with self._lock:
+            return self._schemas.get(database_name)
+
+    def names(self):
+        """Names of the databases with a cached schema."""
+        with self._lock:
+            return list(self._schemas)
+
+    def get(self, database_name, database_config, driver, refresh=False):
+        """
+        Return a database's schema, introspecting it if needed.
+
+        :param database_name: The requested database name.
+        :param database_config: The database's configuration.
+        :type database_config: :py:class:DbConfig
+        :param driver: The driver to introspect with.
+        :type driver: :py:class:base.DatabaseDriver
+        :param refresh: Introspect even if a fresh schema is cached.
+        :rtype: :py:class:Schema
+        """
+        ttl = self.policy(database_config)
+        if not refresh:
+            with self._lock:
+                schema = self._schemas.get(database_name)
+                if schema is not None and schema.loaded + ttl > time.time():
+                    self._schemas[database_name] = self._schemas.pop(
+                        database_name
+                    )
+                    return schema
+
+        def load():
+            SCHEMA_INTROSPECTIONS.inc(
+                (database_config["identifier"].pattern,)
+            )
+            schema = Schema(driver.introspect())
+            with self._lock:
+                self._schemas.pop(database_name, None)
+                self._schemas[database_name] = schema
+                while len(self._schemas) > self.max_databases:
+                    self._schemas.popitem(last=False)
+            return schema
+        return self._flights.do(database_name, load)[0]
+
+    def invalidate(self, database_name):
+        """Drop a database's cached schema."""
+        with self._lock:
+            self._schemas.pop(database_name, None)
+
+
+schema_cache = SchemaCache()
@@ -0,0 +1,262 @@
+"""Run one query on many databases in parallel and merge the results."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import functools
+import itertools
+import logging
+import re
+import threading
+
+from collections import OrderedDict
+from timeit import default_timer
+
+from sql_json_bridge.db_drivers.base import watch_connections
+from sql_json_bridge.extensions.cache import is_read_query
+
+from six.moves import queue
+
+LOG = logging.getLogger(__name__)
+
+# Rows handed from a worker to the response per queue item.
+FANOUT_BATCH_SIZE = 500
+
+# Queue items buffered per database before workers wait for the client.
+FANOUT_QUEUE_DEPTH = 4
+
+
+def known_databases(databases):
+    """
+    List the database names a registry knows of.
+
+    Literal identifiers name themselves. Regex identifiers stand for
+    many databases, so configs list theirs under `members`.
+
+    :param databases: Mapping of compiled identifier to DbConfig.
+    :rtype: list(str)
+    """
+    names = []
+    for identifier, config in databases.items():
+        if identifier.groups == 0:
+            names.append(identifier.pattern)
+        names.extend(config.get("members") or ())
+    return sorted(set(names))
+
+
+def listed_names(config):
+    """
+    Names a configured database is listed, and authorized for listing, by.
+
+    Literal identifiers name themselves, and regex identifiers list theirs
+    under `members`; a regex identifier without members goes by its
+    pattern, so an identity allowed e.g. "shard_*" sees "shard_(\\d+)".
+
+    :param config: The database's configuration.
+    :rtype: list(str)
+    """
+    identifier = config["identifier"]
+    names = [identifier.pattern] if identifier.groups == 0 else []
+    names.extend(config.get("members") or ())
+    return names or [identifier.pattern]
+
+
+def select_databases(databases, pattern):
+    """
+    Pick the known database names fully matching a regex.
+
+    :raises re.error: If `pattern` is not a valid regex.
+    """
+    pattern = re.compile("(?:%s)\\Z" % pattern)
+    return [name for name in known_databases(databases)
+            if pattern.match(name)]
+
+
+class FanOut(object):
+    """
+    One query running on several databases through a bounded executor.
+
+    Each database's rows are read in a worker and handed over through a
+    queue, tagged with the database name, as they arrive. Workers that
+    get ahead of the client wait on the queue. The connection each worker
+    holds is recorded, so when the deadline passes or the client goes
+    away, :py:meth:`close` cancels queries still running with their
+    driver's `cancel`, for drivers whose `cancel_is_threadsafe`, and
+    workers waiting on the queue stop and close their rows. Queries on
+    other drivers are left to the worker, which closes its rows itself,
+    and to the driver's own statement timeout.
+
+    :param registry: The :py:class:`registry.ConfigRegistry`.
+    :param names: Names of the databases to query.
+    :param sql: The query.
+    :param params: Bind parameters for the query, if any.
+    :param executor: Executor to run the per-database workers on.
+    :param timeout: Seconds until the whole fan-out is abandoned.
+    :param max_rows: Row limit for databases without their own.
+    :param read_primary: Read from primaries even if replicas exist.
+    """
+
+    def __init__(self, registry, names, sql, params, executor, timeout,
+                 max_rows=None, read_primary=False):
+        self.registry = registry
+        self.names = list(OrderedDict.fromkeys(names))
+        self.sql = sql
+        self.params = params
+        self.executor = executor
+        self.deadline = default_timer() + timeout
+        self.max_rows = max_rows
+        self.read = is_read_query(sql) and not read_primary
+        self.queue = queue.Queue(FANOUT_QUEUE_DEPTH * max(len(names), 1))
+        self.stop = threading.Event()
+        self.futures = []
+        # Connections workers hold, by database name, with their driver.
+        self.running = {}
+        # Databases whose query `close` is cancelling.
+        self.cancelling = set()
+        self._cond = threading.Condition(threading.Lock())
+
+    def driver(self, name):
+        resolved = self.registry.resolve(name)
+        if resolved is None:
+            raise LookupError("Could not find matching database.")
+        config, args = resolved
+        if self.read:
+            return config.get_read_driver(args)
+        return config.get_driver(args)
+
+    def put(self, item):
+        """Queue an item for the client; False once the fan-out stopped."""
+        while not self.stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def checkout(self, name, db, connection):
+        """Record a worker's connection, unless the fan-out stopped."""
+        with self._cond:
+            if self.stop.is_set():
+                raise RuntimeError("Fan-out stopped.")
+            self.running[name] = (db, connection)
+
+    def release(self, name, db, connection):
+        """
+        Forget a worker's connection before it goes back to the pool.
+
+        Waits while `close` is cancelling the connection's query, so the
+        cancel cannot land on another request's query.
+        """
+        with self._cond:
+            while name in self.cancelling:
+                self._cond.wait()
+            self.running.pop(name, None)
+
+    def run_one(self, name):
+        """Run the query on one database, queueing its rows."""
+        rows = None
+        try:
+            if self.stop.is_set():
+                return
+            db = self.driver(name)
+            limit = db.limits["max_rows"] or self.max_rows
+            with watch_connections(functools.partial(self.checkout, name),
+                                   functools.partial(self.release, name)):
+                columns, rows = db.stream_rows(self.sql, self.params)
+            if not self.put(("columns", name, columns)):
+                return
+            count = 0
+            truncated = False
+            while True:
+                size = FANOUT_BATCH_SIZE
+                if limit is not None:
+                    size = min(size, limit - count)
+                batch = list(itertools.islice(rows, size))
+                if batch:
+                    count += len(batch)
+                    if not self.put(("rows", name, batch)):
+                        return
+                if limit is not None and count >= limit:
+                    truncated = next(rows, None) is not None
+                    break
+                if len(batch) < size:
+                    break
+            # Return the connection before reporting, so `close` has
+            # nothing left to cancel once every database is done.
+            rows.close()
+            self.put(("done", name, (count, truncated)))
+        except Exception as e:
+            self.put(("error", name, e))
+        finally:
+            if rows is not None:
+                rows.close()
+
+    def start(self):
+        self.futures = [self.executor.submit(self.run_one, name)
+                        for name in self.names]
+
+    def close(self):
+        """Stop every worker, cancelling queries still running."""
+        self.stop.set()
+        for future in self.futures:
+            future.cancel()
+        with self._cond:
+            running = [(name, db, connection)
+                       for name, (db, connection) in self.running.items()
+                       if db.cancel_is_threadsafe]
+            self.cancelling.update(name for name, _, _ in running)
+            self.running.clear()
+        # Cancels may take a round trip, e.g. pymysql's KILL QUERY, so
+        # they are sent without the lock; `release` holds the connections
+        # back from the pool until they are done.
+        try:
+            for name, db, connection in running:
+                try:
+                    db.cancel(connection)
+                except Exception:
+                    LOG.exception("Could not cancel query on %s.", name)
+        finally:
+            with self._cond:
+                self.cancelling.clear()
+                self._cond.notify_all()
+
+    def events(self):
+        """
+        Yield results in the order they arrive.
+
+        Items are ("columns", name, columns), ("rows", name, rows),
+        ("done", name, (rows_matched, truncated)) and ("error", name,
+        exception). Finally ("timeout", names, None) lists the databases
+        that had not finished by the deadline, if any.
+        """
+        pending = set(self.names)
+        self.start()
+        try:
+            while pending:
+                remaining = self.deadline - default_timer()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item[0] in ("done", "error"):
+                    pending.discard(item[1])
+                yield item
+            if pending:
+                yield ("timeout", [name for name in self.names
+                                   if name in pending], None)
+        finally:
+            self.close()
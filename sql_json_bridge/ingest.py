@@ -0,0 +1,128 @@
+"""Streaming readers for bulk load request bodies."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import csv
+import itertools
+import json
+
+from collections import OrderedDict
+
+import six
+
+
+def _lines(stream):
+    """Iterate over a binary stream line by line, as native strings."""
+    for line in iter(stream.readline, b""):
+        if six.PY3:
+            line = line.decode("utf-8")
+        yield line
+
+
+class InvalidRecord(ValueError):
+    """
+    Raised for a body line that cannot be loaded.
+
+    :param line: The line's number, counting from 1.
+    :param message: What is wrong with it.
+    """
+
+    def __init__(self, line, message):
+        super(InvalidRecord, self).__init__(
+            "Line %d: %s" % (line, message)
+        )
+        self.line = line
+
+
+def read_ndjson(stream, columns=None):
+    """
+    Read newline-delimited JSON objects from a stream.
+
+    Columns are taken from `columns` or the keys of the first object; keys
+    missing from later objects are inserted as NULL, while keys that are
+    not columns are rejected rather than dropped.
+
+    :param stream: A binary file-like object, e.g. `request.stream`.
+    :param columns: Column names to read, if known up front.
+    :type columns: list(str)
+    :returns: A (columns, rows) pair; rows are read lazily.
+    :raises ValueError: If the body is empty.
+    :raises InvalidRecord: For a line that is not a JSON object, or has
+                           keys that are not columns. May be raised while
+                           reading rows.
+    """
+    def objects():
+        for number, line in enumerate(_lines(stream), 1):
+            if not line.strip():
+                continue
+            try:
+                obj = json.loads(line, object_pairs_hook=OrderedDict)
+            except ValueError as e:
+                raise InvalidRecord(number, "Invalid JSON: %s" % e)
+            if not isinstance(obj, dict):
+                raise InvalidRecord(number, "Expected a JSON object.")
+            yield number, obj
+
+    objects = objects()
+    first = next(objects, None)
+    if first is None:
+        raise ValueError("Body must contain JSON objects, one per line.")
+    if columns is None:
+        columns = list(first[1])
+    known = frozenset(columns)
+
+    def rows():
+        for number, obj in itertools.chain([first], objects):
+            unknown = [key for key in obj if key not in known]
+            if unknown:
+                raise InvalidRecord(
+                    number, "Unknown columns: %s." % ", ".join(unknown)
+                )
+            yield tuple(obj.get(column) for column in columns)
+    return columns, rows()
+
+
+def read_csv(stream, columns=None):
+    """
+    Read CSV rows from a stream.
+
+    The first row holds column names unless `columns` is given. Empty
+    fields are inserted as NULL.
+
+    :param stream: A binary file-like object, e.g. `request.stream`.
+    :param columns: Column names to read, if the body has no header.
+    :type columns: list(str)
+    :returns: A (columns, rows) pair; rows are read lazily.
+    :raises ValueError: If the body is empty.
+    """
+    reader = csv.reader(_lines(stream))
+    if columns is None:
+        columns = next(reader, None)
+        if not columns:
+            raise ValueError("CSV body must start with a header row.")
+
+    def rows():
+        for record in reader:
+            if record:
+                yield tuple(value if value != "" else None
+                            for value in record)
+    return columns, rows()
+
+
+READERS = {
+    "application/x-ndjson": read_ndjson,
+    "application/json": read_ndjson,
+    "text/csv": read_csv,
+}
@@ -14,53 +14,991 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>
 
+import datetime
+import re
+
+from collections import OrderedDict
 
 from flask import (Blueprint,
+                   Response,
                    current_app,
+                   g,
+                   json,
                    jsonify,
-                   request)
+                   request,
+                   url_for)
+
+from sql_json_bridge.auth import auth, requires_auth
+from sql_json_bridge.db_drivers.base import BulkInsertError
+from sql_json_bridge.db_drivers.pool import PoolTimeout
+from sql_json_bridge.db_drivers.procedures import load_proc_params
+from sql_json_bridge.db_drivers.replicas import NoReplicaAvailable
+from sql_json_bridge.extensions.cache import (cache_key,
+                                              is_read_query,
+                                              result_cache)
+from sql_json_bridge.extensions.changes import change_feeds
+from sql_json_bridge.extensions.cursors import OpenCursor, open_cursors
+from sql_json_bridge.extensions.jobs import DONE, FAILED, jobs
+from sql_json_bridge.extensions.schema import schema_cache
+from sql_json_bridge.fanout import FanOut, listed_names, select_databases
+from sql_json_bridge.ingest import InvalidRecord, READERS
+from sql_json_bridge.limits import LimitExceeded
+from sql_json_bridge.metrics import (counting,
+                                     label_database,
+                                     record_rows,
+                                     stage)
+from sql_json_bridge.responses import (event_response,
+                                       fanout_response,
+                                       meta_headers,
+                                       negotiate_format,
+                                       proc_response,
+                                       result_response)
 
-from sql_json_bridge.config import load_database_configs
+import six
 
 legacy = Blueprint('legacy', __name__)
 
+TRUTHY = ('1', 'true', 'yes', 'on')
+
+# Statements changing the schema, which drop the cached schema.
+DDL = re.compile(r'\s*(CREATE|ALTER|DROP|RENAME)\b', re.IGNORECASE)
+
+CACHE_HEADER = 'X-Bridge-Cache'
+
+READ_HEADER = 'X-Bridge-Read'
+
 
 def get_database_config(database_name):
-    for db in current_app.config["DATABASES"]:
-        if db.match(database_name) is not None:
-            return current_app.config["DATABASES"][db]
+    """
+    Resolve a database name through the app's config registry.
+
+    :returns: A (config, identifier groups) pair, or None.
+    """
+    with stage("route"):
+        resolved = current_app.config["DATABASE_REGISTRY"].resolve(
+            database_name
+        )
+    if resolved is not None:
+        g.database_config = resolved[0]
+        label_database(resolved[0])
+    return resolved
+
+
+def cache_directive():
+    """
+    Read the client's cache directive for this request.
+
+    `X-Bridge-Cache: bypass` (or `Cache-Control: no-store`) skips the
+    cache entirely; `X-Bridge-Cache: refresh` (or `Cache-Control:
+    no-cache`) re-runs the query and replaces the cached result.
+    """
+    directive = request.headers.get(CACHE_HEADER, '').lower()
+    if directive in ('bypass', 'refresh'):
+        return directive
+    cache_control = request.headers.get('Cache-Control', '').lower()
+    if 'no-store' in cache_control:
+        return 'bypass'
+    if 'no-cache' in cache_control:
+        return 'refresh'
+    return None
+
+
+def read_driver(config, args):
+    """
+    Get the driver to run the current request's read-only queries on.
+
+    Reads are spread across the database's replicas, if it has any,
+    unless the client sends `X-Bridge-Read: primary`, e.g. to read its
+    own writes.
+    """
+    if request.headers.get(READ_HEADER, '').lower() == 'primary':
+        return config.get_driver(args)
+    return config.get_read_driver(args)
+
+
+def error_response(e):
+    """Render an exception raised while running a query."""
+    if isinstance(e, LimitExceeded):
+        return jsonify(ERROR=str(e)), e.status_code, {'Retry-After': '1'}
+    if isinstance(e, (PoolTimeout, NoReplicaAvailable)):
+        return jsonify(ERROR=str(e)), 503
+    return jsonify(ERROR=": ".join(str(i) for i in e.args)), 422
+
+
+def request_param(data, name):
+    """Read a parameter from the JSON body, or failing that the query."""
+    if data is not None and name in data:
+        return data[name]
+    return request.values.get(name)
+
+
+def flag_param(data, name):
+    """Read a boolean parameter from the JSON body or the query."""
+    if data is not None and name in data:
+        return bool(data[name])
+    return request.values.get(name, '').lower() in TRUTHY
+
 
+def page_size_param(data):
+    """
+    Read the optional `page_size` parameter.
 
-@legacy.route("/query/<database_name>")
-@legacy.route("/update/<database_name>")
+    :raises ValueError: If it is not a positive integer.
+    """
+    page_size = request_param(data, 'page_size')
+    if page_size is None:
+        return None
+    page_size = int(page_size)
+    if page_size < 1:
+        raise ValueError(page_size)
+    return page_size
+
+
+def row_limit(db):
+    """The most rows one response may carry for a database, if any."""
+    return db.limits["max_rows"] or current_app.config["QUERY_MAX_ROWS"]
+
+
+def page_meta(rows, more):
+    """Result metadata for a page of rows."""
+    return OrderedDict([("rows_matched", len(rows)), ("truncated", more)])
+
+
+def limited(rows, limit, meta):
+    """
+    Pass at most `limit` rows of a stream through.
+
+    `meta` is updated with the number of rows passed and whether the
+    stream was cut short, which closes it and cancels the query.
+    """
+    count = 0
+    try:
+        for row in rows:
+            if limit is not None and count >= limit:
+                meta["truncated"] = True
+                break
+            count += 1
+            yield row
+    finally:
+        meta["rows_matched"] = count
+        rows.close()
+
+
+def valid_params(params):
+    """Bind parameters must be a JSON array, object or null."""
+    return params is None or isinstance(params, (dict, list))
+
+
+@legacy.route("/query/<database_name>", methods=["GET", "POST"])
+@legacy.route("/update/<database_name>", methods=["GET", "POST"])
+@requires_auth
 def run_query(database_name):
-    # TODO: Write something...
-    db = get_database_config(database_name).driver
-    if db is None:
+    resolved = get_database_config(database_name)
+    if resolved is None:
         return jsonify(
             ERROR="Could not find matching database."
-        )
+        ), 404
+    config, args = resolved
+    db = config.get_driver(args)
 
     data = request.get_json(silent=True)
-    if data is not None and "sql" in data:
-        sql = data["sql"]
+    try:
+        page_size = page_size_param(data)
+    except ValueError:
+        return jsonify(ERROR="page_size must be a positive integer."), 400
+    limit = row_limit(db)
+    if page_size is not None:
+        limit = page_size = min(page_size, limit) if limit else page_size
+
+    token = request_param(data, 'cursor')
+    if token is not None:
+        fmt = negotiate_format()
+        if fmt is None:
+            return jsonify(ERROR="No acceptable result format."), 406
+        return next_page(database_name, token, fmt, page_size)
+
+    sql = request_param(data, 'sql')
+    if sql is None:
+        return jsonify(ERROR="SQL query missing from request."), 400
+
+    stream = flag_param(data, 'stream')
+
+    params = data.get("params") if data is not None else None
+    if not valid_params(params):
+        return jsonify(ERROR="Params must be an array or object."), 400
+
+    if flag_param(data, 'job'):
+        if request.url_rule.rule.startswith("/update"):
+            return jsonify(ERROR="Only queries can run as jobs."), 400
+        return submit_job(config, args, database_name, sql, params)
+
+    fmt = negotiate_format()
+    if fmt is None:
+        return jsonify(ERROR="No acceptable result format."), 406
+
+    if request.url_rule.rule.startswith("/update"):
+        if DDL.match(sql):
+            schema_cache.invalidate(database_name)
+        return run_update(db, fmt, sql, params, data)
+    if is_read_query(sql):
+        try:
+            db = read_driver(config, args)
+        except NoReplicaAvailable as e:
+            return error_response(e)
+
+    ttl = None
+    directive = cache_directive()
+    if directive != 'bypass' and page_size is None and is_read_query(sql):
+        ttl = result_cache.policy(config)
+    if ttl is not None:
+        key = cache_key((config.fingerprint, tuple(args)), sql, params,
+                        fmt.mimetype)
+        if directive != 'refresh':
+            with stage("cache"):
+                cached = result_cache.get(key)
+            if cached is not None:
+                rows_matched, body = cached
+                record_rows(rows_matched)
+                response = meta_headers(
+                    Response(body, mimetype=fmt.mimetype),
+                    OrderedDict([("rows_matched", rows_matched),
+                                 ("truncated", False)]),
+                )
+                response.headers[CACHE_HEADER] = 'hit'
+                return response
+
+    cursor = None
+    try:
+        if stream or page_size is not None:
+            with stage("execute"):
+                columns, rows = db.stream_rows(sql, params)
+            if not stream:
+                cursor = OpenCursor(database_name, columns, rows, limit)
+                with stage("fetch"):
+                    rows, more = cursor.fetch(limit)
+        else:
+            # Identical reads running concurrently may share one
+            # execution, see DbConfig.fetch_rows.
+            with stage("execute"):
+                columns, rows, more = config.fetch_rows(args, db, sql,
+                                                        params, limit)
+    except Exception as e:
+        return error_response(e)
+
+    if stream:
+        meta = page_meta([], False)
+        return result_response(fmt, columns,
+                               counting(limited(rows, limit, meta)),
+                               stream=True, meta=meta)
+
+    meta = page_meta(rows, more)
+    if more and page_size is not None:
+        meta["next"] = open_cursors.put(cursor)
+    elif cursor is not None:
+        cursor.close()
+
+    # Streamed misses and truncated results are not stored, so memory
+    # stays bounded.
+    store = ttl is not None and not more
+    record_rows(len(rows))
+    with stage("serialize"):
+        response = result_response(fmt, columns, rows, meta=meta)
+    if store:
+        result_cache.set(key, len(rows), response.get_data(), ttl)
+        response.headers[CACHE_HEADER] = 'miss'
+    return response
+
+
+def next_page(database_name, token, fmt, page_size):
+    """
+    Read the next page from a cursor left open by an earlier request.
+
+    Pages keep the size of the first page unless `page_size` is given.
+    """
+    cursor = open_cursors.take(token, database_name)
+    if cursor is None:
+        return jsonify(ERROR="Cursor expired or not found."), 410
+    if page_size is not None:
+        cursor.page_size = page_size
+    try:
+        with stage("fetch"):
+            rows, more = cursor.fetch(cursor.page_size)
+    except Exception as e:
+        return error_response(e)
+
+    meta = page_meta(rows, more)
+    if more:
+        meta["next"] = open_cursors.put(cursor)
     else:
-        sql = request.values.get('sql')
+        cursor.close()
+    record_rows(len(rows))
+    with stage("serialize"):
+        return result_response(fmt, cursor.columns, rows, meta=meta)
+
+
+def submit_job(config, args, database_name, sql, params):
+    """
+    Run a query in the background, answering with its job right away.
+
+    See :py:class:`extensions.jobs.JobManager`. The response is `202
+    Accepted`, with the job's status URL in `Location`.
+    """
+    db = config.get_driver(args)
+    try:
+        if is_read_query(sql):
+            db = read_driver(config, args)
+        job = jobs.submit(database_name, db, sql, params)
+    except (LimitExceeded, NoReplicaAvailable) as e:
+        return error_response(e)
+    response = jsonify(job.status())
+    response.status_code = 202
+    response.headers['Location'] = url_for('.job_status', job_id=job.id)
+    return response
+
+
+@legacy.route("/jobs/<job_id>", methods=["GET"])
+@requires_auth
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify(ERROR="Job expired or not found."), 404
+    denied = auth.forbidden(job.database)
+    if denied is not None:
+        return denied
+    return jsonify(job.status())
+
+
+@legacy.route("/jobs/<job_id>", methods=["DELETE"])
+@requires_auth
+def cancel_job(job_id):
+    """Cancel a job, deleting its result."""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify(ERROR="Job expired or not found."), 404
+    denied = auth.forbidden(job.database)
+    if denied is not None:
+        return denied
+    job = jobs.cancel(job_id) or job
+    return jsonify(job.status())
+
+
+@legacy.route("/jobs/<job_id>/result", methods=["GET"])
+@requires_auth
+def job_result(job_id):
+    """
+    Read rows of a finished job's result from its spool.
+
+    `offset` (default 0) skips rows and `page_size` limits the rows sent;
+    without it every remaining row is sent. Rows are streamed from disk.
+    If more rows follow, the result is flagged `truncated` and
+    `next_offset` gives the offset of the next page.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify(ERROR="Job expired or not found."), 404
+    denied = auth.forbidden(job.database)
+    if denied is not None:
+        return denied
+    if job.state == FAILED:
+        return jsonify(ERROR=job.error), 422
+    if job.state != DONE:
+        return jsonify(ERROR="Job has not finished.", state=job.state), 409
+
+    try:
+        offset = int(request.args.get('offset', 0))
+        page_size = page_size_param(None)
+        if offset < 0:
+            raise ValueError(offset)
+    except ValueError:
+        return jsonify(
+            ERROR="offset and page_size must be positive integers."
+        ), 400
+    fmt = negotiate_format()
+    if fmt is None:
+        return jsonify(ERROR="No acceptable result format."), 406
+
+    spool = job.spool
+    count = max(spool.rows - offset, 0)
+    if page_size is not None:
+        count = min(count, page_size)
+    end = offset + count
+    meta = OrderedDict([("rows_matched", count),
+                        ("truncated", end < spool.rows or job.truncated)])
+    if end < spool.rows:
+        meta["next_offset"] = end
+    response = result_response(fmt, spool.columns,
+                               spool.read(offset, count),
+                               stream=True, meta=meta)
+    return meta_headers(response, meta)
+
+
+@legacy.route("/changes/<database_name>", methods=["POST"])
+@requires_auth
+def subscribe_changes(database_name):
+    """
+    Subscribe to the rows a query gains over time.
+
+    Takes a JSON body of the form::
+
+        {"sql": "SELECT id, total FROM orders WHERE region = %s",
+         "params": ["eu"],
+         "watermark": "id",
+         "from": "latest"}
+
+    The watermark column must be in the query's result and only increase
+    as rows are added, e.g. an auto-increment id. `from` is the watermark
+    to start past: omitted, the first poll returns every current row;
+    "latest" only sees rows added from now on. The query is wrapped in a
+    derived table, so it may not end in ORDER BY. See
+    :py:class:`extensions.changes.ChangeFeeds`. The response is `201
+    Created`, with the subscription's URL in `Location`.
+    """
+    resolved = get_database_config(database_name)
+    if resolved is None:
+        return jsonify(
+            ERROR="Could not find matching database."
+        ), 404
+    config, args = resolved
+
+    data = request.get_json(silent=True) or {}
+    sql = data.get("sql")
+    column = data.get("watermark")
+    params = data.get("params")
+    if not sql or not isinstance(sql, six.string_types):
+        return jsonify(ERROR="SQL Query missing from request."), 400
+    if not column or not isinstance(column, six.string_types):
+        return jsonify(ERROR="Watermark column missing from request."), 400
+    if not is_read_query(sql):
+        return jsonify(ERROR="Only queries can be subscribed to."), 400
+    if not valid_params(params):
+        return jsonify(ERROR="Params must be an array or object."), 400
+
+    try:
+        with stage("execute"):
+            subscription = change_feeds.subscribe(
+                database_name, config, args, sql, params, column,
+                start=data.get("from"),
+            )
+    except Exception as e:
+        return error_response(e)
+    response = jsonify(subscription.status())
+    response.status_code = 201
+    response.headers['Location'] = url_for('.poll_changes',
+                                           subscription_id=subscription.id)
+    return response
+
+
+def watermark_param(value):
+    """
+    Read a watermark a client sent back, in JSON.
+
+    :raises ValueError: If it is not valid JSON.
+    """
+    return json.loads(value)
+
+
+@legacy.route("/changes/<subscription_id>", methods=["GET"])
+@requires_auth
+def poll_changes(subscription_id):
+    """
+    Read the rows added since the subscription's last poll.
+
+    `wait` long-polls: with no new rows, the request waits up to that
+    many seconds for some. `page_size` limits the rows returned, which
+    flags the result `truncated` if more are waiting. The footer carries
+    the subscription's new `watermark`; sending it back as `since`, in
+    JSON, rewinds the subscription to it, e.g. to re-read a poll whose
+    response was lost.
+    """
+    subscription = change_feeds.get(subscription_id)
+    if subscription is None:
+        return jsonify(ERROR="Subscription expired or not found."), 404
+    denied = auth.forbidden(subscription.feed.database)
+    if denied is not None:
+        return denied
+    try:
+        wait = float(request.args.get('wait', 0))
+        page_size = page_size_param(None)
+        if wait < 0:
+            raise ValueError(wait)
+    except ValueError:
+        return jsonify(
+            ERROR="wait and page_size must be positive numbers."
+        ), 400
+    fmt = negotiate_format()
+    if fmt is None:
+        return jsonify(ERROR="No acceptable result format."), 406
+    if 'since' in request.args:
+        try:
+            since = watermark_param(request.args['since'])
+        except ValueError:
+            return jsonify(ERROR="since must be a JSON value."), 400
+        change_feeds.rewind(subscription, since)
+    g.database_config = subscription.feed.config
+    label_database(subscription.feed.config)
+
+    try:
+        with stage("execute"):
+            delta = change_feeds.poll(subscription, page_size, wait)
+    except Exception as e:
+        return error_response(e)
+    meta = OrderedDict([("rows_matched", len(delta.rows)),
+                        ("truncated", delta.more),
+                        ("watermark", delta.watermark)])
+    record_rows(len(delta.rows))
+    with stage("serialize"):
+        return result_response(fmt, delta.columns, delta.rows, meta=meta)
+
+
+@legacy.route("/changes/<subscription_id>/events", methods=["GET"])
+@requires_auth
+def stream_changes(subscription_id):
+    """
+    Push the rows a subscription gains as server-sent events.
+
+    See :py:func:`responses.event_response`. A reconnecting client's
+    `Last-Event-ID` rewinds the subscription to the last event it got.
+    """
+    subscription = change_feeds.get(subscription_id)
+    if subscription is None:
+        return jsonify(ERROR="Subscription expired or not found."), 404
+    denied = auth.forbidden(subscription.feed.database)
+    if denied is not None:
+        return denied
+    try:
+        page_size = page_size_param(None)
+    except ValueError:
+        return jsonify(ERROR="page_size must be a positive integer."), 400
+    last_event = request.headers.get('Last-Event-ID')
+    if last_event:
+        try:
+            since = watermark_param(last_event)
+        except ValueError:
+            return jsonify(ERROR="Last-Event-ID must be a JSON value."), 400
+        change_feeds.rewind(subscription, since)
+    return event_response(change_feeds.events(subscription, page_size))
+
+
+@legacy.route("/changes/<subscription_id>", methods=["DELETE"])
+@requires_auth
+def unsubscribe_changes(subscription_id):
+    """Drop a subscription."""
+    subscription = change_feeds.get(subscription_id)
+    if subscription is None:
+        return jsonify(ERROR="Subscription expired or not found."), 404
+    denied = auth.forbidden(subscription.feed.database)
+    if denied is not None:
+        return denied
+    change_feeds.unsubscribe(subscription_id)
+    return jsonify(subscription.status())
+
+
+def run_update(db, fmt, sql, params, data):
+    """
+    Run and commit a statement for the /update endpoint.
+
+    A `many` array of parameter sets in the request body runs the
+    statement once per set through `executemany`, e.g. for bulk inserts.
+    """
+    many = data.get("many") if data is not None else None
+    if many is not None:
+        if (not isinstance(many, list) or
+                not all(p is not None and valid_params(p) for p in many)):
+            return jsonify(ERROR="Many must be an array of params."), 400
+        try:
+            rowcount = db.run_many(sql, many)
+        except Exception as e:
+            return error_response(e)
+        return jsonify(result=[], rows_matched=rowcount)
+
+    try:
+        with stage("execute"):
+            columns, rows, rowcount = db.run_update(sql, params)
+    except Exception as e:
+        return error_response(e)
+    record_rows(len(rows))
+    with stage("serialize"):
+        return result_response(fmt, columns, rows,
+                               meta={"rows_matched": rowcount})
+
+
+def batch_result(result):
+    """Render one `run_batch` result in the ResultSet shape."""
+    if isinstance(result, Exception):
+        return {"ERROR": ": ".join(str(i) for i in result.args)}
+    columns, rows, rowcount = result
+    return {
+        "result": [dict(zip(columns, row)) for row in rows],
+        "rows_matched": rowcount,
+    }
+
+
+@legacy.route("/batch/<database_name>", methods=["POST"])
+@requires_auth
+def run_batch(database_name):
+    """
+    Run several statements against one database in a single request.
+
+    Takes a JSON body of the form::
+
+        {"statements": ["SELECT ...", {"sql": "...", "params": [...]}],
+         "transaction": false,
+         "concurrent": false}
+
+    Statements run in order on one connection, optionally as a single
+    transaction. With `concurrent`, a batch made up only of read queries
+    is instead spread across pooled connections and run in parallel.
+    Batches of only read queries run on replicas, if the database has any.
+    """
+    resolved = get_database_config(database_name)
+    if resolved is None:
+        return jsonify(
+            ERROR="Could not find matching database."
+        ), 404
+    config, args = resolved
+    db = config.get_driver(args)
+
+    data = request.get_json(silent=True) or {}
+    statements = data.get("statements")
+    if not isinstance(statements, list) or not statements:
+        return jsonify(ERROR="Statements missing from request."), 400
+    if len(statements) > current_app.config["BATCH_MAX_STATEMENTS"]:
+        return jsonify(ERROR="Too many statements in batch."), 400
+    statements = [
+        stmt if isinstance(stmt, dict) else {"sql": stmt}
+        for stmt in statements
+    ]
+    if any(not stmt.get("sql") for stmt in statements):
+        return jsonify(ERROR="SQL query missing from statement."), 400
+
+    transaction = bool(data.get("transaction", False))
+    read_only = (not transaction and
+                 all(is_read_query(stmt["sql"]) for stmt in statements))
+    concurrent = bool(data.get("concurrent", False)) and read_only
+
+    try:
+        if concurrent:
+            executor = current_app.extensions["batch_executor"]
+            futures = [executor.submit(read_driver(config, args).run_batch,
+                                       [stmt])
+                       for stmt in statements]
+            results = [future.result()[0] for future in futures]
+        else:
+            if read_only:
+                db = read_driver(config, args)
+            results = db.run_batch(statements, transaction=transaction)
+    except (LimitExceeded, PoolTimeout, NoReplicaAvailable) as e:
+        return error_response(e)
+
+    return jsonify(results=[batch_result(result) for result in results])
+
+
+@legacy.route("/proc/<database_name>", methods=["POST"])
+@requires_auth
+def run_proc(database_name):
+    """
+    Call a stored procedure, streaming every result set it returns.
+
+    Takes a JSON body of the form::
+
+        {"procedure": "dbo.report",
+         "params": {"start": {"value": "2016-01-01", "type": "date"},
+                    "total": {"type": "int", "output": true}}}
+
+    `params` is an object of named parameters, or an array of positional
+    ones, see :py:func:`procedures.load_proc_params`. The call is built
+    by the driver, so clients never send `EXEC` or `CALL` statements.
+    Procedures may write, so they always run on the primary. The
+    response is described in :py:func:`responses.proc_response`.
+    """
+    resolved = get_database_config(database_name)
+    if resolved is None:
+        return jsonify(
+            ERROR="Could not find matching database."
+        ), 404
+    config, args = resolved
+    db = config.get_driver(args)
+
+    data = request.get_json(silent=True) or {}
+    proc_name = data.get("procedure")
+    if not proc_name or not isinstance(proc_name, six.string_types):
+        return jsonify(ERROR="Procedure missing from request."), 400
+    try:
+        params = load_proc_params(data.get("params"))
+    except ValueError as e:
+        return jsonify(ERROR=str(e)), 400
+
+    try:
+        with stage("execute"):
+            items = db.run_stored_proc(proc_name, params)
+            # Runs the call, so errors starting it get a proper status.
+            first = next(items, None)
+    except NotImplementedError:
+        return jsonify(
+            ERROR="Stored procedures are not supported by this database."
+        ), 501
+    except ValueError as e:
+        return jsonify(ERROR=str(e)), 400
+    except Exception as e:
+        return error_response(e)
+    return proc_response(items, first)
+
+
+@legacy.route("/fanout", methods=["POST"])
+@requires_auth
+def fan_out():
+    """
+    Run one query on many databases in parallel, merging the results.
+
+    Takes a JSON body of the form::
+
+        {"sql": "SELECT ...", "params": [...],
+         "databases": ["shard_1", "shard_2"],
+         "timeout": 10}
+
+    with `pattern`, a regex matched against the names of known databases,
+    in place of `databases`. Regex identifiers list their databases under
+    `members` in their config. Results are streamed as NDJSON, tagged
+    with the database they came from, see
+    :py:func:`responses.fanout_response`. A database that fails or
+    misses the deadline is reported in-band without stopping the others.
+    """
+    data = request.get_json(silent=True) or {}
+    sql = data.get("sql")
     if sql is None:
         return jsonify(ERROR="SQL query missing from request."), 400
+    params = data.get("params")
+    if not valid_params(params):
+        return jsonify(ERROR="Params must be an array or object."), 400
+
+    registry = current_app.config["DATABASE_REGISTRY"]
+    names = data.get("databases")
+    pattern = data.get("pattern")
+    if pattern is not None:
+        try:
+            names = select_databases(registry.databases, pattern)
+        except (re.error, TypeError):
+            return jsonify(ERROR="Pattern must be a valid regex."), 400
+    if (not isinstance(names, list) or
+            not all(isinstance(name, six.string_types) for name in names)):
+        return jsonify(
+            ERROR="Databases must be an array of names, or a pattern given."
+        ), 400
+    if len(names) > current_app.config["FANOUT_MAX_DATABASES"]:
+        return jsonify(ERROR="Too many databases in fan-out."), 400
+    for name in names:
+        denied = auth.forbidden(name)
+        if denied is not None:
+            return denied
+
+    max_timeout = current_app.config["FANOUT_TIMEOUT"]
+    try:
+        timeout = min(float(data.get("timeout", max_timeout)), max_timeout)
+    except (TypeError, ValueError):
+        return jsonify(ERROR="timeout must be a number."), 400
+
+    fanout = FanOut(
+        registry, names, sql, params,
+        current_app.extensions["fanout_executor"],
+        timeout,
+        max_rows=current_app.config["QUERY_MAX_ROWS"],
+        read_primary=(
+            request.headers.get(READ_HEADER, '').lower() == 'primary'
+        ),
+    )
+    return fanout_response(fanout.events(), len(fanout.names))
+
+
+@legacy.route("/load/<database_name>/<table>", methods=["POST"])
+@requires_auth
+def bulk_load(database_name, table):
+    """
+    Stream an NDJSON or CSV request body into a table.
+
+    Rows are read from the body as they arrive and inserted in batches of
+    `batch_size` rows (request parameter, or the database's `bulk`
+    config), each committed on its own. The response reports rows
+    written, batches, elapsed seconds and rows per second; if a batch
+    fails, earlier batches stay committed and are reported with the error.
+    A body line that is not a JSON object, or has keys that are not
+    columns, fails the load with a 400 naming the line.
+    """
+    resolved = get_database_config(database_name)
+    if resolved is None:
+        return jsonify(
+            ERROR="Could not find matching database."
+        ), 404
+    config, args = resolved
+    db = config.get_driver(args)
+
+    reader = READERS.get(request.mimetype)
+    if reader is None:
+        return jsonify(
+            ERROR="Body must be application/x-ndjson or text/csv."
+        ), 415
+
+    options = config.get("bulk") or {}
+    try:
+        batch_size = int(request.args.get(
+            'batch_size', options.get("batch_size", 1000)
+        ))
+    except ValueError:
+        return jsonify(ERROR="batch_size must be an integer."), 400
+    batch_size = max(1, min(batch_size, options.get("max_batch_size",
+                                                    10000)))
+    columns = request.args.get('columns')
+    if columns is not None:
+        columns = columns.split(',')
 
     try:
-        result = db.run_query(sql)
+        columns, rows = reader(request.stream, columns)
+        stats = db.bulk_insert(table, columns, rows, batch_size=batch_size)
+    except BulkInsertError as e:
+        response = jsonify(ERROR=": ".join(str(i) for i in e.args),
+                           rows_matched=e.stats["rows"],
+                           **e.stats)
+        # A bad record in the body is the client's error, not the table's.
+        if isinstance(e.error, InvalidRecord):
+            response.status_code = 400
+        else:
+            response.status_code = 422
+        return response
+    except ValueError as e:
+        return jsonify(ERROR=str(e)), 400
     except Exception as e:
-        return jsonify(ERROR=": ".join(str(i) for i in e.args)), 422
+        return error_response(e)
+    return jsonify(rows_matched=stats["rows"], **stats)
 
-    return jsonify(result=result)
 
+@legacy.route("/schema/<database_name>", methods=["GET"])
+@requires_auth
+def get_schema(database_name):
+    """
+    Describe a database's tables, columns and indexes.
 
-@legacy.list("/list")
-def list():
-    current_app.config["DATABASES"] = load_database_configs(
-        current_app.config["DATABASE_CONFIG_LOCATION"]
+    Served from :py:class:`extensions.schema.SchemaCache`, so clients
+    can look tables up without introspection queries of their own.
+    `table` filters tables by a shell-style pattern, e.g. "order*", and
+    `schema` by schema name. `X-Bridge-Cache: refresh` re-reads the
+    schema from the database.
+    """
+    resolved = get_database_config(database_name)
+    if resolved is None:
+        return jsonify(
+            ERROR="Could not find matching database."
+        ), 404
+    config, args = resolved
+    try:
+        with stage("execute"):
+            schema = schema_cache.get(database_name, config,
+                                      read_driver(config, args),
+                                      refresh=cache_directive() == 'refresh')
+    except Exception as e:
+        return error_response(e)
+    return jsonify(
+        database=database_name,
+        loaded=datetime.datetime.utcfromtimestamp(
+            schema.loaded
+        ).isoformat() + "Z",
+        tables=schema.filter(request.args.get('table'),
+                             request.args.get('schema')),
     )
-    configs = current_app.config["DATABASES"].values()
-    return jsonify(str(config["identifier"]) for config in configs)
+
+
+# Endpoints listed for each database by OPTIONS /query.
+ENDPOINT_TYPES = ('query', 'update', 'batch', 'proc', 'schema')
+
+# Connection settings shown by OPTIONS /query, unless a database lists
+# them under `hidden_options`.
+DATABASE_OPTIONS = OrderedDict([
+    ('hostname', ('host', 'server')),
+    ('username', ('user',)),
+])
+
+
+def database_option(config, names, cached):
+    """
+    Describe a configured database for OPTIONS /query.
+
+    :param config: The database's configuration.
+    :param names: Names of the database to list, from
+                  :py:func:`fanout.listed_names`.
+    :param cached: Names resolving to this database that have a cached
+                   schema.
+    """
+    identifier = config["identifier"]
+    if identifier.groups and not config.get("members"):
+        # A regex identifier without members; any matching name works.
+        names = ["{database_name}"] if names else []
+    names = names + [name for name in cached if name not in names]
+    urls = ["/%s/%s" % (kind, name)
+            for name in names for kind in ENDPOINT_TYPES]
+    endpoints = [
+        OrderedDict([("endpoint_url", url),
+                     ("endpoint_type", url.split("/")[1])])
+        for url in urls
+    ]
+    hidden = set(config.get("hidden_options") or ())
+    options = OrderedDict()
+    if 'driver' not in hidden:
+        options['driver'] = config["driver"]
+    connection = config.get("connection") or {}
+    for option, keys in DATABASE_OPTIONS.items():
+        if option in hidden:
+            continue
+        for key in keys:
+            if key in connection:
+                options[option] = connection[key]
+                break
+    option = OrderedDict([("identifier", identifier.pattern),
+                          ("endpoints", endpoints),
+                          ("options", options)])
+    tables = OrderedDict()
+    for name in cached:
+        schema = schema_cache.cached(name)
+        if schema is not None:
+            tables[name] = ["%s.%s" % (table["schema"], table["name"])
+                            for table in schema.tables]
+    if tables:
+        option["tables"] = tables
+    return option
+
+
+@legacy.route("/query", methods=["OPTIONS"])
+@requires_auth
+def database_options():
+    """
+    List configured databases, their endpoints and connection details.
+
+    Databases whose schema is cached also list their tables. Listing
+    never introspects, so it stays cheap for any number of databases.
+    Names the caller may not use are left out, as are databases left
+    with none.
+    """
+    registry = current_app.config["DATABASE_REGISTRY"]
+    cached = {}
+    for name in schema_cache.names():
+        resolved = registry.resolve(name)
+        if resolved is not None and auth.permits(name):
+            pattern = resolved[0]["identifier"].pattern
+            cached.setdefault(pattern, []).append(name)
+    options = []
+    for identifier, config in sorted(registry.databases.items(),
+                                     key=lambda item: item[0].pattern):
+        names = [name for name in listed_names(config)
+                 if auth.permits(name)]
+        names_cached = sorted(cached.get(identifier.pattern, ()))
+        if names or names_cached:
+            options.append(database_option(config, names, names_cached))
+    return jsonify(options)
+
+
+@legacy.route("/list", endpoint="list")
+@requires_auth
+def list_databases():
+    """List configured database identifiers the caller may use."""
+    databases = current_app.config["DATABASE_REGISTRY"].databases
+    return jsonify(databases=sorted(
+        identifier.pattern for identifier, config in databases.items()
+        if any(auth.permits(name) for name in listed_names(config))
+    ))
@@ -0,0 +1,141 @@
+"""Per-database concurrency limits and statement timeouts."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import contextlib
+import threading
+import time
+
+DEFAULT_LIMITS = {
+    "max_concurrent": None,
+    "max_queue": None,
+    "queue_timeout": 5,
+    "statement_timeout": None,
+    "max_rows": None,
+}
+
+# Extra seconds a driver's socket timeout allows past `statement_timeout`,
+# so a server-side cancel gets the chance to land first.
+CANCEL_GRACE = 5
+
+
+class LimitExceeded(Exception):
+    """
+    Base class for queries rejected by a database's limits.
+
+    :ivar status_code: The HTTP status to answer the request with.
+    """
+
+    status_code = 503
+
+
+class QueueFull(LimitExceeded):
+    """Raised when a database already has `max_queue` queries waiting."""
+
+    status_code = 429
+
+
+class QueueTimeout(LimitExceeded):
+    """Raised when a query waited `queue_timeout` seconds for a slot."""
+
+    status_code = 503
+
+
+def load_limits(database_config):
+    """
+    Read the `limits` section of a database config, filling in defaults.
+
+    :param database_config: Configuration of the database.
+    :rtype: dict
+    """
+    limits = dict(DEFAULT_LIMITS)
+    limits.update(database_config.get("limits") or {})
+    if limits["max_concurrent"] and limits["max_queue"] is None:
+        limits["max_queue"] = limits["max_concurrent"]
+    return limits
+
+
+class Bulkhead(object):
+    """
+    Bound the number of queries running against one database.
+
+    Up to `max_concurrent` callers hold a slot at once. Up to `max_queue`
+    more wait for one, each for at most `queue_timeout` seconds; anyone
+    beyond that is turned away immediately. A slow database therefore
+    only ties up a bounded number of workers, leaving the rest free to
+    serve other databases.
+
+    :param max_concurrent: Number of slots.
+    :type max_concurrent: int
+    :param max_queue: Number of callers allowed to wait for a slot.
+    :type max_queue: int
+    :param queue_timeout: Seconds to wait for a slot, or None to wait
+                          forever.
+    :type queue_timeout: float
+    """
+
+    def __init__(self, max_concurrent, max_queue=0, queue_timeout=None):
+        self.max_concurrent = int(max_concurrent)
+        self.max_queue = int(max_queue or 0)
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+        self._cond = threading.Condition(threading.Lock())
+
+    def acquire(self):
+        """
+        Take a slot, waiting in the queue if none is free.
+
+        :raises QueueFull: If the queue is already full.
+        :raises QueueTimeout: If no slot freed up within `queue_timeout`.
+        """
+        with self._cond:
+            if self.active < self.max_concurrent:
+                self.active += 1
+                return
+            if self.waiting >= self.max_queue:
+                raise QueueFull("Too many queries queued for this database.")
+            deadline = None
+            if self.queue_timeout is not None:
+                deadline = time.time() + self.queue_timeout
+            self.waiting += 1
+            try:
+                while self.active >= self.max_concurrent:
+                    remaining = None
+                    if deadline is not None:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            raise QueueTimeout(
+                                "Timed out waiting for a query slot."
+                            )
+                    self._cond.wait(remaining)
+                self.active += 1
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        """Give a slot back, waking one waiting caller."""
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+    @contextlib.contextmanager
+    def slot(self):
+        """Context manager holding a slot for the enclosed block."""
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
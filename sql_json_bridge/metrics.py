@@ -0,0 +1,337 @@
+"""Lightweight Prometheus-style metrics for SQL-HTTP-Bridge."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import bisect
+import contextlib
+import threading
+
+from timeit import default_timer
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_local = threading.local()
+
+
+def _escape(value):
+    return (str(value).replace("\\", "\\\\")
+            .replace("\n", "\\n").replace('"', '\\"'))
+
+
+def _format_labels(names, values, extra=()):
+    pairs = ['%s="%s"' % (n, _escape(v)) for n, v in zip(names, values)]
+    pairs.extend('%s="%s"' % pair for pair in extra)
+    return "{%s}" % ",".join(pairs) if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Metric(object):
+    """
+    Base class for a metric family with a fixed set of label names.
+
+    Label values are passed positionally to `inc`, `set` or `observe`,
+    in the order of `labelnames`.
+    """
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.documentation),
+                 "# TYPE %s %s" % (self.name, self.kind)]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._render(items))
+        return lines
+
+    def _render(self, items):
+        for labels, value in items:
+            yield "%s%s %s" % (self.name,
+                               _format_labels(self.labelnames, labels),
+                               _format_value(value))
+
+
+class Counter(Metric):
+    """A monotonically increasing count."""
+
+    kind = "counter"
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that can go up and down, e.g. requests in flight."""
+
+    kind = "gauge"
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+    def set(self, labels=(), value=0):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    """A distribution of observations in cumulative buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, labels, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                # Per-bucket counts, then the sum of observations.
+                state = self._values[labels] = [0] * (len(self.buckets) + 2)
+            state[i] += 1
+            state[-1] += value
+
+    def _render(self, items):
+        bounds = self.buckets + (float("inf"),)
+        for labels, state in items:
+            cumulative = 0
+            for bound, count in zip(bounds, state):
+                cumulative += count
+                yield "%s_bucket%s %d" % (
+                    self.name,
+                    _format_labels(self.labelnames, labels,
+                                   [("le", _format_value(bound))]),
+                    cumulative,
+                )
+            label_str = _format_labels(self.labelnames, labels)
+            yield "%s_sum%s %s" % (self.name, label_str,
+                                   _format_value(state[-1]))
+            yield "%s_count%s %d" % (self.name, label_str, cumulative)
+
+
+class Registry(object):
+    """A collection of metrics rendered together."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Render every metric in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "sql_json_bridge_request_seconds",
+    "Time spent handling requests.",
+    ("endpoint", "database", "driver"),
+))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "sql_json_bridge_stage_seconds",
+    "Time spent in each stage of a request.",
+    ("stage", "endpoint", "database", "driver"),
+))
+POOL_WAIT_SECONDS = REGISTRY.register(Histogram(
+    "sql_json_bridge_pool_wait_seconds",
+    "Time spent waiting to check a connection out of a pool.",
+    ("database", "driver"),
+))
+REQUESTS = REGISTRY.register(Counter(
+    "sql_json_bridge_requests_total",
+    "Requests handled, by response status.",
+    ("endpoint", "database", "status"),
+))
+ERRORS = REGISTRY.register(Counter(
+    "sql_json_bridge_errors_total",
+    "Requests answered with an error status.",
+    ("endpoint", "database", "status"),
+))
+ROWS = REGISTRY.register(Counter(
+    "sql_json_bridge_rows_total",
+    "Rows returned to clients.",
+    ("endpoint", "database", "driver"),
+))
+RESPONSE_BYTES = REGISTRY.register(Counter(
+    "sql_json_bridge_response_bytes_total",
+    "Bytes of non-streamed response bodies.",
+    ("endpoint", "database"),
+))
+IN_FLIGHT = REGISTRY.register(Gauge(
+    "sql_json_bridge_requests_in_flight",
+    "Requests currently being handled.",
+    ("endpoint",),
+))
+COALESCED = REGISTRY.register(Counter(
+    "sql_json_bridge_coalesced_queries_total",
+    "Queries answered by sharing an identical query already running.",
+    ("database",),
+))
+SCHEMA_INTROSPECTIONS = REGISTRY.register(Counter(
+    "sql_json_bridge_schema_introspections_total",
+    "Schemas read from a database rather than the schema cache.",
+    ("database",),
+))
+CHANGES_SERVED = REGISTRY.register(Counter(
+    "sql_json_bridge_change_rows_total",
+    "Rows returned to change feed subscriptions, by where they were read.",
+    ("database", "source"),
+))
+REPLICA_HEALTHY = REGISTRY.register(Gauge(
+    "sql_json_bridge_replica_healthy",
+    "Whether a read replica is in rotation (1) or ejected (0).",
+    ("database", "replica"),
+))
+REPLICA_LAG_SECONDS = REGISTRY.register(Gauge(
+    "sql_json_bridge_replica_lag_seconds",
+    "Replication lag of a read replica at its last health check.",
+    ("database", "replica"),
+))
+
+
+class RequestTimings(object):
+    """
+    Per-request metric context, bound to the handling thread.
+
+    :param endpoint: The endpoint handling the request.
+    """
+
+    __slots__ = ("endpoint", "database", "driver", "stages", "start")
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.database = ""
+        self.driver = ""
+        self.stages = []
+        self.start = default_timer()
+
+
+def begin_request(endpoint):
+    """Start collecting timings for a request on this thread."""
+    _local.timings = timings = RequestTimings(endpoint)
+    return timings
+
+
+def end_request():
+    """Stop collecting timings on this thread and return them."""
+    timings = getattr(_local, "timings", None)
+    _local.timings = None
+    return timings
+
+
+def current_request():
+    """The timings of the request being handled on this thread, if any."""
+    return getattr(_local, "timings", None)
+
+
+def label_database(database_config):
+    """
+    Label the current request with the database it resolved to.
+
+    The configured identifier pattern is used rather than the requested
+    name, to keep label cardinality bounded.
+    """
+    timings = current_request()
+    if timings is not None:
+        timings.database = database_config["identifier"].pattern
+        timings.driver = database_config["driver"]
+
+
+@contextlib.contextmanager
+def stage(name):
+    """
+    Time a stage of the current request, e.g. "route" or "execute".
+
+    The duration is recorded in the stage histogram and reported in the
+    request's Server-Timing header. Outside a request this only times.
+    """
+    start = default_timer()
+    try:
+        yield
+    finally:
+        elapsed = default_timer() - start
+        timings = current_request()
+        if timings is not None:
+            timings.stages.append((name, elapsed))
+            STAGE_SECONDS.observe(
+                (name, timings.endpoint, timings.database, timings.driver),
+                elapsed,
+            )
+
+
+def observe_pool_wait(database_config, elapsed):
+    """Record the time spent waiting on a connection pool."""
+    POOL_WAIT_SECONDS.observe(
+        (database_config["identifier"].pattern, database_config["driver"]),
+        elapsed,
+    )
+    timings = current_request()
+    if timings is not None:
+        timings.stages.append(("connect", elapsed))
+
+
+def record_rows(count):
+    """Count rows returned by the current request."""
+    timings = current_request()
+    if timings is not None:
+        ROWS.inc((timings.endpoint, timings.database, timings.driver), count)
+
+
+def counting(rows):
+    """Pass rows through, counting them once the stream ends or closes."""
+    count = 0
+    try:
+        for row in rows:
+            count += 1
+            yield row
+    finally:
+        close = getattr(rows, "close", None)
+        if close is not None:
+            close()
+        record_rows(count)
+
+
+def server_timing(timings):
+    """Format stage timings as a Server-Timing header value."""
+    return ", ".join("%s;dur=%.3f" % (name, elapsed * 1000)
+                     for name, elapsed in timings.stages)
@@ -0,0 +1,183 @@
+"""Hot-reloadable registry of database configurations."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import logging
+import os
+import threading
+
+from collections import namedtuple
+
+from sql_json_bridge.config import DbConfig
+from sql_json_bridge.router import DatabaseRouter
+
+LOG = logging.getLogger(__name__)
+
+Snapshot = namedtuple("Snapshot", ["files", "databases", "router"])
+
+
+def scan_config_files(directory):
+    """
+    Find database config files and their modification stamps.
+
+    :param directory: The directory to walk.
+    :type directory: str
+    :returns: A dict of path to (mtime, size).
+    :rtype: dict
+    """
+    stamps = {}
+    for (dirpath, dirnames, filenames) in os.walk(directory):
+        for f in filenames:
+            if f.endswith(('.yml', '.yaml')):
+                path = os.path.join(dirpath, f)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                stamps[path] = (st.st_mtime, st.st_size)
+    return stamps
+
+
+class ConfigRegistry(object):
+    """
+    In-memory registry of database configurations.
+
+    Configurations are loaded once, then reloaded incrementally: only
+    files whose mtime or size changed are re-parsed, and unchanged
+    configs keep their DbConfig, drivers and connection pools. Each
+    reload builds a new immutable snapshot of configs and router which
+    replaces the old one in a single assignment, so readers never see a
+    partially reloaded state. Callbacks added with :py:meth:`add_listener`
+    are called after each reload that changed anything.
+
+    :param directory: Directory holding database YAML files.
+    :type directory: str
+    :param router_cache_size: Size of the router's resolution cache.
+    :type router_cache_size: int
+    """
+
+    def __init__(self, directory, router_cache_size=1024):
+        self.directory = directory
+        self.router_cache_size = router_cache_size
+        self._reload_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stamps = None
+        self._listeners = []
+        self.snapshot = Snapshot({}, {}, DatabaseRouter({}))
+        self.reload()
+
+    @property
+    def databases(self):
+        """Mapping of compiled identifier to :py:class:DbConfig."""
+        return self.snapshot.databases
+
+    def resolve(self, database_name):
+        """
+        Resolve a database name against the current snapshot.
+
+        :returns: A (config, identifier groups) pair, or None.
+        """
+        return self.snapshot.router.resolve(database_name)
+
+    def reload(self):
+        """
+        Re-read changed configuration files and swap in a new snapshot.
+
+        Files that fail to parse are logged and keep their previous
+        configuration, if any.
+
+        :returns: True if anything changed.
+        :rtype: bool
+        """
+        with self._reload_lock:
+            old = self.snapshot
+            stamps = scan_config_files(self.directory)
+            if stamps == self._stamps:
+                return False
+            last_stamps, self._stamps = self._stamps or {}, stamps
+
+            files = {}
+            for path, stamp in sorted(stamps.items()):
+                previous = old.files.get(path)
+                if previous is not None and previous[0] == stamp:
+                    files[path] = previous
+                    continue
+                if previous is None and last_stamps.get(path) == stamp:
+                    # Unchanged since it last failed to load.
+                    continue
+                try:
+                    files[path] = (stamp, DbConfig(path))
+                except Exception:
+                    LOG.exception("Failed to load database config %s", path)
+                    if previous is not None:
+                        files[path] = (stamp, previous[1])
+
+            databases = {}
+            for path, (_, conf) in sorted(files.items()):
+                databases[conf['identifier']] = conf
+            self.snapshot = Snapshot(
+                files,
+                databases,
+                DatabaseRouter(databases, self.router_cache_size),
+            )
+
+        kept = set(id(conf) for _, conf in files.values())
+        for _, conf in old.files.values():
+            if id(conf) not in kept:
+                conf.close()
+        for listener in list(self._listeners):
+            try:
+                listener()
+            except Exception:
+                LOG.exception("Config reload listener failed.")
+        return True
+
+    def add_listener(self, callback):
+        """
+        Call `callback`, without arguments, after each changing reload.
+
+        :param callback: A callable, e.g. clearing a cache of results
+                         read through the old configs.
+        """
+        self._listeners.append(callback)
+
+    def _poll(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.reload()
+            except Exception:
+                LOG.exception("Failed to reload database configs.")
+
+    def start(self, interval):
+        """
+        Poll the config directory for changes every `interval` seconds.
+
+        :param interval: Polling interval in seconds.
+        :type interval: float
+        """
+        if self._thread is not None or not interval:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._poll, args=(interval,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop polling for changes."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
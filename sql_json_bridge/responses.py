@@ -0,0 +1,516 @@
+"""Response formats and streaming helpers for query results."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import itertools
+
+from collections import OrderedDict
+
+from flask import Response, current_app, json, request, stream_with_context
+from flask.json import JSONEncoder as FlaskJSONEncoder
+
+from sql_json_bridge.encoders import (Columns,
+                                      column_kinds,
+                                      default,
+                                      load_encoder,
+                                      ordered_dict)
+
+import six
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Rows are buffered into chunks of roughly this many bytes before being
+# handed to the WSGI server, rather than writing one chunk per row.
+CHUNK_SIZE = 8192
+
+JSON = "application/json"
+NDJSON = "application/x-ndjson"
+COLUMNAR = "application/vnd.sql-json-bridge.columnar+json"
+MSGPACK = "application/x-msgpack"
+EVENT_STREAM = "text/event-stream"
+
+# Response headers carrying result metadata, for formats without a footer
+# to put it in.
+META_HEADERS = OrderedDict([
+    ("rows_matched", "X-Bridge-Rows-Matched"),
+    ("truncated", "X-Bridge-Truncated"),
+    ("next", "X-Bridge-Next"),
+    ("next_offset", "X-Bridge-Next-Offset"),
+])
+
+# Short names accepted by the `format` request parameter.
+FORMAT_ALIASES = {
+    "json": JSON,
+    "ndjson": NDJSON,
+    "columnar": COLUMNAR,
+    "msgpack": MSGPACK,
+}
+
+
+def _dumps(obj):
+    return ResultFormat.encoder.dumps(obj)
+
+
+def _members(meta):
+    return b"".join(b"," + _dumps(key) + b":" + _dumps(value)
+                    for key, value in (meta or {}).items())
+
+
+class ResultFormat(object):
+    """
+    Serializer for a result set.
+
+    A format is written as `header`, one `row` per result row and a
+    `footer`, which may include result metadata such as `rows_matched`.
+    If reading rows fails part way through a streamed response, `error`
+    is written in place of the footer.
+
+    Rows are passed through `converter` before being written, so formats
+    can convert values per column, see :py:mod:`encoders`.
+    """
+
+    mimetype = None
+    # The JSON encoder used by every format, see `use_encoder`.
+    encoder = load_encoder()
+
+    def converter(self, columns):
+        """
+        Build a function converting each row before it is written.
+
+        :param columns: Column names, possibly a :py:class:`Columns`
+                        carrying the kind of each column.
+        :returns: A function of one row, or None to write rows as is.
+        """
+        return self.encoder.row_converter(column_kinds(columns))
+
+    def header(self, columns):
+        return ""
+
+    def row(self, columns, row, first):
+        raise NotImplementedError
+
+    def footer(self, meta=None):
+        return b""
+
+    def error(self, message):
+        raise NotImplementedError
+
+
+class JSONFormat(ResultFormat):
+    """`{"result": [{column: value, ...}, ...]}`, written compactly."""
+
+    mimetype = JSON
+
+    def header(self, columns):
+        return b'{"result":['
+
+    def row(self, columns, row, first):
+        obj = _dumps(ordered_dict(zip(columns, row)))
+        return obj if first else b"," + obj
+
+    def footer(self, meta=None):
+        return b"]" + _members(meta) + b"}"
+
+    def error(self, message):
+        return b'],"ERROR":' + _dumps(message) + b"}"
+
+
+class NDJSONFormat(ResultFormat):
+    """One JSON object per row, newline delimited."""
+
+    mimetype = NDJSON
+
+    def row(self, columns, row, first):
+        return _dumps(ordered_dict(zip(columns, row))) + b"\n"
+
+    def error(self, message):
+        return _dumps({"ERROR": message}) + b"\n"
+
+
+class ColumnarFormat(ResultFormat):
+    """`{"columns": [...], "data": [[...], ...]}`, names sent once."""
+
+    mimetype = COLUMNAR
+
+    def header(self, columns):
+        return b'{"columns":' + _dumps(list(columns)) + b',"data":['
+
+    def row(self, columns, row, first):
+        obj = _dumps(row if isinstance(row, list) else list(row))
+        return obj if first else b"," + obj
+
+    def footer(self, meta=None):
+        return b"]" + _members(meta) + b"}"
+
+    def error(self, message):
+        return b'],"ERROR":' + _dumps(message) + b"}"
+
+
+def _pack_default(value):
+    try:
+        return default(value)
+    except TypeError:
+        return str(value)
+
+
+class MsgPackFormat(ResultFormat):
+    """
+    A stream of MessagePack objects.
+
+    The first object is the array of column names, followed by one array
+    per row. A map with an "ERROR" key ends a stream that failed.
+    """
+
+    mimetype = MSGPACK
+
+    def converter(self, columns):
+        # MessagePack has a binary type, and other values go through
+        # `default` as they are met.
+        return None
+
+    def header(self, columns):
+        return msgpack.packb(list(columns), use_bin_type=True)
+
+    def row(self, columns, row, first):
+        return msgpack.packb(list(row), use_bin_type=True,
+                             default=_pack_default)
+
+    def error(self, message):
+        return msgpack.packb({"ERROR": message}, use_bin_type=True)
+
+
+FORMATS = OrderedDict(
+    (fmt.mimetype, fmt) for fmt in (JSONFormat(),
+                                    NDJSONFormat(),
+                                    ColumnarFormat())
+)
+if msgpack is not None:
+    FORMATS[MSGPACK] = MsgPackFormat()
+
+
+def use_encoder(encoder):
+    """
+    Serialize the JSON result formats with `encoder`.
+
+    :param encoder: An encoder, e.g. from :py:func:`encoders.load_encoder`.
+    :type encoder: :py:class:`encoders.JSONEncoder`
+    """
+    ResultFormat.encoder = encoder
+
+
+class BridgeJSONEncoder(FlaskJSONEncoder):
+    """
+    Flask's JSON encoder, also handling the values drivers return.
+
+    Used for `jsonify` responses, e.g. from the batch endpoint. Dates and
+    times are written in ISO 8601, like the result formats.
+    """
+
+    def default(self, o):
+        try:
+            return default(o)
+        except TypeError:
+            return super(BridgeJSONEncoder, self).default(o)
+
+
+def negotiate_format():
+    """
+    Pick a result format for the current request.
+
+    An explicit `format` request parameter wins over the Accept header.
+    JSON is used when the client expresses no preference.
+
+    :returns: The chosen format, or None if nothing acceptable is offered.
+    :rtype: :py:class:ResultFormat
+    """
+    name = request.values.get("format")
+    if name:
+        return FORMATS.get(FORMAT_ALIASES.get(name, name))
+    if not request.accept_mimetypes:
+        return FORMATS[JSON]
+    mimetype = request.accept_mimetypes.best_match(list(FORMATS))
+    return FORMATS.get(mimetype)
+
+
+def _encode(piece):
+    if isinstance(piece, six.text_type):
+        return piece.encode("utf-8")
+    return piece
+
+
+def _close(iterable):
+    close = getattr(iterable, "close", None)
+    if close is not None:
+        close()
+
+
+def _chunked(pieces, chunk_size=CHUNK_SIZE):
+    buf = []
+    size = 0
+    try:
+        for piece in pieces:
+            piece = _encode(piece)
+            buf.append(piece)
+            size += len(piece)
+            if size >= chunk_size:
+                yield b"".join(buf)
+                buf = []
+                size = 0
+    finally:
+        # Closed early when the client disconnects; pass that on so the
+        # driver can cancel the query.
+        _close(pieces)
+    if buf:
+        yield b"".join(buf)
+
+
+def _write(fmt, columns, rows, meta=None):
+    try:
+        yield fmt.header(columns)
+        convert = fmt.converter(columns)
+        first = True
+        try:
+            for row in rows:
+                if convert is not None:
+                    row = convert(row)
+                yield fmt.row(columns, row, first)
+                first = False
+        except Exception as e:
+            current_app.logger.exception("Streaming query failed.")
+            yield fmt.error(": ".join(str(i) for i in e.args))
+            return
+        yield fmt.footer(meta)
+    finally:
+        _close(rows)
+
+
+def _error_message(e):
+    return ": ".join(str(i) for i in e.args)
+
+
+def _fanout_lines(events, ndatabases):
+    fmt = FORMATS[NDJSON]
+    columns = {}
+    converters = {}
+    summary = OrderedDict([("databases", ndatabases), ("succeeded", 0),
+                           ("failed", 0), ("timed_out", 0)])
+    try:
+        for kind, name, value in events:
+            if kind == "columns":
+                columns[name] = value
+                converters[name] = fmt.converter(value)
+            elif kind == "rows":
+                names = columns[name]
+                convert = converters[name]
+                tag = b'{"database":' + _dumps(name) + b',"row":'
+                for row in value:
+                    if convert is not None:
+                        row = convert(row)
+                    yield tag + _dumps(ordered_dict(zip(names, row))) + b"}\n"
+            elif kind == "done":
+                summary["succeeded"] += 1
+                yield _dumps(ordered_dict([("database", name),
+                                           ("rows_matched", value[0]),
+                                           ("truncated", value[1])]))
+                yield b"\n"
+            elif kind == "error":
+                summary["failed"] += 1
+                yield _dumps(ordered_dict([("database", name),
+                                           ("ERROR", _error_message(value))]))
+                yield b"\n"
+            elif kind == "timeout":
+                summary["timed_out"] = len(name)
+                for timed_out in name:
+                    yield _dumps(ordered_dict([
+                        ("database", timed_out),
+                        ("ERROR", "Deadline exceeded."),
+                    ])) + b"\n"
+    finally:
+        # Stops the workers if the client went away.
+        _close(events)
+    yield _dumps({"summary": summary}) + b"\n"
+
+
+def fanout_response(events, ndatabases):
+    """
+    Stream the merged results of a fan-out query as NDJSON.
+
+    Lines come in the order results arrive, each tagged with its source
+    database:
+
+    - `{"database": name, "row": {column: value, ...}}` per row,
+    - `{"database": name, "rows_matched": n, "truncated": bool}` once a
+      database finishes,
+    - `{"database": name, "ERROR": message}` if it fails or misses the
+      deadline,
+
+    and finally a `{"summary": {...}}` line counting databases that
+    succeeded, failed and timed out.
+
+    :param events: Events from :py:meth:`fanout.FanOut.events`.
+    :param ndatabases: Number of databases queried.
+    :returns: A flask response object.
+    """
+    body = stream_with_context(_chunked(_fanout_lines(events, ndatabases)))
+    return Response(body, mimetype=NDJSON)
+
+
+def _proc_body(items, first=None):
+    fmt = FORMATS[JSON]
+    columns = None
+    convert = None
+    count = 0
+    output = {}
+    yield b'{"results":['
+    try:
+        for item in itertools.chain([first], items):
+            if item is None:
+                continue
+            if isinstance(item, Columns):
+                if columns is not None:
+                    yield fmt.footer({"rows_matched": count}) + b","
+                columns = item
+                convert = fmt.converter(columns)
+                count = 0
+                yield fmt.header(columns)
+            elif isinstance(item, dict):
+                output = item
+            else:
+                if convert is not None:
+                    item = convert(item)
+                yield fmt.row(columns, item, count == 0)
+                count += 1
+    except Exception as e:
+        current_app.logger.exception("Stored procedure failed.")
+        if columns is not None:
+            yield fmt.footer({"rows_matched": count})
+        yield b'],"ERROR":' + _dumps(_error_message(e)) + b"}"
+        return
+    finally:
+        _close(items)
+    if columns is not None:
+        yield fmt.footer({"rows_matched": count})
+    yield b'],"output":' + _dumps(output) + b"}"
+
+
+def proc_response(items, first=None):
+    """
+    Stream the result sets of a stored procedure call as JSON.
+
+    The body is `{"results": [ResultSet, ...], "output": {...}}`, the
+    result sets in the order the procedure returned them and `output`
+    holding the values of output parameters. Each result set is written
+    as it is read, so the first can reach the client while the procedure
+    still runs. An error part way through ends the `results` and is
+    reported in an `ERROR` member instead of `output`.
+
+    :param items: Columns, rows and output values, as yielded by
+                  :py:meth:`DatabaseDriver.run_stored_proc`.
+    :param first: The first item, if already read from `items`.
+    :returns: A flask response object.
+    """
+    body = stream_with_context(_chunked(_proc_body(items, first)))
+    return Response(body, mimetype=JSON)
+
+
+def _events(deltas):
+    fmt = FORMATS[JSON]
+    try:
+        for delta in deltas:
+            if delta is None:
+                yield b": keepalive\n\n"
+                continue
+            convert = fmt.converter(delta.columns)
+            pieces = [fmt.header(delta.columns)]
+            for index, row in enumerate(delta.rows):
+                if convert is not None:
+                    row = convert(row)
+                pieces.append(fmt.row(delta.columns, row, index == 0))
+            pieces.append(fmt.footer(OrderedDict([
+                ("rows_matched", len(delta.rows)),
+                ("truncated", delta.more),
+                ("watermark", delta.watermark),
+            ])))
+            yield (b"id: " + _dumps(delta.watermark) +
+                   b"\nevent: changes\ndata: " + b"".join(pieces) +
+                   b"\n\n")
+    except Exception as e:
+        current_app.logger.exception("Change stream failed.")
+        yield (b"event: error\ndata: " +
+               _dumps({"ERROR": _error_message(e)}) + b"\n\n")
+    finally:
+        _close(deltas)
+
+
+def event_response(deltas):
+    """
+    Stream change feed deltas as server-sent events.
+
+    Each delta is a `changes` event whose data is a JSON result set, as
+    returned by the /changes endpoint, and whose id is the watermark
+    after it, in JSON, so a reconnecting client resumes with
+    `Last-Event-ID`. Comments keep idle connections open. An error ends
+    the stream with an `error` event.
+
+    :param deltas: Deltas, or None for a keepalive, as yielded by
+                   :py:meth:`ChangeFeeds.events`.
+    :returns: A flask response object.
+    """
+    response = Response(stream_with_context(_events(deltas)),
+                        mimetype=EVENT_STREAM)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def result_response(fmt, columns, rows, stream=False, meta=None):
+    """
+    Serialize a result set into a response using `fmt`.
+
+    When streaming, rows are serialized and written incrementally as the
+    generator produces them, so memory use stays constant in the row
+    count; an error mid-stream is reported in-band by the format.
+    Otherwise the body is built up front.
+
+    :param fmt: The result format, see :py:func:`negotiate_format`.
+    :param columns: Column names of the result set.
+    :param rows: An iterable of tuple rows, e.g. from
+                 :py:meth:`DatabaseDriver.stream_rows`.
+    :param stream: Whether to write the response incrementally.
+    :param meta: Result metadata for the footer, e.g. `rows_matched`.
+                 When streaming, it is read once the rows are exhausted,
+                 so it can be filled in as they are produced. Otherwise it
+                 is also sent in `META_HEADERS`.
+    :type meta: dict
+    :returns: A flask response object.
+    """
+    if stream:
+        body = stream_with_context(_chunked(_write(fmt, columns, rows, meta)))
+        return Response(body, mimetype=fmt.mimetype)
+    body = b"".join(_encode(piece)
+                    for piece in _write(fmt, columns, rows, meta))
+    return meta_headers(Response(body, mimetype=fmt.mimetype), meta)
+
+
+def meta_headers(response, meta):
+    """Send the result metadata in `meta` in `META_HEADERS` as well."""
+    for key, value in (meta or {}).items():
+        if key in META_HEADERS:
+            response.headers[META_HEADERS[key]] = (
+                json.dumps(value) if isinstance(value, bool) else str(value)
+            )
+    return response
@@ -0,0 +1,153 @@
+"""Database name routing for SQL-HTTP-Bridge."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import re
+import threading
+
+from collections import OrderedDict
+
+# Python 2's re module allows at most 100 groups per pattern, so
+# identifiers are combined into alternations of bounded size.
+MAX_GROUPS_PER_PATTERN = 90
+
+# Patterns using backreferences or inline flags can't be safely
+# renumbered into a combined alternation.
+_UNCOMBINABLE = re.compile(r"\\[1-9]|\(\?P=|\(\?[aiLmsux]")
+_METACHARACTERS = re.compile(r"[.^$*+?{}\[\]\\|()]")
+
+
+class _Alternation(object):
+    """
+    Several identifier patterns compiled into one alternation.
+
+    Each pattern is wrapped in a named group, `_r<n>`; the name of the
+    last closed group tells which alternative matched, and its own groups
+    follow it in the combined match.
+    """
+
+    def __init__(self, entries):
+        self.entries = {}
+        parts = []
+        offset = 1
+        for n, (pattern, config) in enumerate(entries):
+            name = "_r%d" % n
+            parts.append("(?P<%s>%s)" % (name, pattern.pattern))
+            self.entries[name] = (config, offset, pattern.groups)
+            offset += pattern.groups + 1
+        self.regex = re.compile("|".join(parts))
+
+    def match(self, database_name):
+        m = self.regex.match(database_name)
+        if m is None:
+            return None
+        config, offset, ngroups = self.entries[m.lastgroup]
+        groups = m.groups()[offset:offset + ngroups]
+        return config, groups
+
+
+class _Single(object):
+    """A lone identifier pattern that could not be combined."""
+
+    def __init__(self, pattern, config):
+        self.pattern = pattern
+        self.config = config
+
+    def match(self, database_name):
+        m = self.pattern.match(database_name)
+        if m is None:
+            return None
+        return self.config, m.groups()
+
+
+class DatabaseRouter(object):
+    """
+    Resolve database names to their configuration.
+
+    Built once from the loaded configurations. Identifiers without regex
+    metacharacters are looked up in a dict; the rest are matched through
+    a few combined alternations, in configuration order. Resolutions,
+    including misses, are memoized in a bounded LRU.
+
+    :param databases: Mapping of compiled identifier to :py:class:DbConfig.
+    :type databases: dict
+    :param cache_size: Number of resolutions to memoize.
+    :type cache_size: int
+    """
+
+    def __init__(self, databases, cache_size=1024):
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.literals = {}
+        self.matchers = []
+
+        pending = []
+        ngroups = 0
+        for pattern, config in databases.items():
+            if not _METACHARACTERS.search(pattern.pattern):
+                self.literals.setdefault(pattern.pattern, config)
+            if _UNCOMBINABLE.search(pattern.pattern):
+                self._flush(pending)
+                pending, ngroups = [], 0
+                self.matchers.append(_Single(pattern, config))
+                continue
+            if ngroups + pattern.groups + 1 > MAX_GROUPS_PER_PATTERN:
+                self._flush(pending)
+                pending, ngroups = [], 0
+            pending.append((pattern, config))
+            ngroups += pattern.groups + 1
+        self._flush(pending)
+
+    def _flush(self, entries):
+        if not entries:
+            return
+        try:
+            self.matchers.append(_Alternation(entries))
+        except (re.error, AssertionError, OverflowError):
+            # e.g. clashing named groups; fall back to one matcher each.
+            self.matchers.extend(_Single(p, c) for p, c in entries)
+
+    def _resolve(self, database_name):
+        config = self.literals.get(database_name)
+        if config is not None:
+            return config, ()
+        for matcher in self.matchers:
+            resolved = matcher.match(database_name)
+            if resolved is not None:
+                return resolved
+        return None
+
+    def resolve(self, database_name):
+        """
+        Find the configuration serving `database_name`.
+
+        :param database_name: The requested database name.
+        :type database_name: str
+        :returns: A (config, groups) pair, where groups are the identifier's
+                  regex groups for template substitution, or None.
+        :rtype: tuple(:py:class:DbConfig, tuple)
+        """
+        with self._lock:
+            if database_name in self._cache:
+                resolved = self._cache.pop(database_name)
+                self._cache[database_name] = resolved
+                return resolved
+        resolved = self._resolve(database_name)
+        with self._lock:
+            self._cache[database_name] = resolved
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return resolved
@@ -0,0 +1,126 @@
+"""Shared fixtures: a bridge serving SQLite databases in a temp dir."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import asyncio
+import os
+import sqlite3
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+DATABASE_TEMPLATE = """\
+identifier: "shard_(\\\\d+)"
+driver: "sqlite"
+connection:
+    database: "{directory}/shard_{{{{0}}}}.db"
+"""
+
+# API keys configured by the `auth_config` fixture.
+ADMIN_KEY = "admin-key"
+SHARD_2_KEY = "shard-2-key"
+
+
+@pytest.fixture
+def shards(tmp_path):
+    """Create shard_1 and shard_2, each holding an `items` table."""
+    for n in (1, 2):
+        connection = sqlite3.connect(str(tmp_path / ("shard_%d.db" % n)))
+        connection.executescript(
+            "CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT);"
+            "INSERT INTO items (name) VALUES ('a'), ('b'), ('c');"
+        )
+        connection.commit()
+        connection.close()
+    return tmp_path
+
+
+@pytest.fixture
+def configure(shards, monkeypatch):
+    """
+    Write a bridge config serving the shards, and point the app at it.
+
+    Returns a function taking app settings as keyword arguments, and
+    `database`, YAML added to the shards' database config.
+    """
+    databases = shards / "databases"
+    databases.mkdir()
+
+    def write(database="", **settings):
+        (databases / "shards.yml").write_text(
+            DATABASE_TEMPLATE.format(directory=str(shards)) + database
+        )
+        settings.setdefault("LEGACY_SUPPORT", True)
+        settings.setdefault("DATABASE_CONFIG_DIRECTORY", str(databases))
+        settings.setdefault("DATABASE_CONFIG_POLL_INTERVAL", 0)
+        settings.setdefault("LOG_FILE", str(shards / "bridge.log"))
+        path = shards / "config.py"
+        path.write_text("".join("%s = %r\n" % item
+                                for item in sorted(settings.items())))
+        monkeypatch.setenv("SQL_JSON_BRIDGE_CONFIG", str(path))
+    write()
+    return write
+
+
+@pytest.fixture
+def auth_config(configure):
+    """Require one of two API keys; the second may only use shard_2."""
+    configure(AUTH_BACKEND="api_key", AUTH_OPTIONS={"keys": {
+        ADMIN_KEY: {"name": "admin"},
+        SHARD_2_KEY: {"name": "reports", "databases": ["shard_2"]},
+    }})
+
+
+@pytest.fixture
+def client(configure):
+    from sql_json_bridge.app import create_app
+    return create_app().test_client()
+
+
+def asgi_request(app, method, path, query=b"", body=b"", headers=()):
+    """
+    Send one request through an ASGI app.
+
+    :returns: The status, a dict of response headers and the body.
+    """
+    sent = []
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        # The client stays connected until the response is sent.
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": method, "path": path,
+             "query_string": query, "headers": list(headers)}
+    asyncio.run(app(scope, receive, send))
+    return (sent[0]["status"], dict(sent[0]["headers"]),
+            b"".join(message.get("body", b"") for message in sent[1:]))
+
+
+@pytest.fixture
+def asgi_app(configure):
+    from sql_json_bridge.aio.app import create_asgi_app
+    app = create_asgi_app()
+    yield app
+    asyncio.run(app.close())
@@ -0,0 +1,56 @@
+"""Tests for the ASGI app."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import json
+import sqlite3
+
+from tests.conftest import asgi_request
+
+
+def query(app, path, sql):
+    status, headers, body = asgi_request(
+        app, "POST", path,
+        body=json.dumps({"sql": sql}).encode("utf-8"),
+        headers=[(b"content-type", b"application/json")],
+    )
+    return status, headers, json.loads(body.decode("utf-8"))
+
+
+def test_update_is_committed(asgi_app, shards):
+    status, headers, body = query(
+        asgi_app, "/update/shard_1",
+        "UPDATE items SET name = 'z' WHERE id > 1",
+    )
+    assert status == 200
+    assert body["rows_matched"] == 2
+    assert headers[b"x-bridge-rows-matched"] == b"2"
+    # Read on a separate connection, so only committed changes show.
+    connection = sqlite3.connect(str(shards / "shard_1.db"))
+    names = [row[0] for row in connection.execute(
+        "SELECT name FROM items ORDER BY id")]
+    assert names == ["a", "z", "z"]
+
+
+def test_unknown_database(asgi_app):
+    status, _, _ = query(asgi_app, "/query/nope", "SELECT 1")
+    assert status == 404
+
+
+def test_list_databases(asgi_app):
+    status, _, body = asgi_request(asgi_app, "GET", "/list")
+    assert status == 200
+    assert json.loads(body.decode("utf-8")) == {
+        "databases": ["shard_(\\d+)"]}
@@ -0,0 +1,111 @@
+"""Tests for authentication of the flask and ASGI apps."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import json
+
+import pytest
+
+from tests.conftest import ADMIN_KEY, SHARD_2_KEY, asgi_request
+
+
+@pytest.fixture
+def auth_client(auth_config):
+    from sql_json_bridge.app import create_app
+    return create_app().test_client()
+
+
+def test_missing_credentials(auth_client):
+    response = auth_client.get("/query/shard_1?sql=SELECT+1")
+    assert response.status_code == 401
+    assert response.headers["WWW-Authenticate"] == "Bearer"
+
+
+def test_invalid_key(auth_client):
+    response = auth_client.get("/query/shard_1?sql=SELECT+1",
+                               headers={"X-API-Key": "wrong"})
+    assert response.status_code == 401
+
+
+def test_bearer_key(auth_client):
+    response = auth_client.get(
+        "/query/shard_1?sql=SELECT+1",
+        headers={"Authorization": "Bearer %s" % ADMIN_KEY},
+    )
+    assert response.status_code == 200
+
+
+def test_forbidden_database(auth_client):
+    response = auth_client.get("/query/shard_1?sql=SELECT+1",
+                               headers={"X-API-Key": SHARD_2_KEY})
+    assert response.status_code == 403
+    response = auth_client.get("/query/shard_2?sql=SELECT+1",
+                               headers={"X-API-Key": SHARD_2_KEY})
+    assert response.status_code == 200
+
+
+def test_fanout_forbidden_database(auth_client):
+    response = auth_client.post(
+        "/fanout", headers={"X-API-Key": SHARD_2_KEY},
+        json={"sql": "SELECT 1", "databases": ["shard_1", "shard_2"]},
+    )
+    assert response.status_code == 403
+
+
+def test_listing_hides_forbidden_databases(auth_client):
+    headers = {"X-API-Key": SHARD_2_KEY}
+    assert auth_client.get("/list", headers=headers).get_json() == {
+        "databases": [],
+    }
+    assert auth_client.open("/query", method="OPTIONS",
+                            headers=headers).get_json() == []
+    headers = {"X-API-Key": ADMIN_KEY}
+    assert auth_client.get("/list", headers=headers).get_json() == {
+        "databases": ["shard_(\\d+)"],
+    }
+
+
+def test_metrics_require_credentials(auth_client):
+    assert auth_client.get("/metrics").status_code == 401
+    response = auth_client.get("/metrics", headers={"X-API-Key": ADMIN_KEY})
+    assert response.status_code == 200
+
+
+def test_public_metrics(configure):
+    configure(AUTH_BACKEND="api_key", METRICS_PUBLIC=True,
+              AUTH_OPTIONS={"keys": {ADMIN_KEY: {}}})
+    from sql_json_bridge.app import create_app
+    assert create_app().test_client().get("/metrics").status_code == 200
+
+
+def test_asgi_missing_credentials(auth_config, asgi_app):
+    status, headers, _ = asgi_request(asgi_app, "GET", "/query/shard_1",
+                                      query=b"sql=SELECT+1")
+    assert status == 401
+    assert headers[b"www-authenticate"] == b"Bearer"
+
+
+def test_asgi_forbidden_database(auth_config, asgi_app):
+    key = [(b"x-api-key", SHARD_2_KEY.encode("ascii"))]
+    status, _, _ = asgi_request(asgi_app, "GET", "/update/shard_1",
+                                query=b"sql=DELETE+FROM+items",
+                                headers=key)
+    assert status == 403
+    status, _, body = asgi_request(asgi_app, "GET", "/list", headers=key)
+    assert status == 200
+    assert json.loads(body.decode("utf-8")) == {"databases": []}
+    status, _, _ = asgi_request(asgi_app, "GET", "/query/shard_2",
+                                query=b"sql=SELECT+1", headers=key)
+    assert status == 200
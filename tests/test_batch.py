@@ -0,0 +1,93 @@
+"""Tests for the batch endpoint."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+import sqlite3
+
+
+def names(shards, n=1):
+    connection = sqlite3.connect(str(shards / ("shard_%d.db" % n)))
+    try:
+        return [row[0] for row in connection.execute(
+            "SELECT name FROM items ORDER BY id")]
+    finally:
+        connection.close()
+
+
+def test_batch(client, shards):
+    response = client.post("/batch/shard_1", json={"statements": [
+        "UPDATE items SET name = 'x' WHERE id = 1",
+        {"sql": "SELECT name FROM items WHERE id = ?", "params": [1]},
+    ]})
+    assert response.status_code == 200
+    results = response.get_json()["results"]
+    assert results[0]["rows_matched"] == 1
+    assert results[1]["result"] == [{"name": "x"}]
+    assert names(shards) == ["x", "b", "c"]
+
+
+def test_failure_only_affects_its_statement(client, shards):
+    response = client.post("/batch/shard_1", json={"statements": [
+        "SELECT * FROM missing",
+        "UPDATE items SET name = 'y' WHERE id = 2",
+    ]})
+    results = response.get_json()["results"]
+    assert "missing" in results[0]["ERROR"]
+    assert results[1]["rows_matched"] == 1
+    assert names(shards) == ["a", "y", "c"]
+
+
+def test_transaction_rolls_back(client, shards):
+    response = client.post("/batch/shard_1", json={
+        "transaction": True,
+        "statements": [
+            "UPDATE items SET name = 'y' WHERE id = 2",
+            "SELECT * FROM missing",
+            "UPDATE items SET name = 'z' WHERE id = 3",
+        ],
+    })
+    assert response.status_code == 200
+    results = response.get_json()["results"]
+    assert results[0]["rows_matched"] == 1
+    assert "missing" in results[1]["ERROR"]
+    assert "Skipped" in results[2]["ERROR"]
+    assert names(shards) == ["a", "b", "c"]
+
+
+def test_concurrent_reads(client):
+    response = client.post("/batch/shard_1", json={
+        "concurrent": True,
+        "statements": ["SELECT %d AS n" % n for n in range(5)],
+    })
+    results = response.get_json()["results"]
+    assert [result["result"] for result in results] == [
+        [{"n": n}] for n in range(5)]
+
+
+def test_too_many_statements(configure, shards):
+    configure(BATCH_MAX_STATEMENTS=2)
+    from sql_json_bridge.app import create_app
+    client = create_app().test_client()
+    response = client.post("/batch/shard_1",
+                           json={"statements": ["SELECT 1"] * 3})
+    assert response.status_code == 400
+
+
+def test_invalid_batches(client):
+    assert client.post("/batch/shard_1", json={}).status_code == 400
+    response = client.post("/batch/shard_1",
+                           json={"statements": [{"params": []}]})
+    assert response.status_code == 400
+    response = client.post("/batch/nope", json={"statements": ["SELECT 1"]})
+    assert response.status_code == 404
@@ -0,0 +1,144 @@
+"""Tests for result caching."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import sqlite3
+
+import pytest
+
+from sql_json_bridge.extensions.cache import (LocalCacheBackend,
+                                              cache_key,
+                                              is_read_query)
+
+CACHED = """\
+cache:
+    enabled: true
+    ttl: 60
+"""
+
+SQL = "SELECT id, name FROM items ORDER BY id"
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM items",
+    "  select id from items where name = 'a';",
+    "WITH t AS (SELECT 1 AS a) SELECT a FROM t",
+    "SELECT 'INSERT INTO x' AS text",
+    "SELECT 1 -- DELETE FROM items",
+    "SELECT updated_at, into_count FROM items",
+])
+def test_reads(sql):
+    assert is_read_query(sql)
+
+
+@pytest.mark.parametrize("sql", [
+    "INSERT INTO items VALUES (1)",
+    "UPDATE items SET name = 'x'",
+    "SELECT * INTO copy FROM items",
+    "SELECT * FROM items FOR UPDATE",
+    "SELECT * FROM items FOR SHARE",
+    "SELECT * FROM items LOCK IN SHARE MODE",
+    "SELECT * FROM items WITH (UPDLOCK)",
+    "WITH t AS (DELETE FROM items RETURNING *) SELECT * FROM t",
+    "SELECT 1; DELETE FROM items",
+    "CALL refresh()",
+    "EXPLAIN ANALYZE DELETE FROM items",
+    "",
+])
+def test_not_reads(sql):
+    assert not is_read_query(sql)
+
+
+def test_cache_key_normalizes_whitespace():
+    assert (cache_key("db", "SELECT  1\n FROM t") ==
+            cache_key("db", "SELECT 1 FROM t"))
+    assert cache_key("db", "SELECT 1") != cache_key("other", "SELECT 1")
+    assert (cache_key("db", "SELECT 1", mimetype="application/json") !=
+            cache_key("db", "SELECT 1", mimetype="application/x-ndjson"))
+
+
+def test_local_backend_evicts_least_recently_used():
+    backend = LocalCacheBackend(max_bytes=10)
+    backend.set("a", b"12345", 60)
+    backend.set("b", b"12345", 60)
+    backend.get("a")
+    backend.set("c", b"12345", 60)
+    assert backend.get("a") == b"12345"
+    assert backend.get("b") is None
+    assert backend.size == 10
+
+
+def test_local_backend_expires():
+    backend = LocalCacheBackend()
+    backend.set("a", b"1", 0)
+    assert backend.get("a") is None
+
+
+@pytest.fixture
+def cached_client(configure):
+    configure(database=CACHED)
+    from sql_json_bridge.app import create_app
+    return create_app().test_client()
+
+
+def rename_all(shards):
+    connection = sqlite3.connect(str(shards / "shard_1.db"))
+    connection.execute("UPDATE items SET name = 'changed'")
+    connection.commit()
+    connection.close()
+
+
+def test_hit_after_miss(cached_client, shards):
+    first = cached_client.post("/query/shard_1", json={"sql": SQL})
+    assert first.headers["X-Bridge-Cache"] == "miss"
+    rename_all(shards)
+    second = cached_client.post("/query/shard_1", json={"sql": SQL})
+    assert second.headers["X-Bridge-Cache"] == "hit"
+    assert second.get_data() == first.get_data()
+    assert second.headers["X-Bridge-Rows-Matched"] == "3"
+
+
+def test_refresh_and_bypass(cached_client, shards):
+    cached_client.post("/query/shard_1", json={"sql": SQL})
+    rename_all(shards)
+    bypassed = cached_client.post("/query/shard_1", json={"sql": SQL},
+                                  headers={"X-Bridge-Cache": "bypass"})
+    assert "X-Bridge-Cache" not in bypassed.headers
+    assert bypassed.get_json()["result"][0]["name"] == "changed"
+    refreshed = cached_client.post("/query/shard_1", json={"sql": SQL},
+                                   headers={"X-Bridge-Cache": "refresh"})
+    assert refreshed.headers["X-Bridge-Cache"] == "miss"
+    hit = cached_client.post("/query/shard_1", json={"sql": SQL})
+    assert hit.get_json()["result"][0]["name"] == "changed"
+
+
+def test_formats_cached_separately(cached_client):
+    cached_client.post("/query/shard_1", json={"sql": SQL})
+    response = cached_client.post("/query/shard_1?format=ndjson",
+                                  json={"sql": SQL})
+    assert response.headers["X-Bridge-Cache"] == "miss"
+    assert response.mimetype == "application/x-ndjson"
+
+
+def test_reload_clears_cache(configure, cached_client, shards):
+    from flask import current_app
+    cached_client.post("/query/shard_1", json={"sql": SQL})
+    rename_all(shards)
+    configure(database=CACHED + "# reloaded\n")
+    with cached_client.application.app_context():
+        assert current_app.config["DATABASE_REGISTRY"].reload()
+    response = cached_client.post("/query/shard_1", json={"sql": SQL})
+    assert response.headers["X-Bridge-Cache"] == "miss"
+    assert response.get_json()["result"][0]["name"] == "changed"
@@ -0,0 +1,133 @@
+"""Tests for change feed subscriptions."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+import json
+import re
+import sqlite3
+import threading
+
+import pytest
+
+from sql_json_bridge.db_drivers.sqlite import SQLiteDriver
+from sql_json_bridge.extensions.changes import Feed
+
+SUBSCRIPTION = {"sql": "SELECT id, name FROM items", "watermark": "id"}
+
+
+@pytest.fixture
+def changes_client(configure):
+    configure(CHANGES_POLL_INTERVAL=0.05)
+    from sql_json_bridge.app import create_app
+    return create_app().test_client()
+
+
+def insert(shards, name):
+    connection = sqlite3.connect(str(shards / "shard_1.db"))
+    connection.execute("INSERT INTO items (name) VALUES (?)", (name,))
+    connection.commit()
+    connection.close()
+
+
+def subscribe(client, **options):
+    response = client.post("/changes/shard_1",
+                           json=dict(SUBSCRIPTION, **options))
+    assert response.status_code == 201
+    return response.headers["Location"]
+
+
+def poll(client, location, query=""):
+    response = client.get(location + query)
+    assert response.status_code == 200
+    return json.loads(response.get_data(as_text=True))
+
+
+def names(body):
+    return [row["name"] for row in body["result"]]
+
+
+def test_statement():
+    feed = Feed("db", None, (), "SELECT id FROM t WHERE a = %s", ["x"],
+                "id")
+    driver = SQLiteDriver({"identifier": re.compile("db"),
+                           "driver": "sqlite", "connection": {}})
+    assert feed.statement(driver, 5) == (
+        'SELECT * FROM (SELECT id FROM t WHERE a = %s) bridge_changes '
+        'WHERE "id" > %s ORDER BY "id"', ["x", 5])
+    feed.params = {"a": "x"}
+    statement, params = feed.statement(driver, 5)
+    assert statement.endswith('WHERE "id" > %(bridge_watermark)s '
+                              'ORDER BY "id"')
+    assert params == {"a": "x", "bridge_watermark": 5}
+    assert feed.statement(driver, None, aggregate=True)[0] == (
+        'SELECT MAX("id") FROM (SELECT id FROM t WHERE a = %s) '
+        'bridge_changes')
+
+
+def test_polls_return_new_rows(changes_client, shards):
+    location = subscribe(changes_client)
+    body = poll(changes_client, location)
+    assert names(body) == ["a", "b", "c"]
+    assert body["watermark"] == 3
+    assert names(poll(changes_client, location)) == []
+    insert(shards, "d")
+    body = poll(changes_client, location, "?wait=5")
+    assert names(body) == ["d"]
+    assert body["watermark"] == 4
+    changes_client.delete(location)
+
+
+def test_from_latest(changes_client, shards):
+    location = subscribe(changes_client, **{"from": "latest"})
+    assert names(poll(changes_client, location)) == []
+    insert(shards, "d")
+    assert names(poll(changes_client, location, "?wait=5")) == ["d"]
+    changes_client.delete(location)
+
+
+def test_long_poll_waits_for_rows(changes_client, shards):
+    location = subscribe(changes_client, **{"from": "latest"})
+    poll(changes_client, location)
+    timer = threading.Timer(0.2, insert, (shards, "e"))
+    timer.start()
+    body = poll(changes_client, location, "?wait=5")
+    timer.join()
+    assert names(body) == ["e"]
+    changes_client.delete(location)
+
+
+def test_page_size_and_rewind(changes_client):
+    location = subscribe(changes_client)
+    body = poll(changes_client, location, "?page_size=2")
+    assert names(body) == ["a", "b"]
+    assert body["truncated"] is True
+    assert names(poll(changes_client, location)) == ["c"]
+    assert names(poll(changes_client, location, "?since=1")) == ["b", "c"]
+    changes_client.delete(location)
+
+
+def test_unsubscribe(changes_client):
+    location = subscribe(changes_client)
+    assert changes_client.delete(location).status_code == 200
+    assert changes_client.get(location).status_code == 404
+
+
+@pytest.mark.parametrize("body, status", [
+    ({"sql": "SELECT id FROM items"}, 400),
+    ({"sql": "DELETE FROM items", "watermark": "id"}, 400),
+    ({"sql": "SELECT name FROM items", "watermark": "id"}, 422),
+])
+def test_invalid_subscriptions(changes_client, body, status):
+    response = changes_client.post("/changes/shard_1", json=body)
+    assert response.status_code == status
@@ -0,0 +1,114 @@
+"""Tests for coalescing identical concurrent queries."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+import threading
+
+import pytest
+
+from sql_json_bridge.config import DbConfig
+from sql_json_bridge.db_drivers.singleflight import SingleFlight
+
+
+def run_concurrently(count, func):
+    """Call `func` from `count` threads, returning their results."""
+    results = [None] * count
+
+    def run(n):
+        results[n] = func()
+
+    threads = [threading.Thread(target=run, args=(n,))
+               for n in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    return results
+
+
+def test_concurrent_calls_share_one_execution():
+    flights = SingleFlight()
+    entered = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        entered.set()
+        release.wait(5)
+        return "rows"
+
+    leader = threading.Thread(target=flights.do, args=("key", work))
+    leader.start()
+    entered.wait(5)
+    timer = threading.Timer(0.1, release.set)
+    timer.start()
+    results = run_concurrently(3, lambda: flights.do("key", work))
+    leader.join(5)
+    assert calls == [1]
+    assert results == [("rows", True)] * 3
+    assert len(flights) == 0
+
+
+def test_errors_are_shared_and_forgotten():
+    flights = SingleFlight()
+    with pytest.raises(ZeroDivisionError):
+        flights.do("key", lambda: 1 / 0)
+    assert flights.do("key", lambda: "again") == ("again", False)
+
+
+class CountingDriver(object):
+    def __init__(self):
+        self.calls = 0
+        self.release = threading.Event()
+
+    def fetch_rows(self, query_string, params=None, limit=None):
+        self.calls += 1
+        self.release.wait(5)
+        return ["n"], [(1,)], False
+
+
+def write_config(tmp_path, coalesce):
+    path = tmp_path / "db.yml"
+    path.write_text('identifier: "db"\ndriver: "sqlite"\n'
+                    'coalesce:\n    enabled: %s\n' % coalesce)
+    return DbConfig(str(path))
+
+
+def coalesced(config, sql, count=4):
+    driver = CountingDriver()
+    timer = threading.Timer(0.2, driver.release.set)
+    timer.start()
+    results = run_concurrently(
+        count, lambda: config.fetch_rows((), driver, sql))
+    timer.join()
+    return driver.calls, results
+
+
+def test_identical_reads_coalesce(tmp_path):
+    calls, results = coalesced(write_config(tmp_path, "true"),
+                               "SELECT n FROM t")
+    assert calls == 1
+    assert results == [(["n"], [(1,)], False)] * 4
+
+
+def test_writes_never_coalesce(tmp_path):
+    calls, _ = coalesced(write_config(tmp_path, "true"),
+                         "UPDATE t SET n = 1")
+    assert calls == 4
+
+
+def test_coalescing_off(tmp_path):
+    calls, _ = coalesced(write_config(tmp_path, "false"), "SELECT n FROM t")
+    assert calls == 4
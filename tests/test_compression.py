@@ -0,0 +1,91 @@
+"""Tests for response compression and ETags."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+import gzip
+import json
+
+QUERY = {"sql": "SELECT id, name FROM items"}
+
+
+def make_client(configure, database="", **settings):
+    configure(database=database, **settings)
+    from sql_json_bridge.app import create_app
+    return create_app().test_client()
+
+
+def test_gzip(configure):
+    client = make_client(configure, COMPRESSION_ENABLED=True,
+                         COMPRESSION_MIN_SIZE=0)
+    response = client.post("/query/shard_1", json=QUERY,
+                           headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    body = json.loads(gzip.decompress(response.get_data()).decode("utf-8"))
+    assert body["rows_matched"] == 3
+
+
+def test_small_responses_sent_as_is(configure):
+    client = make_client(configure, COMPRESSION_ENABLED=True)
+    response = client.post("/query/shard_1", json=QUERY,
+                           headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
+    assert response.get_json()["rows_matched"] == 3
+
+
+def test_identity_when_not_accepted(configure):
+    client = make_client(configure, COMPRESSION_ENABLED=True,
+                         COMPRESSION_MIN_SIZE=0)
+    response = client.post("/query/shard_1", json=QUERY)
+    assert "Content-Encoding" not in response.headers
+
+
+def test_streamed_gzip(configure):
+    client = make_client(configure, COMPRESSION_ENABLED=True)
+    response = client.post("/query/shard_1", json=dict(QUERY, stream=True),
+                           headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.content_length is None
+    body = json.loads(gzip.decompress(response.get_data()).decode("utf-8"))
+    assert [row["id"] for row in body["result"]] == [1, 2, 3]
+
+
+def test_compression_per_database(configure):
+    client = make_client(configure, database=(
+        "compression:\n    enabled: true\n    min_size: 0\n"))
+    response = client.post("/query/shard_1", json=QUERY,
+                           headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+
+
+def test_etag_not_modified(configure):
+    client = make_client(configure, ETAG_ENABLED=True)
+    response = client.post("/query/shard_1", json=QUERY)
+    etag = response.headers["ETag"]
+    assert etag.startswith("W/")
+    response = client.post("/query/shard_1", json=QUERY,
+                           headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.get_data() == b""
+    client.post("/update/shard_1",
+                json={"sql": "UPDATE items SET name = 'x' WHERE id = 1"})
+    response = client.post("/query/shard_1", json=QUERY,
+                           headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_no_etag_by_default(client):
+    response = client.post("/query/shard_1", json=QUERY)
+    assert "ETag" not in response.headers
@@ -0,0 +1,63 @@
+"""Tests for lazy database driver loading."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+from sql_json_bridge import db_drivers
+from sql_json_bridge.config import DbConfig
+from sql_json_bridge.db_drivers.sqlite import SQLiteDriver
+
+
+class CountingDriver(SQLiteDriver):
+    created = 0
+
+    def __init__(self, database_config):
+        super(CountingDriver, self).__init__(database_config)
+        CountingDriver.created += 1
+
+
+def write_config(tmp_path, driver, identifier="lazy_(\\\\d+)"):
+    path = tmp_path / "lazy.yml"
+    path.write_text('identifier: "%s"\ndriver: "%s"\n' % (identifier, driver))
+    return str(path)
+
+
+def test_builtin_driver_needs_no_entry_point():
+    assert db_drivers.get_db_driver_class("sqlite") is SQLiteDriver
+
+
+def test_loading_config_creates_no_driver(tmp_path):
+    # An unknown driver only fails once a query needs it.
+    config = DbConfig(write_config(tmp_path, "not-installed"))
+    assert config._driver is None
+    assert config.drivers == {}
+
+
+def test_drivers_created_on_first_use(tmp_path, monkeypatch):
+    monkeypatch.setitem(db_drivers._DRIVER_CLASSES, "counting",
+                        CountingDriver)
+    monkeypatch.setattr(CountingDriver, "created", 0)
+    config = DbConfig(write_config(tmp_path, "counting"))
+    assert CountingDriver.created == 0
+    first = config.get_driver(("1",))
+    assert isinstance(first, CountingDriver)
+    assert config.get_driver(("1",)) is first
+    assert config.get_driver(("2",)) is not first
+    assert CountingDriver.created == 2
+
+
+def test_register_db_driver(monkeypatch):
+    monkeypatch.setattr(db_drivers, "_DRIVER_CLASSES",
+                        dict(db_drivers._DRIVER_CLASSES))
+    db_drivers.register_db_driver("counting", CountingDriver)
+    assert db_drivers.get_db_driver_class("counting") is CountingDriver
@@ -0,0 +1,80 @@
+"""Tests for JSON encoders and column conversion."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+import datetime
+import decimal
+import json
+import uuid
+
+import pytest
+
+from sql_json_bridge import encoders
+
+ROW = (decimal.Decimal("1.50"), datetime.date(2016, 2, 29),
+       datetime.timedelta(days=1, seconds=61, microseconds=5), b"\x00\xff",
+       uuid.UUID(int=1), None)
+KINDS = [encoders.DECIMAL, encoders.TEMPORAL, encoders.TIMEDELTA,
+         encoders.BINARY, encoders.UUID, encoders.DECIMAL]
+EXPECTED = ["1.50", "2016-02-29", "24:01:01.000005", "AP8=",
+            "00000000-0000-0000-0000-000000000001", None]
+
+
+def available_encoders():
+    for encoder in encoders.BUILTIN_ENCODERS.values():
+        try:
+            yield encoder()
+        except ImportError:
+            continue
+
+
+@pytest.mark.parametrize("value, expected", [
+    (datetime.timedelta(hours=1), "01:00:00"),
+    (datetime.timedelta(hours=30), "30:00:00"),
+    (-datetime.timedelta(minutes=1, seconds=30), "-00:01:30"),
+])
+def test_format_timedelta(value, expected):
+    assert encoders.format_timedelta(value) == expected
+
+
+def test_default_conversions():
+    assert [encoders.default(value) for value in ROW[:-1]] == EXPECTED[:-1]
+    with pytest.raises(TypeError):
+        encoders.default(object())
+
+
+def test_columns_carry_kinds():
+    columns = encoders.Columns(["a", "b"], [encoders.DECIMAL, None])
+    assert columns == ["a", "b"]
+    assert encoders.column_kinds(columns) == [encoders.DECIMAL, None]
+    assert encoders.column_kinds(["a"]) == [None]
+
+
+def test_no_converter_without_kinds():
+    encoder = encoders.StdlibJSONEncoder()
+    assert encoder.row_converter([None, None]) is None
+
+
+@pytest.mark.parametrize("encoder", list(available_encoders()),
+                         ids=lambda encoder: encoder.name)
+def test_encoders_agree(encoder):
+    convert = encoder.row_converter(KINDS)
+    row = convert(ROW) if convert is not None else list(ROW)
+    assert json.loads(encoder.dumps([row]).decode("utf-8")) == [EXPECTED]
+
+
+def test_load_encoder():
+    assert isinstance(encoders.load_encoder("json"),
+                      encoders.StdlibJSONEncoder)
+    assert encoders.load_encoder("auto") is not None
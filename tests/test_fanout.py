@@ -0,0 +1,121 @@
+"""Tests for running one query on many databases."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from sql_json_bridge import db_drivers
+from sql_json_bridge.db_drivers.sqlite import SQLiteDriver
+from sql_json_bridge.fanout import FanOut
+
+# Runs for many seconds unless cancelled.
+SLOW_QUERY = ("WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 "
+              "FROM c WHERE x < 1000000000) SELECT sum(x) FROM c")
+
+# Many more rows than a fan-out buffers.
+MANY_ROWS = ("WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 "
+             "FROM c WHERE x < 100000) SELECT x FROM c")
+
+
+class UnsafeCancelDriver(SQLiteDriver):
+    """Records the threads `cancel` is called from."""
+
+    cancel_is_threadsafe = False
+    cancelled_from = []
+
+    def cancel(self, connection):
+        self.cancelled_from.append(threading.current_thread())
+        return super(UnsafeCancelDriver, self).cancel(connection)
+
+
+class SlowCancelDriver(SQLiteDriver):
+    """Interrupts at once, but takes a while to report back."""
+
+    order = []
+
+    def cancel(self, connection):
+        super(SlowCancelDriver, self).cancel(connection)
+        time.sleep(0.2)
+        self.order.append("cancelled")
+        return True
+
+
+class RecordingFanOut(FanOut):
+
+    def release(self, name, db, connection):
+        super(RecordingFanOut, self).release(name, db, connection)
+        SlowCancelDriver.order.append("released")
+
+
+def registry():
+    from sql_json_bridge.app import create_app
+    return create_app().config["DATABASE_REGISTRY"]
+
+
+def test_merges_databases(configure):
+    executor = ThreadPoolExecutor(2)
+    fanout = FanOut(registry(), ["shard_1", "shard_2"],
+                    "SELECT name FROM items", None, executor, 10)
+    events = list(fanout.events())
+    done = [item for item in events if item[0] == "done"]
+    assert sorted(item[1] for item in done) == ["shard_1", "shard_2"]
+    assert all(item[2] == (3, False) for item in done)
+    assert fanout.running == {}
+
+
+def test_deadline_cancels_running_query(configure):
+    executor = ThreadPoolExecutor(1)
+    fanout = FanOut(registry(), ["shard_1"], SLOW_QUERY, None, executor,
+                    0.2)
+    assert list(fanout.events()) == [("timeout", ["shard_1"], None)]
+    start = time.time()
+    fanout.futures[0].result(timeout=5)
+    assert time.time() - start < 1
+    assert fanout.running == {}
+
+
+def test_unsafe_cancel_left_to_worker(configure, monkeypatch):
+    monkeypatch.setitem(db_drivers._DRIVER_CLASSES, "unsafe",
+                        UnsafeCancelDriver)
+    monkeypatch.setattr(UnsafeCancelDriver, "cancelled_from", [])
+    # Overrides the driver named by the shards' template.
+    configure(database='driver: "unsafe"\n')
+    executor = ThreadPoolExecutor(1)
+    fanout = FanOut(registry(), ["shard_1"], MANY_ROWS, None, executor, 10)
+    events = fanout.events()
+    assert next(events)[0] == "columns"
+    events.close()
+    fanout.futures[0].result(timeout=5)
+    # The worker closed its own rows, cancelling on its own thread.
+    assert UnsafeCancelDriver.cancelled_from
+    assert threading.current_thread() not in (
+        UnsafeCancelDriver.cancelled_from)
+    assert fanout.running == {}
+
+
+def test_connection_held_until_cancel_finishes(configure, monkeypatch):
+    monkeypatch.setitem(db_drivers._DRIVER_CLASSES, "slow_cancel",
+                        SlowCancelDriver)
+    monkeypatch.setattr(SlowCancelDriver, "order", [])
+    configure(database='driver: "slow_cancel"\n')
+    executor = ThreadPoolExecutor(1)
+    fanout = RecordingFanOut(registry(), ["shard_1"], SLOW_QUERY, None,
+                             executor, 0.2)
+    assert list(fanout.events()) == [("timeout", ["shard_1"], None)]
+    fanout.futures[0].result(timeout=5)
+    assert SlowCancelDriver.order == ["cancelled", "released"]
@@ -0,0 +1,78 @@
+"""Tests for result formats and content negotiation."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import json
+
+import pytest
+
+SQL = "SELECT id, name FROM items ORDER BY id"
+
+
+def query(client, **kwargs):
+    return client.post("/query/shard_1", json={"sql": SQL}, **kwargs)
+
+
+def test_json_by_default(client):
+    response = query(client)
+    assert response.mimetype == "application/json"
+    assert response.headers["X-Bridge-Rows-Matched"] == "3"
+    assert response.headers["X-Bridge-Truncated"] == "false"
+
+
+def test_ndjson_from_accept(client):
+    response = query(client, headers={"Accept": "application/x-ndjson"})
+    assert response.mimetype == "application/x-ndjson"
+    lines = response.get_data(as_text=True).splitlines()
+    assert [json.loads(line) for line in lines] == [
+        {"id": 1, "name": "a"}, {"id": 2, "name": "b"},
+        {"id": 3, "name": "c"},
+    ]
+
+
+def test_columnar_from_format_parameter(client):
+    response = client.post("/query/shard_1?format=columnar",
+                           json={"sql": SQL})
+    body = response.get_json(force=True)
+    assert body["columns"] == ["id", "name"]
+    assert body["data"] == [[1, "a"], [2, "b"], [3, "c"]]
+    assert body["rows_matched"] == 3
+
+
+def test_format_parameter_wins_over_accept(client):
+    response = client.post("/query/shard_1?format=ndjson",
+                           json={"sql": SQL},
+                           headers={"Accept": "application/json"})
+    assert response.mimetype == "application/x-ndjson"
+
+
+def test_quality_values(client):
+    response = query(client, headers={
+        "Accept": "application/json;q=0.5, application/x-ndjson",
+    })
+    assert response.mimetype == "application/x-ndjson"
+
+
+def test_unacceptable_format(client):
+    response = query(client, headers={"Accept": "text/html"})
+    assert response.status_code == 406
+
+
+def test_msgpack(client):
+    msgpack = pytest.importorskip("msgpack")
+    response = query(client, headers={"Accept": "application/x-msgpack"})
+    unpacker = msgpack.Unpacker(raw=False)
+    unpacker.feed(response.get_data())
+    assert list(unpacker) == [["id", "name"], [1, "a"], [2, "b"], [3, "c"]]
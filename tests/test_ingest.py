@@ -0,0 +1,84 @@
+"""Tests for bulk load body readers and the load endpoint."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import io
+import sqlite3
+
+import pytest
+
+from sql_json_bridge.ingest import InvalidRecord, read_ndjson
+
+
+def read(body, columns=None):
+    columns, rows = read_ndjson(io.BytesIO(body), columns)
+    return columns, list(rows)
+
+
+def test_columns_from_first_object():
+    columns, rows = read(b'{"id": 1, "name": "a"}\n\n{"id": 2}\n')
+    assert columns == ["id", "name"]
+    assert rows == [(1, "a"), (2, None)]
+
+
+def test_unknown_key_names_line():
+    with pytest.raises(InvalidRecord) as e:
+        read(b'{"id": 1}\n{"id": 2, "nmae": "b"}\n')
+    assert e.value.line == 2
+    assert "nmae" in str(e.value)
+
+
+def test_unknown_key_with_given_columns():
+    with pytest.raises(InvalidRecord) as e:
+        read(b'{"id": 1, "extra": 2}\n', ["id"])
+    assert e.value.line == 1
+
+
+@pytest.mark.parametrize("line", [b"[1, 2]", b"5", b"null", b"nope"])
+def test_non_objects_rejected(line):
+    with pytest.raises(InvalidRecord) as e:
+        read(b'{"id": 1}\n' + line + b"\n")
+    assert e.value.line == 2
+
+
+def test_empty_body_rejected():
+    with pytest.raises(ValueError):
+        read(b"\n")
+
+
+def test_load_rejects_unknown_key(client, shards):
+    response = client.post(
+        "/load/shard_1/items?batch_size=1",
+        data=b'{"name": "d"}\n{"name": "e", "colour": "red"}\n',
+        content_type="application/x-ndjson",
+    )
+    assert response.status_code == 400
+    body = response.get_json()
+    assert body["ERROR"].startswith("Line 2:")
+    assert body["rows"] == 1
+    connection = sqlite3.connect(str(shards / "shard_1.db"))
+    names = [row[0] for row in connection.execute(
+        "SELECT name FROM items ORDER BY id")]
+    assert names == ["a", "b", "c", "d"]
+
+
+def test_load_inserts_rows(client):
+    response = client.post(
+        "/load/shard_1/items",
+        data=b'{"name": "d"}\n{"name": "e"}\n',
+        content_type="application/x-ndjson",
+    )
+    assert response.status_code == 200
+    assert response.get_json()["rows"] == 2
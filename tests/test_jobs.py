@@ -0,0 +1,102 @@
+"""Tests for background query jobs."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+import json
+import shutil
+import time
+
+import pytest
+
+from sql_json_bridge.extensions.jobs import (DONE, FAILED, JobQueueFull,
+                                             Spool, jobs)
+
+
+def wait(client, location):
+    """Poll a job until it finishes."""
+    for _ in range(100):
+        status = client.get(location).get_json()
+        if status["state"] not in ("queued", "running"):
+            return status
+        time.sleep(0.05)
+    raise AssertionError("Job did not finish.")
+
+
+def submit(client, sql="SELECT id FROM items ORDER BY id"):
+    response = client.post("/query/shard_1", json={"sql": sql, "job": True})
+    assert response.status_code == 202
+    return response.headers["Location"]
+
+
+def test_spool_reads_ranges_across_batches(tmp_path):
+    spool = Spool(str(tmp_path / "spool"))
+    spool.write([(n,) for n in range(3)])
+    spool.write([(n,) for n in range(3, 5)])
+    spool.finish()
+    assert spool.rows == 5
+    assert list(spool.read(2, 2)) == [(2,), (3,)]
+    assert list(spool.read(4)) == [(4,)]
+    assert list(spool.read(5)) == []
+    spool.remove()
+    assert not (tmp_path / "spool").exists()
+
+
+def test_job_result(client):
+    location = submit(client)
+    status = wait(client, location)
+    assert status["state"] == DONE
+    assert status["rows_matched"] == 3
+    response = client.get(location + "/result?offset=1&page_size=1")
+    body = json.loads(response.get_data(as_text=True))
+    assert body["result"] == [{"id": 2}]
+    assert body["truncated"] is True
+    assert body["next_offset"] == 2
+
+
+def test_failed_job(client):
+    location = submit(client, "SELECT * FROM missing")
+    status = wait(client, location)
+    assert status["state"] == FAILED
+    assert "missing" in status["ERROR"]
+    assert client.get(location + "/result").status_code == 422
+
+
+def test_spool_failure_fails_job(client):
+    shutil.rmtree(jobs.directory)
+    status = wait(client, submit(client))
+    assert status["state"] == FAILED
+    assert status["ERROR"]
+
+
+def test_cancel_job(client):
+    location = submit(client)
+    wait(client, location)
+    response = client.delete(location)
+    assert response.status_code == 200
+    assert client.get(location).status_code == 404
+
+
+def test_updates_cannot_be_jobs(client):
+    response = client.post("/update/shard_1", json={
+        "sql": "DELETE FROM items", "job": True})
+    assert response.status_code == 400
+
+
+def test_max_pending(client, monkeypatch):
+    monkeypatch.setattr(jobs, "max_pending", 0)
+    with pytest.raises(JobQueueFull):
+        jobs.submit("shard_1", None, "SELECT 1")
+    response = client.post("/query/shard_1",
+                           json={"sql": "SELECT 1", "job": True})
+    assert response.status_code == 429
@@ -0,0 +1,100 @@
+"""Tests for query timeouts and per-database concurrency limits."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+import threading
+import time
+
+import pytest
+
+from sql_json_bridge.limits import (Bulkhead, QueueFull, QueueTimeout,
+                                    load_limits)
+
+# Counts well past any timeout used here, unless cancelled.
+SLOW_QUERY = (
+    "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) "
+    "SELECT COUNT(*) AS n FROM n"
+)
+
+
+def test_load_limits_defaults_queue_to_slots():
+    limits = load_limits({"limits": {"max_concurrent": 3}})
+    assert limits["max_queue"] == 3
+    assert limits["queue_timeout"] == 5
+    assert load_limits({})["max_concurrent"] is None
+
+
+def test_bulkhead_rejects_beyond_queue():
+    bulkhead = Bulkhead(1, max_queue=0)
+    bulkhead.acquire()
+    with pytest.raises(QueueFull):
+        bulkhead.acquire()
+    bulkhead.release()
+    with bulkhead.slot():
+        assert bulkhead.active == 1
+    assert bulkhead.active == 0
+
+
+def test_bulkhead_queue_times_out():
+    bulkhead = Bulkhead(1, max_queue=1, queue_timeout=0.05)
+    bulkhead.acquire()
+    with pytest.raises(QueueTimeout):
+        bulkhead.acquire()
+    assert bulkhead.waiting == 0
+
+
+def test_bulkhead_release_wakes_waiter():
+    bulkhead = Bulkhead(1, max_queue=1, queue_timeout=5)
+    bulkhead.acquire()
+    acquired = threading.Event()
+
+    def wait():
+        bulkhead.acquire()
+        acquired.set()
+
+    thread = threading.Thread(target=wait)
+    thread.start()
+    time.sleep(0.05)
+    assert not acquired.is_set()
+    bulkhead.release()
+    thread.join(1)
+    assert acquired.is_set()
+
+
+def test_statement_timeout_cancels_query(configure):
+    configure(database="limits:\n    statement_timeout: 0.2\n")
+    from sql_json_bridge.app import create_app
+    client = create_app().test_client()
+    start = time.time()
+    response = client.post("/query/shard_1", json={"sql": SLOW_QUERY})
+    assert time.time() - start < 5
+    assert response.status_code == 422
+    assert "interrupt" in response.get_json()["ERROR"]
+    # The connection is still usable afterwards.
+    response = client.post("/query/shard_1", json={"sql": "SELECT 1 AS n"})
+    assert response.get_json()["result"] == [{"n": 1}]
+
+
+def test_full_bulkhead_answers_429(configure):
+    configure(database="limits:\n    max_concurrent: 1\n    max_queue: 0\n")
+    from sql_json_bridge.app import create_app
+    app = create_app()
+    client = app.test_client()
+    client.post("/query/shard_1", json={"sql": "SELECT 1"})
+    db = app.config["DATABASE_REGISTRY"].resolve("shard_1")
+    driver = db[0].get_driver(db[1])
+    with driver.bulkhead.slot():
+        response = client.post("/query/shard_1", json={"sql": "SELECT 1"})
+    assert response.status_code == 429
+    assert "Retry-After" in response.headers
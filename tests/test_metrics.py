@@ -0,0 +1,75 @@
+"""Tests for request metrics."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+from sql_json_bridge import metrics
+
+
+def test_counter_and_gauge():
+    counter = metrics.Counter("hits_total", "Hits.", ("path",))
+    counter.inc(("/a",))
+    counter.inc(("/a",), 2)
+    assert counter.render() == ["# HELP hits_total Hits.",
+                                "# TYPE hits_total counter",
+                                'hits_total{path="/a"} 3.0']
+    gauge = metrics.Gauge("busy", "Busy.")
+    gauge.inc()
+    gauge.dec()
+    assert gauge.render()[-1] == "busy 0.0"
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram("wait", "Wait.", buckets=(1, 5))
+    for value in (0.5, 2, 10):
+        histogram.observe((), value)
+    assert histogram.render()[2:] == [
+        'wait_bucket{le="1.0"} 1',
+        'wait_bucket{le="5.0"} 2',
+        'wait_bucket{le="+Inf"} 3',
+        "wait_sum 12.5",
+        "wait_count 3",
+    ]
+
+
+def test_label_values_escaped():
+    counter = metrics.Counter("c", "C.", ("q",))
+    counter.inc(('a"b\\',))
+    assert counter.render()[-1] == 'c{q="a\\"b\\\\"} 1.0'
+
+
+def test_server_timing_header(client):
+    response = client.post("/query/shard_1",
+                           json={"sql": "SELECT id FROM items"})
+    stages = [part.split(";")[0]
+              for part in response.headers["Server-Timing"].split(", ")]
+    assert "execute" in stages
+
+
+def test_server_timing_disabled(configure):
+    configure(METRICS_SERVER_TIMING=False)
+    from sql_json_bridge.app import create_app
+    client = create_app().test_client()
+    response = client.post("/query/shard_1",
+                           json={"sql": "SELECT id FROM items"})
+    assert "Server-Timing" not in response.headers
+
+
+def test_metrics_endpoint(client):
+    client.post("/query/shard_1", json={"sql": "SELECT id FROM items"})
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    text = response.get_data(as_text=True)
+    assert "# TYPE sql_json_bridge_requests_total counter" in text
+    assert 'database="shard_(\\\\d+)",status="200"' in text
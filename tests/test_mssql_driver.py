@@ -0,0 +1,80 @@
+"""Tests for the MSSQL driver's parameter declarations."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+import datetime
+import decimal
+import re
+
+import pytest
+
+pytest.importorskip("pymssql")
+
+from sql_json_bridge.db_drivers import mssql_driver  # noqa: E402
+
+CONFIG = {"identifier": re.compile("mssql"), "driver": "mssql",
+          "connection": {}}
+
+
+@pytest.mark.parametrize("value, expected", [
+    (True, "BIT"),
+    (1, "BIGINT"),
+    (1.5, "FLOAT"),
+    (decimal.Decimal("1.5"), "DECIMAL(38, 10)"),
+    (decimal.Decimal("123456.123"), "DECIMAL(38, 10)"),
+    (datetime.datetime(2016, 1, 1), "DATETIME2"),
+    (datetime.date(2016, 1, 1), "DATE"),
+    (b"x", "VARBINARY(8000)"),
+    (b"x" * 8001, "VARBINARY(MAX)"),
+    ("x", "NVARCHAR(4000)"),
+    ("x" * 4001, "NVARCHAR(MAX)"),
+])
+def test_sql_type(value, expected):
+    assert mssql_driver.sql_type(value) == expected
+
+
+def test_varchar_sql_type():
+    assert mssql_driver.sql_type("x", varchar=True) == "VARCHAR(8000)"
+    assert (mssql_driver.sql_type("x" * 8001, varchar=True) ==
+            "VARCHAR(MAX)")
+
+
+def test_prepare():
+    driver = mssql_driver.MSSQLDriver(dict(CONFIG))
+    statement, values = driver.prepare(
+        "SELECT * FROM t WHERE a = %s AND b = %s", [1, "x"])
+    assert statement == (
+        "EXEC sp_executesql N'SELECT * FROM t WHERE a = @P1 AND b = @P2', "
+        "N'@P1 BIGINT, @P2 NVARCHAR(4000)', @P1=%s, @P2=%s"
+    )
+    assert values == (1, "x")
+
+
+def test_prepare_named():
+    driver = mssql_driver.MSSQLDriver(dict(CONFIG))
+    statement, values = driver.prepare(
+        "SELECT * FROM t WHERE b = %(b)s AND a = %(a)s", {"a": 1, "b": 2})
+    assert statement == (
+        "EXEC sp_executesql N'SELECT * FROM t WHERE b = @b AND a = @a', "
+        "N'@a BIGINT, @b BIGINT', @a=%s, @b=%s"
+    )
+    assert values == (1, 2)
+
+
+def test_prepared_statements_cached():
+    driver = mssql_driver.MSSQLDriver(dict(CONFIG, statement_cache_size=1))
+    first = driver.prepare("SELECT %s", [1])[0]
+    assert driver.prepare("SELECT %s", [2])[0] is first
+    driver.prepare("SELECT %s", ["x"])
+    assert list(driver.statements) == [("SELECT %s", (), ("NVARCHAR(4000)",))]
@@ -0,0 +1,104 @@
+"""Tests for row limits and paging through open cursors."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+import asyncio
+import json
+
+from tests.conftest import asgi_request
+
+
+def ids(response):
+    return [row["id"] for row in response.get_json()["result"]]
+
+
+def make_client(configure, **settings):
+    configure(**settings)
+    from sql_json_bridge.app import create_app
+    return create_app().test_client()
+
+
+def test_row_limit_truncates(configure):
+    client = make_client(configure, QUERY_MAX_ROWS=2)
+    response = client.post("/query/shard_1",
+                           json={"sql": "SELECT id FROM items"})
+    assert ids(response) == [1, 2]
+    body = response.get_json()
+    assert body["rows_matched"] == 2
+    assert body["truncated"] is True
+    assert "next" not in body
+
+
+def test_database_row_limit(configure):
+    client = make_client(configure, database="limits:\n    max_rows: 1\n")
+    response = client.post("/query/shard_1",
+                           json={"sql": "SELECT id FROM items"})
+    assert ids(response) == [1]
+
+
+def test_streamed_row_limit(configure):
+    client = make_client(configure, QUERY_MAX_ROWS=2)
+    response = client.post("/query/shard_1",
+                           json={"sql": "SELECT id FROM items",
+                                 "stream": True})
+    body = json.loads(response.get_data(as_text=True))
+    assert [row["id"] for row in body["result"]] == [1, 2]
+    assert body["truncated"] is True
+
+
+def test_paging(client):
+    response = client.post("/query/shard_1", json={
+        "sql": "SELECT id FROM items ORDER BY id", "page_size": 2})
+    assert ids(response) == [1, 2]
+    token = response.get_json()["next"]
+    response = client.post("/query/shard_1", json={"cursor": token})
+    assert ids(response) == [3]
+    body = response.get_json()
+    assert body["truncated"] is False
+    assert "next" not in body
+    # Cursors are single use.
+    response = client.post("/query/shard_1", json={"cursor": token})
+    assert response.status_code == 410
+
+
+def test_cursor_bound_to_database(client):
+    response = client.post("/query/shard_1", json={
+        "sql": "SELECT id FROM items", "page_size": 1})
+    token = response.get_json()["next"]
+    response = client.post("/query/shard_2", json={"cursor": token})
+    assert response.status_code == 410
+
+
+def test_invalid_page_size(client):
+    response = client.post("/query/shard_1", json={
+        "sql": "SELECT id FROM items", "page_size": 0})
+    assert response.status_code == 400
+
+
+def test_asgi_row_limit(configure):
+    configure(QUERY_MAX_ROWS=2)
+    from sql_json_bridge.aio.app import create_asgi_app
+    app = create_asgi_app()
+    try:
+        status, _, body = asgi_request(
+            app, "POST", "/query/shard_1",
+            body=json.dumps({"sql": "SELECT * FROM items"}).encode("utf-8"),
+            headers=[(b"content-type", b"application/json")],
+        )
+    finally:
+        asyncio.run(app.close())
+    body = json.loads(body.decode("utf-8"))
+    assert status == 200
+    assert len(body["result"]) == 2
+    assert body["truncated"] is True
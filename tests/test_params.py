@@ -0,0 +1,61 @@
+"""Tests for bind parameters on the query endpoints."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+import sqlite3
+
+
+def test_positional_params(client):
+    response = client.post("/query/shard_1", json={
+        "sql": "SELECT name FROM items WHERE id > ?", "params": [1]})
+    assert response.status_code == 200
+    assert response.get_json()["result"] == [{"name": "b"}, {"name": "c"}]
+
+
+def test_named_params(client):
+    response = client.post("/query/shard_1", json={
+        "sql": "SELECT id FROM items WHERE name = :name",
+        "params": {"name": "c"}})
+    assert response.get_json()["result"] == [{"id": 3}]
+
+
+def test_params_are_not_interpolated(client):
+    response = client.post("/query/shard_1", json={
+        "sql": "SELECT COUNT(*) AS n FROM items WHERE name = ?",
+        "params": ["a' OR '1'='1"]})
+    assert response.get_json()["result"] == [{"n": 0}]
+
+
+def test_invalid_params(client):
+    response = client.post("/query/shard_1", json={
+        "sql": "SELECT 1", "params": "a"})
+    assert response.status_code == 400
+
+
+def test_executemany(client, shards):
+    response = client.post("/update/shard_2", json={
+        "sql": "INSERT INTO items (name) VALUES (?)",
+        "many": [["d"], ["e"]]})
+    assert response.status_code == 200
+    assert response.get_json()["rows_matched"] == 2
+    connection = sqlite3.connect(str(shards / "shard_2.db"))
+    names = [row[0] for row in connection.execute(
+        "SELECT name FROM items ORDER BY id")]
+    assert names == ["a", "b", "c", "d", "e"]
+
+
+def test_invalid_many(client):
+    response = client.post("/update/shard_2", json={
+        "sql": "INSERT INTO items (name) VALUES (?)", "many": [["d"], None]})
+    assert response.status_code == 400
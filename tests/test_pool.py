@@ -0,0 +1,125 @@
+"""Tests for the connection pool."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import re
+import time
+
+import pytest
+
+from sql_json_bridge.db_drivers.base import DatabaseDriver
+from sql_json_bridge.db_drivers.pool import ConnectionPool, PoolTimeout
+
+
+class FakeConnection(object):
+
+    def __init__(self):
+        self.closed = False
+        self.rollbacks = 0
+
+    def close(self):
+        self.closed = True
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+def make_pool(**options):
+    connections = []
+
+    def factory():
+        connections.append(FakeConnection())
+        return connections[-1]
+    return ConnectionPool(factory, **options), connections
+
+
+def test_acquire_times_out_when_exhausted():
+    pool, _ = make_pool(max_size=1, wait_timeout=0.05)
+    pool.acquire()
+    start = time.time()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    assert time.time() - start >= 0.05
+
+
+def test_release_wakes_waiter():
+    pool, _ = make_pool(max_size=1, wait_timeout=1)
+    first = pool.acquire()
+    pool.release(first)
+    assert pool.acquire() is first
+
+
+def test_release_discard_closes_and_frees_slot():
+    pool, connections = make_pool(max_size=1, wait_timeout=0.05)
+    first = pool.acquire()
+    pool.release(first, discard=True)
+    assert first.closed
+    assert pool.size == 0
+    second = pool.acquire()
+    assert second is not first
+    assert len(connections) == 2
+
+
+def test_failed_reset_discards():
+    def reset(connection):
+        raise RuntimeError("broken")
+    pool, _ = make_pool(reset=reset)
+    connection = pool.acquire()
+    pool.release(connection)
+    assert connection.closed
+    assert pool.size == 0
+
+
+def test_unhealthy_connection_is_replaced():
+    pool, _ = make_pool(check=lambda connection: False)
+    first = pool.acquire()
+    pool.release(first)
+    second = pool.acquire()
+    assert first.closed
+    assert second is not first
+    assert pool.size == 1
+
+
+def test_maintain_prunes_idle_and_refills_to_min_size():
+    pool, connections = make_pool(min_size=2, idle_timeout=0.01)
+    assert pool.idle == 2
+    time.sleep(0.02)
+    pool.maintain()
+    assert all(connection.closed for connection in connections[:2])
+    assert pool.size == pool.idle == 2
+    assert len(connections) == 4
+
+
+class FakeDriver(DatabaseDriver):
+
+    def connect(self):
+        return FakeConnection()
+
+    def run_query(self, query_string, params=None):
+        return []
+
+
+def test_driver_reuses_pooled_connection():
+    driver = FakeDriver({"identifier": re.compile("fake"),
+                         "driver": "fake", "pool": {"max_size": 2}})
+    with driver.connection() as first:
+        pass
+    with driver.connection() as second:
+        assert second is first
+    # Released connections are reset before reuse.
+    assert first.rollbacks == 2
+    assert driver.pool.size == 1
+    driver.close()
+    assert first.closed
@@ -0,0 +1,121 @@
+"""Tests for stored procedure calls."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+import datetime
+import decimal
+import json
+
+import pytest
+
+from sql_json_bridge import db_drivers
+from sql_json_bridge.db_drivers.procedures import (load_proc_params,
+                                                   output_key)
+from sql_json_bridge.db_drivers.sqlite import SQLiteDriver
+from sql_json_bridge.encoders import Columns
+
+
+class ProcDriver(SQLiteDriver):
+    """Answers every call with two result sets and its output params."""
+
+    def run_stored_proc(self, proc_name, params=()):
+        if proc_name == "fails":
+            raise ValueError("No such procedure.")
+        yield Columns(["id"])
+        yield (1,)
+        yield (2,)
+        yield Columns(["when"], ["temporal"])
+        yield (datetime.date(2016, 1, 31),)
+        if proc_name == "breaks":
+            raise RuntimeError("Lost connection.")
+        yield dict((output_key(param, n), param.value)
+                   for n, param in enumerate(params) if param.output)
+
+
+@pytest.fixture
+def proc_client(configure, monkeypatch):
+    monkeypatch.setitem(db_drivers._DRIVER_CLASSES, "proc", ProcDriver)
+    # Overrides the driver named by the shards' template.
+    configure(database='driver: "proc"\n')
+    from sql_json_bridge.app import create_app
+    return create_app().test_client()
+
+
+def call(client, procedure, params=None):
+    response = client.post("/proc/shard_1", json={
+        "procedure": procedure, "params": params})
+    return response, json.loads(response.get_data(as_text=True) or "null")
+
+
+def test_load_proc_params():
+    params = load_proc_params({
+        "@amount": {"type": "decimal", "value": 1.5, "output": True},
+        "name": "a",
+        "start": {"type": "date", "value": "2016-01-31"},
+    })
+    assert [param.name for param in params] == ["amount", "name", "start"]
+    assert params[0].value == decimal.Decimal("1.5")
+    assert params[0].output
+    assert params[1].value == "a" and params[1].type is None
+    assert params[2].value == datetime.date(2016, 1, 31)
+    assert [param.name for param in load_proc_params([1, 2])] == [None,
+                                                                  None]
+
+
+@pytest.mark.parametrize("params", [
+    "a",
+    {"a": {"type": "money", "value": 1}},
+    {"a": {"type": "int", "value": "x"}},
+    {"a": {"type": "bool", "value": 1}},
+    {"a": {"type": "datetime", "value": "31/01/2016"}},
+])
+def test_invalid_proc_params(params):
+    with pytest.raises(ValueError):
+        load_proc_params(params)
+
+
+def test_unsupported_by_driver(client):
+    response, _ = call(client, "report")
+    assert response.status_code == 501
+
+
+def test_result_sets_and_output(proc_client):
+    response, body = call(proc_client, "report", [
+        {"type": "int", "value": 5, "output": True}, 7])
+    assert response.status_code == 200
+    assert [result["result"] for result in body["results"]] == [
+        [{"id": 1}, {"id": 2}], [{"when": "2016-01-31"}]]
+    assert [result["rows_matched"] for result in body["results"]] == [2, 1]
+    assert body["output"] == {"0": 5}
+
+
+def test_error_part_way_reported_in_band(proc_client):
+    response, body = call(proc_client, "breaks")
+    assert response.status_code == 200
+    assert len(body["results"]) == 2
+    assert "Lost connection" in body["ERROR"]
+    assert "output" not in body
+
+
+def test_error_starting_call(proc_client):
+    response, body = call(proc_client, "fails")
+    assert response.status_code == 400
+    assert body["ERROR"] == "No such procedure."
+
+
+def test_invalid_requests(client):
+    response, _ = call(client, None)
+    assert response.status_code == 400
+    response, _ = call(client, "report", {"a": {"type": "money"}})
+    assert response.status_code == 400
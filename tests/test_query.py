@@ -0,0 +1,63 @@
+"""Tests for running queries and updates through the flask app."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import json
+
+
+def test_query(client):
+    response = client.post("/query/shard_1",
+                           json={"sql": "SELECT id, name FROM items"})
+    assert response.status_code == 200
+    # Buffered bodies have a length; streamed ones are sent chunked.
+    assert response.content_length is not None
+    body = response.get_json()
+    assert body["result"] == [{"id": 1, "name": "a"}, {"id": 2, "name": "b"},
+                              {"id": 3, "name": "c"}]
+    assert body["rows_matched"] == 3
+
+
+def test_streamed_query(client):
+    response = client.post("/query/shard_1",
+                           json={"sql": "SELECT id FROM items",
+                                 "stream": True})
+    assert response.status_code == 200
+    assert response.content_length is None
+    body = json.loads(response.get_data(as_text=True))
+    assert [row["id"] for row in body["result"]] == [1, 2, 3]
+    assert body["rows_matched"] == 3
+
+
+def test_streamed_query_from_query_string(client):
+    response = client.get("/query/shard_1?sql=SELECT+id+FROM+items"
+                          "&stream=true")
+    assert response.content_length is None
+    assert json.loads(response.get_data(as_text=True))["rows_matched"] == 3
+
+
+def test_missing_sql(client):
+    assert client.post("/query/shard_1", json={}).status_code == 400
+
+
+def test_unknown_database(client):
+    response = client.post("/query/nope", json={"sql": "SELECT 1"})
+    assert response.status_code == 404
+
+
+def test_failed_query(client):
+    response = client.post("/query/shard_1",
+                           json={"sql": "SELECT * FROM missing"})
+    assert response.status_code == 422
+    assert "missing" in response.get_json()["ERROR"]
@@ -0,0 +1,105 @@
+"""Tests for the hot-reloadable config registry."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import os
+
+import pytest
+
+from sql_json_bridge.registry import ConfigRegistry
+
+CONFIG = """\
+identifier: "{identifier}"
+driver: "sqlite"
+connection:
+    database: "{database}"
+"""
+
+
+@pytest.fixture
+def directory(tmp_path):
+    return tmp_path
+
+
+def write(directory, name, identifier, database="/tmp/unused.db"):
+    path = directory / name
+    path.write_text(CONFIG.format(identifier=identifier, database=database))
+    return path
+
+
+def patterns(registry):
+    return sorted(identifier.pattern for identifier in registry.databases)
+
+
+def test_loads_configs(directory):
+    write(directory, "a.yml", "alpha")
+    write(directory, "b.yaml", "beta")
+    (directory / "notes.txt").write_text("ignored")
+    registry = ConfigRegistry(str(directory))
+    assert patterns(registry) == ["alpha", "beta"]
+    assert registry.resolve("alpha")[0]["identifier"].pattern == "alpha"
+
+
+def test_unchanged_reload_is_a_no_op(directory):
+    write(directory, "a.yml", "alpha")
+    registry = ConfigRegistry(str(directory))
+    snapshot = registry.snapshot
+    assert not registry.reload()
+    assert registry.snapshot is snapshot
+
+
+def test_reload_keeps_unchanged_configs(directory):
+    write(directory, "a.yml", "alpha")
+    registry = ConfigRegistry(str(directory))
+    alpha = registry.resolve("alpha")[0]
+    write(directory, "b.yml", "beta")
+    assert registry.reload()
+    assert patterns(registry) == ["alpha", "beta"]
+    assert registry.resolve("alpha")[0] is alpha
+
+
+def test_reload_picks_up_changes_and_removals(directory):
+    write(directory, "a.yml", "alpha")
+    write(directory, "b.yml", "beta")
+    registry = ConfigRegistry(str(directory))
+    write(directory, "a.yml", "alpha_renamed")
+    os.remove(str(directory / "b.yml"))
+    assert registry.reload()
+    assert patterns(registry) == ["alpha_renamed"]
+    assert registry.resolve("alpha") is None
+
+
+def test_broken_file_keeps_previous_config(directory):
+    write(directory, "a.yml", "alpha")
+    registry = ConfigRegistry(str(directory))
+    (directory / "a.yml").write_text("identifier: [unclosed\n")
+    registry.reload()
+    assert patterns(registry) == ["alpha"]
+
+
+def test_listeners_called_on_change(directory):
+    write(directory, "a.yml", "alpha")
+    registry = ConfigRegistry(str(directory))
+    calls = []
+    registry.add_listener(lambda: calls.append(1))
+    registry.reload()
+    assert calls == []
+    write(directory, "b.yml", "beta")
+    registry.reload()
+    assert calls == [1]
+
+
+def test_list_endpoint_reads_registry(configure, client):
+    assert client.get("/list").get_json() == {"databases": ["shard_(\\d+)"]}
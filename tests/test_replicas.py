@@ -0,0 +1,140 @@
+"""Tests for read replica routing and health checks."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+import re
+import sqlite3
+
+import pytest
+
+from sql_json_bridge.db_drivers.replicas import (NoReplicaAvailable,
+                                                 ReplicaSet,
+                                                 load_replica_options)
+
+
+@pytest.fixture
+def replica_db(shards):
+    path = shards / "replica.db"
+    connection = sqlite3.connect(str(path))
+    connection.executescript(
+        "CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT);"
+        "INSERT INTO items (name) VALUES ('replica');"
+    )
+    connection.commit()
+    connection.close()
+    return path
+
+
+def replica_set(tmp_path, replicas, **policy):
+    policy.setdefault("check_interval", 0)
+    return ReplicaSet({
+        "identifier": re.compile("db"),
+        "driver": "sqlite",
+        "connection": {"database": str(tmp_path / "primary.db")},
+        "replicas": replicas,
+        "replica_policy": policy,
+    })
+
+
+def names(replicas, count):
+    chosen = [replicas.choose() for _ in range(count)]
+    by_driver = dict((replica.driver, replica.name)
+                     for replica in replicas.replicas)
+    return [by_driver[driver] for driver in chosen]
+
+
+def test_unknown_balance_policy():
+    with pytest.raises(ValueError):
+        load_replica_options({"replica_policy": {"balance": "random"}})
+
+
+def test_replica_connection_merged_over_primary(tmp_path):
+    replicas = replica_set(tmp_path, [
+        {"name": "r1", "connection": {"timeout": 1}}])
+    config = replicas.replicas[0].driver.config
+    assert config["connection"] == {
+        "database": str(tmp_path / "primary.db"), "timeout": 1}
+    assert config["driver"] == "sqlite"
+
+
+def test_weighted_round_robin(tmp_path):
+    replicas = replica_set(tmp_path, [
+        {"name": "a", "weight": 2, "connection": {}},
+        {"name": "b", "connection": {}},
+    ], balance="round_robin")
+    assert names(replicas, 6) == ["a", "b", "a", "a", "b", "a"]
+
+
+def test_ejection_and_readmission(tmp_path):
+    replicas = replica_set(tmp_path, [
+        {"name": "a", "connection": {}},
+        {"name": "b", "connection": {}},
+    ], eject_after=2, readmit_after=1)
+    a, b = replicas.replicas
+    for _ in range(2):
+        replicas._failed(a, RuntimeError("down"))
+    assert not a.healthy
+    assert names(replicas, 3) == ["b", "b", "b"]
+    replicas.check()
+    assert a.healthy
+
+
+def test_failed_check_counts_against_replica(tmp_path):
+    replicas = replica_set(tmp_path, [{"name": "a", "connection": {
+        "database": str(tmp_path / "missing" / "replica.db")}}],
+        eject_after=1)
+    replicas.check()
+    assert not replicas.replicas[0].healthy
+
+
+def test_lagging_replica_skipped(tmp_path):
+    replicas = replica_set(tmp_path, [
+        {"name": "a", "connection": {}},
+        {"name": "b", "connection": {}},
+    ], max_lag=5)
+    replicas.replicas[0].lag = 10
+    assert names(replicas, 2) == ["b", "b"]
+
+
+def test_fallback_to_primary(tmp_path):
+    replicas = replica_set(tmp_path, [{"name": "a", "connection": {}}],
+                           eject_after=1)
+    replicas._failed(replicas.replicas[0], RuntimeError("down"))
+    assert replicas.choose() is None
+    replicas.options["fallback_to_primary"] = False
+    with pytest.raises(NoReplicaAvailable):
+        replicas.choose()
+
+
+def test_reads_go_to_replica(configure, replica_db):
+    configure(database=(
+        "replicas:\n"
+        "    - connection:\n"
+        "          database: \"%s\"\n"
+        "replica_policy:\n"
+        "    check_interval: 0\n" % replica_db
+    ))
+    from sql_json_bridge.app import create_app
+    client = create_app().test_client()
+    sql = {"sql": "SELECT name FROM items WHERE id = 1"}
+    response = client.post("/query/shard_1", json=sql)
+    assert response.get_json()["result"] == [{"name": "replica"}]
+    response = client.post("/query/shard_1", json=sql,
+                           headers={"X-Bridge-Read": "primary"})
+    assert response.get_json()["result"] == [{"name": "a"}]
+    response = client.post("/update/shard_1", json={
+        "sql": "UPDATE items SET name = 'x' WHERE id = 1"})
+    assert response.status_code == 200
+    response = client.post("/query/shard_1", json=sql)
+    assert response.get_json()["result"] == [{"name": "replica"}]
@@ -0,0 +1,73 @@
+"""Tests for routing database names to their configs."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import re
+
+from collections import OrderedDict
+
+from sql_json_bridge.router import MAX_GROUPS_PER_PATTERN, DatabaseRouter
+
+
+def router(*patterns, **kwargs):
+    return DatabaseRouter(OrderedDict(
+        (re.compile(pattern), "config:%s" % pattern) for pattern in patterns
+    ), **kwargs)
+
+
+def test_literal():
+    assert router("reports", "shard_(\\d+)").resolve("reports") == (
+        "config:reports", ()
+    )
+
+
+def test_regex_groups():
+    assert router("reports", "shard_(\\d+)_(\\w+)").resolve("shard_7_eu") == (
+        "config:shard_(\\d+)_(\\w+)", ("7", "eu")
+    )
+
+
+def test_first_matching_pattern_wins():
+    routes = router("db_(\\d+)", "db_(\\w+)")
+    assert routes.resolve("db_12") == ("config:db_(\\d+)", ("12",))
+    assert routes.resolve("db_xy") == ("config:db_(\\w+)", ("xy",))
+
+
+def test_miss():
+    assert router("shard_(\\d+)").resolve("nope") is None
+
+
+def test_many_patterns_split_across_alternations():
+    patterns = ["p%d_(\\d+)_(\\d+)" % n
+                for n in range(MAX_GROUPS_PER_PATTERN)]
+    routes = router(*patterns)
+    assert len(routes.matchers) > 1
+    assert routes.resolve("p80_1_2") == ("config:p80_(\\d+)_(\\d+)",
+                                         ("1", "2"))
+
+
+def test_backreference_matched_alone():
+    routes = router("(a+)_\\1", "b_(\\d+)")
+    assert routes.resolve("aa_aa") == ("config:(a+)_\\1", ("aa",))
+    assert routes.resolve("aa_a") is None
+    assert routes.resolve("b_3") == ("config:b_(\\d+)", ("3",))
+
+
+def test_resolutions_memoized_and_bounded():
+    routes = router("shard_(\\d+)", cache_size=2)
+    for name in ("shard_1", "shard_2", "nope"):
+        routes.resolve(name)
+    assert list(routes._cache) == ["shard_2", "nope"]
+    assert routes.resolve("nope") is None
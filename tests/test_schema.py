@@ -0,0 +1,106 @@
+"""Tests for the schema endpoint and cache."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+import pytest
+
+from sql_json_bridge.extensions.schema import Schema, schema_cache
+
+TABLES = [
+    {"schema": "dbo", "name": "Orders"},
+    {"schema": "dbo", "name": "order_lines"},
+    {"schema": "sales", "name": "customers"},
+]
+
+
+@pytest.fixture(autouse=True)
+def empty_schema_cache():
+    for name in schema_cache.names():
+        schema_cache.invalidate(name)
+    yield
+    for name in schema_cache.names():
+        schema_cache.invalidate(name)
+
+
+def names(tables):
+    return [table["name"] for table in tables]
+
+
+def test_filter():
+    schema = Schema(TABLES)
+    assert names(schema.filter("order*")) == ["Orders", "order_lines"]
+    assert names(schema.filter("SALES.*")) == ["customers"]
+    assert names(schema.filter(schema="dbo")) == ["Orders", "order_lines"]
+    assert names(schema.filter("c*", schema="dbo")) == []
+
+
+def test_schema(client):
+    response = client.get("/schema/shard_1")
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["database"] == "shard_1"
+    [table] = body["tables"]
+    assert table["name"] == "items"
+    assert [column["name"] for column in table["columns"]] == ["id", "name"]
+    response = client.get("/schema/shard_1?table=other")
+    assert response.get_json()["tables"] == []
+
+
+def test_schema_cached_until_refresh(client):
+    loaded = client.get("/schema/shard_1").get_json()["loaded"]
+    assert client.get("/schema/shard_1").get_json()["loaded"] == loaded
+    assert schema_cache.names() == ["shard_1"]
+    cached = schema_cache.cached("shard_1")
+    client.get("/schema/shard_1", headers={"X-Bridge-Cache": "refresh"})
+    assert schema_cache.cached("shard_1") is not cached
+
+
+def test_ddl_invalidates_schema(client):
+    client.get("/schema/shard_1")
+    client.post("/update/shard_1",
+                json={"sql": "CREATE TABLE extra (id INTEGER)"})
+    assert schema_cache.cached("shard_1") is None
+    body = client.get("/schema/shard_1").get_json()
+    assert names(body["tables"]) == ["extra", "items"]
+
+
+def test_ttl_per_database(configure):
+    configure(database="schema:\n    ttl: 0\n")
+    from sql_json_bridge.app import create_app
+    client = create_app().test_client()
+    client.get("/schema/shard_1")
+    cached = schema_cache.cached("shard_1")
+    client.get("/schema/shard_1")
+    assert schema_cache.cached("shard_1") is not cached
+
+
+def test_least_recently_used_dropped(configure):
+    configure(SCHEMA_CACHE_MAX_DATABASES=1)
+    from sql_json_bridge.app import create_app
+    client = create_app().test_client()
+    client.get("/schema/shard_1")
+    client.get("/schema/shard_2")
+    assert schema_cache.names() == ["shard_2"]
+
+
+def test_options_list_cached_tables(client):
+    client.get("/schema/shard_2")
+    [option] = client.open("/query", method="OPTIONS").get_json()
+    assert option["tables"] == {"shard_2": ["main.items"]}
+    assert "/schema/shard_2" in [endpoint["endpoint_url"]
+                                 for endpoint in option["endpoints"]]
+
+
+def test_unknown_database(client):
+    assert client.get("/schema/nope").status_code == 404
@@ -0,0 +1,93 @@
+"""Tests for the SQLite driver and the benchmark helpers."""
+# Copyright (C) 2016 Russell Troxel
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+import re
+import threading
+
+import pytest
+
+from benchmarks.common import compare, percentile
+from sql_json_bridge.db_drivers.sqlite import SQLiteDriver, to_qmark
+
+
+@pytest.fixture
+def driver(shards):
+    driver = SQLiteDriver({
+        "identifier": re.compile("shard_1"),
+        "driver": "sqlite",
+        "connection": {"database": str(shards / "shard_1.db")},
+    })
+    yield driver
+    driver.close()
+
+
+def test_to_qmark():
+    assert to_qmark("a = %s AND b = %(b)s") == "a = ? AND b = :b"
+    assert to_qmark("LIKE 'a%%'") == "LIKE 'a%'"
+
+
+def test_run_query(driver):
+    assert driver.run_query("SELECT name FROM items WHERE id = %s",
+                            [2]) == [{"name": "b"}]
+    assert driver.run_query("SELECT id FROM items WHERE name = %(name)s",
+                            {"name": "c"}) == [{"id": 3}]
+
+
+def test_stream_rows(driver):
+    columns, rows = driver.stream_rows("SELECT id, name FROM items")
+    assert list(columns) == ["id", "name"]
+    assert list(rows) == [(1, "a"), (2, "b"), (3, "c")]
+
+
+def test_cancel_interrupts_from_another_thread(driver):
+    with driver.connection() as connection:
+        timer = threading.Timer(0.1, driver.cancel, (connection,))
+        timer.start()
+        with pytest.raises(Exception) as e:
+            connection.execute(
+                "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL "
+                "SELECT i + 1 FROM n) SELECT COUNT(*) FROM n"
+            ).fetchall()
+        timer.join()
+    assert "interrupt" in str(e.value)
+
+
+def test_introspect(driver):
+    [table] = driver.introspect()
+    assert table["name"] == "items"
+    assert [column["name"] for column in table["columns"]] == ["id", "name"]
+    assert table["columns"][0]["nullable"] is False
+
+
+def test_max_insert_rows(driver):
+    assert driver.max_insert_rows(1) == 999
+    assert driver.max_insert_rows(10) == 99
+
+
+def test_percentile():
+    assert percentile([], 0.5) is None
+    assert percentile([1, 2, 3, 4, 5], 0.5) == 3
+    assert percentile([1, 2, 3, 4, 5], 0.99) == 5
+
+
+def test_compare_flags_regressions():
+    baseline = {"results": {"query_s": 1.0, "rows_per_s": 100.0,
+                            "errors": 0}}
+    assert compare({"query_s": 1.1, "rows_per_s": 95.0, "errors": 0},
+                   baseline, 0.2) == []
+    regressions = compare({"query_s": 1.5, "rows_per_s": 50.0,
+                           "errors": 2}, baseline, 0.2)
+    assert [metric for metric, _, _, _ in regressions] == [
+        "errors", "query_s", "rows_per_s"]